@@ -0,0 +1,490 @@
+"""Offline microbenchmarks for every pipeline stage
+
+Runs on CPU without network access. Stylization is measured against a local
+stub of the NVIDIA NIM API. Results can be saved as a baseline and later runs
+compared against it; the script exits with status 1 when a stage regresses
+past the threshold. Two memory figures are reported: the peak tracemalloc
+sees (Python and NumPy allocations only), and how far the stage raised the
+process's peak resident set size (ru_maxrss), which also counts Pillow, OpenCV
+and torch buffers. The RSS peak never goes down, so a stage that stays below
+an earlier stage's peak shows 0.
+
+Usage:
+    python benchmark.py                         # run all stages
+    python benchmark.py --save-baseline         # store results as the baseline
+    python benchmark.py --stages compositing,mask --iterations 50
+    python benchmark.py --images ./samples      # add real photos to the synthetic set
+    python benchmark.py --stages detection --detectors yunet,onnx
+    python benchmark.py --stages local --local-model hf-internal-testing/tiny-stable-diffusion-pipe
+
+Detection is run once per detector backend. Accuracy is the IoU of the best
+detection against the known face box of the synthetic photos; sample photos
+have no ground truth and are scored against the first backend that loads.
+
+The "local" stage (not run by default) times the local diffusers pipeline
+with the LOCAL_* settings from the environment; it needs diffusers, torch and
+the model in the Hugging Face cache or a local directory.
+"""
+
+import os
+import io
+import sys
+import json
+import time
+import base64
+import argparse
+import threading
+import tracemalloc
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE = os.path.join(BACKEND_DIR, "benchmark_baseline.json")
+DEFAULT_RESOLUTIONS = "640x480,1920x1080,4000x3000"
+ALL_STAGES = ("detection", "mask", "compositing", "encoding", "stylization")
+OPTIONAL_STAGES = ("local",)
+DEFAULT_DETECTORS = "mtcnn,yunet,onnx"
+
+
+class StubNimHandler(BaseHTTPRequestHandler):
+    """Answers NIM generation requests with a fixed image after a configurable delay"""
+
+    # Keep-alive like the real API - HTTP/1.0 would close every connection and
+    # hide the connection reuse being measured (every response needs a Content-Length)
+    protocol_version = "HTTP/1.1"
+    response_body = b"{}"
+    latency = 0.0
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        self.rfile.read(length)
+        if self.latency:
+            time.sleep(self.latency)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(self.response_body)))
+        self.end_headers()
+        self.wfile.write(self.response_body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_nim(latency_ms):
+    """Start the stub NIM server on a free port and return (server, base_url)"""
+    from PIL import Image
+
+    buf = io.BytesIO()
+    Image.new("RGB", (1024, 1024), (230, 180, 160)).save(buf, format="PNG")
+    StubNimHandler.response_body = json.dumps({"image": base64.b64encode(buf.getvalue()).decode("ascii")}).encode("utf-8")
+    StubNimHandler.latency = latency_ms / 1000.0
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubNimHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def synthetic_face_box(width, height):
+    """Ground-truth (x1, y1, x2, y2) of the face drawn by synthetic_photo"""
+    face_w, face_h = width // 4, int(height // 2.5)
+    cx, cy = width // 2, height // 2
+    return (cx - face_w // 2, cy - face_h // 2, cx + face_w // 2, cy + face_h // 2)
+
+
+def synthetic_photo(width, height):
+    """A photo-sized image with a face-like shape (background, skin oval, eyes, mouth)"""
+    from PIL import Image, ImageDraw, ImageFilter
+
+    img = Image.new("RGB", (width, height), (90, 120, 150))
+    draw = ImageDraw.Draw(img)
+    face_w, face_h = width // 4, int(height // 2.5)
+    cx, cy = width // 2, height // 2
+    draw.ellipse(list(synthetic_face_box(width, height)), fill=(224, 172, 140))
+    eye_r = max(2, face_w // 14)
+    for dx in (-face_w // 5, face_w // 5):
+        draw.ellipse([cx + dx - eye_r, cy - face_h // 8 - eye_r, cx + dx + eye_r, cy - face_h // 8 + eye_r], fill=(40, 30, 30))
+    draw.rectangle([cx - face_w // 6, cy + face_h // 5, cx + face_w // 6, cy + face_h // 5 + max(2, face_h // 30)], fill=(150, 60, 60))
+    return img.filter(ImageFilter.GaussianBlur(radius=max(1, width // 800)))
+
+
+def load_images(resolutions, images_dir=None):
+    """Return [(label, PIL Image, face box or None)] of synthetic photos plus any sample photos"""
+    from PIL import Image
+
+    images = []
+    for resolution in resolutions:
+        width, height = (int(v) for v in resolution.lower().split("x"))
+        images.append((f"{width}x{height}", synthetic_photo(width, height), synthetic_face_box(width, height)))
+    if images_dir:
+        for name in sorted(os.listdir(images_dir)):
+            if name.lower().endswith((".jpg", ".jpeg", ".png", ".webp")):
+                img = Image.open(os.path.join(images_dir, name)).convert("RGB")
+                images.append((f"{name}@{img.width}x{img.height}", img, None))
+    return images
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def max_rss():
+    """Peak resident set size of this process so far, in bytes (None where unavailable)"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024  # Bytes on macOS, KiB on Linux
+
+
+def measure(func, iterations, warmup=1):
+    """Time func() and return latency percentiles (ms), throughput and peak memory"""
+    rss_before = max_rss()
+    for _ in range(warmup):
+        func()
+
+    tracemalloc.start()
+    timings = []
+    started = time.perf_counter()
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - t0) * 1000.0)
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return summarize(timings, elapsed, peak, rss_before=rss_before)
+
+
+def summarize(timings, elapsed, peak, ops_per_iteration=1, rss_before=None):
+    """
+    Latency percentiles (ms), throughput and memory of a run
+
+    Args:
+        peak: Peak tracemalloc bytes during the run
+        rss_before: max_rss() before the run (warm-up included), for the RSS growth
+    """
+    rss_after = max_rss()
+    return {
+        "iterations": len(timings),
+        "p50_ms": round(percentile(timings, 50), 3),
+        "p95_ms": round(percentile(timings, 95), 3),
+        "p99_ms": round(percentile(timings, 99), 3),
+        "mean_ms": round(sum(timings) / len(timings), 3),
+        "throughput_per_s": round(len(timings) * ops_per_iteration / elapsed, 2) if elapsed else 0.0,
+        "peak_traced_mb": round(peak / (1024 * 1024), 2),
+        "max_rss_mb": round(rss_after / (1024 * 1024), 2) if rss_after is not None else None,
+        "rss_growth_mb": round((rss_after - rss_before) / (1024 * 1024), 2) if rss_before is not None else None,
+    }
+
+
+def iou(a, b):
+    """Intersection over union of two (x1, y1, x2, y2) boxes"""
+    ix = max(0.0, min(a[2], b[2]) - max(a[0], b[0]))
+    iy = max(0.0, min(a[3], b[3]) - max(a[1], b[1]))
+    inter = ix * iy
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def best_face_box(detector, img):
+    """Most confident raw detection box (before the crop margin), or None"""
+    from config import DETECTION_MAX_SIDE
+
+    boxes, probs, _ = detector._detect_on_proxy(img, DETECTION_MAX_SIDE)
+    if boxes is None or len(boxes) == 0:
+        return None
+    best = max(range(len(probs)), key=lambda i: probs[i])
+    return tuple(float(v) for v in boxes[best])
+
+
+def bench_detection(images, iterations, results, backends):
+    from face_detection import FaceDetector
+
+    reference = {}  # Boxes of the first backend that loads, for photos without ground truth
+    for backend in backends:
+        try:
+            detector = FaceDetector(device="cpu", backend=backend)
+            detector.load()
+        except Exception as e:
+            print(f"⚠ Skipping detector backend {backend}: {e}")
+            continue
+
+        for label, img, truth in images:
+            box = best_face_box(detector, img)
+            if truth is None and label not in reference:
+                reference[label] = box
+            expected = truth if truth is not None else reference.get(label)
+
+            def run():
+                try:
+                    detector.detect_and_align(img)
+                except ValueError:
+                    pass  # Still measures the full detection pass
+
+            key = f"detection_{backend}@{label}"
+            results[key] = measure(run, iterations)
+            results[key]["face_found"] = box is not None
+            if expected is not None:
+                results[key]["iou"] = round(iou(box, expected), 3) if box is not None else 0.0
+
+
+def print_detection_summary(results):
+    """Speed/accuracy trade-off per detector backend"""
+    backends = {}
+    for key, r in results.items():
+        if key.startswith("detection_"):
+            backends.setdefault(key[len("detection_"):].split("@")[0], []).append(r)
+    if not backends:
+        return
+    print(f"\n{'detector':12s} {'mean p50':>10s} {'found':>8s} {'mean IoU':>9s}")
+    for backend, rows in sorted(backends.items()):
+        p50 = sum(r["p50_ms"] for r in rows) / len(rows)
+        found = sum(1 for r in rows if r["face_found"])
+        scored = [r["iou"] for r in rows if "iou" in r]
+        mean_iou = f"{sum(scored) / len(scored):9.3f}" if scored else f"{'-':>9s}"
+        print(f"{backend:12s} {p50:8.2f}ms {found:>4d}/{len(rows):<3d} {mean_iou}")
+
+
+def bench_mask(iterations, results):
+    from compositing import feathered_mask
+
+    for size in (256, 768):
+        for shape in ("rect", "ellipse"):
+            def cold():
+                feathered_mask.cache_clear()
+                feathered_mask(size, size, 20, shape)
+
+            results[f"mask_{shape}@{size}"] = measure(cold, iterations)
+    feathered_mask.cache_clear()
+    results["mask_cached@768"] = measure(lambda: feathered_mask(768, 768, 20, "rect"), iterations)
+
+
+def bench_compositing(iterations, results):
+    import tempfile
+    from PIL import Image
+    from compositing import TemplateCompositor
+    from template_store import MappedTemplateStore
+
+    face = synthetic_photo(768, 768)
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in (1024, 2480):  # Screen page and A4 @ 300 dpi
+            template_path = os.path.join(tmp, f"page{size}.png")
+            Image.new("RGB", (size, int(size * 1.414)), (250, 240, 220)).save(template_path)
+            compositor = TemplateCompositor(template_path=template_path)
+            compositor.registry.store = MappedTemplateStore(os.path.join(tmp, "store"))
+            bbox = (100, 100, 600, 600)
+            results[f"compositing@{size}"] = measure(lambda: compositor.composite(face, bbox), iterations)
+
+            # Cost of (re)loading a template: PNG decode vs mapping the converted file
+            registry = compositor.registry
+            for label, store in (("decode", None), ("mapped", registry.store)):
+                def load():
+                    registry.invalidate()
+                    registry.get(template_path)
+
+                registry.store = store
+                results[f"template_load_{label}@{size}"] = measure(load, iterations)
+        missing = os.path.join(tmp, "missing.png")
+        compositor = TemplateCompositor(template_path=missing)
+        results["compositing@fallback"] = measure(lambda: compositor.composite(face), iterations)
+
+
+def bench_encoding(iterations, results):
+    from encoding import MEDIA_TYPES, ENCODING_PRESETS, encode_image
+
+    for size in (1024, 2480):
+        img = synthetic_photo(size, int(size * 1.414))
+        for fmt in MEDIA_TYPES:
+            for preset in ENCODING_PRESETS:
+                sizes = {}
+
+                def run():
+                    sizes["bytes"] = len(encode_image(img, fmt, preset=preset))
+
+                key = f"encoding_{fmt.lower()}_{preset}@{size}"
+                results[key] = measure(run, iterations)
+                results[key]["output_bytes"] = sizes["bytes"]
+
+
+def bench_stylization(iterations, concurrency, results):
+    import asyncio
+    from stylization import FaceStylizer
+
+    stylizer = FaceStylizer()
+    face = synthetic_photo(768, 768)
+    results["stylization_sync@stub"] = measure(lambda: stylizer.stylize_face(face), iterations)
+
+    async def burst():
+        await asyncio.gather(*(stylizer.stylize_face_async(face) for _ in range(concurrency)))
+
+    async def run_async():
+        rss_before = max_rss()
+        await burst()  # Warm up the connection pool
+        timings = []
+        tracemalloc.start()
+        started = time.perf_counter()
+        for _ in range(iterations):
+            t0 = time.perf_counter()
+            await burst()
+            timings.append((time.perf_counter() - t0) * 1000.0)
+        elapsed = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        await stylizer.aclose()
+        summary = summarize(timings, elapsed, peak, ops_per_iteration=concurrency, rss_before=rss_before)
+        summary["concurrency"] = concurrency
+        return summary
+
+    results[f"stylization_async_x{concurrency}@stub"] = asyncio.run(run_async())
+
+
+def bench_local_stylization(iterations, results):
+    import diffusers  # noqa: F401 - skip the stage cleanly when diffusers is missing
+    from config import FACE_CROP_SIZE
+    from local_diffusion import LocalDiffusionPipeline, working_size
+
+    pipeline = LocalDiffusionPipeline()
+    started = time.perf_counter()
+    pipeline.load()
+    load_ms = (time.perf_counter() - started) * 1000.0
+
+    face = synthetic_photo(FACE_CROP_SIZE, FACE_CROP_SIZE)
+    width, height = working_size(face.size, pipeline.resolution)
+    key = f"local_{pipeline.scheduler}_{pipeline.steps}steps@{width}x{height}"
+    results[key] = measure(lambda: pipeline(face, "cartoon portrait", "photo"), iterations)
+    results[key]["load_ms"] = load_ms
+
+
+def compare(results, baseline, threshold):
+    """Return a list of regression messages (p50 slower than baseline by more than threshold)"""
+    regressions = []
+    for key, current in sorted(results.items()):
+        previous = baseline.get(key)
+        if not previous or not previous.get("p50_ms"):
+            continue
+        ratio = current["p50_ms"] / previous["p50_ms"]
+        marker = ""
+        if ratio > 1.0 + threshold:
+            marker = "  <-- REGRESSION"
+            regressions.append(f"{key}: p50 {previous['p50_ms']:.2f} ms -> {current['p50_ms']:.2f} ms ({ratio:.2f}x)")
+        print(f"  {key:40s} {previous['p50_ms']:10.2f} -> {current['p50_ms']:10.2f} ms  ({ratio:5.2f}x){marker}")
+    return regressions
+
+
+def print_results(results):
+    print(f"\n{'stage':40s} {'p50':>9s} {'p95':>9s} {'p99':>9s} {'ops/s':>9s} {'traced MB':>10s} {'+RSS MB':>8s}")
+    for key, r in sorted(results.items()):
+        growth = r.get("rss_growth_mb")
+        print(f"{key:40s} {r['p50_ms']:9.2f} {r['p95_ms']:9.2f} {r['p99_ms']:9.2f} "
+              f"{r['throughput_per_s']:9.2f} {r['peak_traced_mb']:10.2f} "
+              f"{growth if growth is not None else '-':>8}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="PictoBook AI pipeline microbenchmarks")
+    parser.add_argument("--stages", default=",".join(ALL_STAGES), help="Comma-separated stages to run")
+    parser.add_argument("--iterations", type=int, default=10)
+    parser.add_argument("--resolutions", default=DEFAULT_RESOLUTIONS, help="Synthetic photo sizes for detection")
+    parser.add_argument("--images", help="Directory of sample photos to add to the detection set")
+    parser.add_argument("--detectors", default=DEFAULT_DETECTORS, help="Comma-separated detector backends to compare")
+    parser.add_argument("--stub-latency-ms", type=float, default=50.0, help="Simulated NIM response time")
+    parser.add_argument("--concurrency", type=int, default=8, help="Parallel requests for async stylization")
+    parser.add_argument("--local-model", help="Model for the local stage (default: LOCAL_MODEL)")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="Write results to the baseline file")
+    parser.add_argument("--threshold", type=float, default=0.25, help="Allowed p50 slowdown (0.25 = 25%%)")
+    parser.add_argument("--output", help="Also write results as JSON to this file")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    stages = [stage.strip() for stage in args.stages.split(",") if stage.strip()]
+    unknown = set(stages) - set(ALL_STAGES) - set(OPTIONAL_STAGES)
+    if unknown:
+        print(f"Unknown stages: {', '.join(sorted(unknown))}")
+        return 2
+
+    # Configure the pipeline before its modules read config: offline, CPU only,
+    # no caches that would turn repeated iterations into hits
+    server = None
+    if "stylization" in stages:
+        server, base_url = start_stub_nim(args.stub_latency_ms)
+        os.environ.update({
+            "USE_NVIDIA_NIM": "true",
+            "NVIDIA_NIM_API_KEY": "benchmark",
+            "NVIDIA_NIM_BASE_URL": base_url,
+            "NVIDIA_NIM_MAX_RETRIES": "0",
+        })
+    if args.local_model:
+        os.environ["LOCAL_MODEL"] = args.local_model
+    os.environ["STYLIZATION_CACHE_ENABLED"] = "false"
+    os.environ.setdefault("CUDA_VISIBLE_DEVICES", "")
+    os.chdir(BACKEND_DIR)
+    sys.path.insert(0, BACKEND_DIR)
+
+    print("=" * 50)
+    print("PictoBook AI - Pipeline Benchmarks")
+    print("=" * 50)
+
+    results = {}
+    runners = {
+        "detection": lambda: bench_detection(
+            load_images(args.resolutions.split(","), args.images), args.iterations, results,
+            [name.strip() for name in args.detectors.split(",") if name.strip()]
+        ),
+        "mask": lambda: bench_mask(args.iterations, results),
+        "compositing": lambda: bench_compositing(args.iterations, results),
+        "encoding": lambda: bench_encoding(args.iterations, results),
+        "stylization": lambda: bench_stylization(args.iterations, args.concurrency, results),
+        "local": lambda: bench_local_stylization(args.iterations, results),
+    }
+    for stage in stages:
+        print(f"Running {stage}...")
+        try:
+            runners[stage]()
+        except ImportError as e:
+            print(f"⚠ Skipping {stage}: {e}")
+
+    if server is not None:
+        server.shutdown()
+
+    print_results(results)
+    print_detection_summary(results)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print(f"\n✓ Baseline saved to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"\nNo baseline at {args.baseline} - run with --save-baseline to create one")
+        return 0
+
+    with open(args.baseline, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    print(f"\nComparing against baseline (threshold {args.threshold:.0%}):")
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print(f"\n✗ {len(regressions)} stage(s) regressed:")
+        for message in regressions:
+            print(f"  {message}")
+        return 1
+    print("\n✓ No regressions")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,208 @@
+"""Single-flight request coalescing and idempotency-key replay"""
+
+import os
+import json
+import time
+import sqlite3
+import asyncio
+import threading
+from collections import OrderedDict
+
+
+class SingleFlight:
+    """Share one in-flight execution between concurrent callers with the same key"""
+
+    def __init__(self):
+        self._inflight = {}
+
+    async def run(self, key, factory):
+        """
+        Await the in-flight task for key, or start one with factory()
+
+        Args:
+            key: Hashable identity of the work
+            factory: Zero-argument callable returning a coroutine
+
+        Returns:
+            The coroutine's result (exceptions propagate to every caller)
+        """
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            print(f"Coalescing duplicate request ({str(key)[:12]})")
+        # A disconnecting caller must not cancel work other callers are waiting on
+        return await asyncio.shield(task)
+
+    def __len__(self):
+        return len(self._inflight)
+
+
+class StoredResponse:
+    """Snapshot of a completed response for idempotent replay"""
+
+    def __init__(self, fingerprint, body, media_type, headers=None, status_code=200):
+        self.fingerprint = fingerprint
+        self.body = body
+        self.media_type = media_type
+        self.headers = dict(headers or {})
+        self.status_code = status_code
+        self.expires_at = 0.0
+
+
+class IdempotencyStore:
+    def __init__(self, ttl=3600, max_entries=64, max_bytes=256 * 1024 * 1024):
+        """
+        Initialize the store
+
+        Args:
+            ttl: Seconds a completed response can be replayed
+            max_entries: Maximum number of stored responses
+            max_bytes: Maximum total size of stored bodies
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the StoredResponse for key, or None if unknown or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry.expires_at < time.monotonic():
+                self._drop(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, response):
+        """Store a completed response under key"""
+        if len(response.body) > self.max_bytes:
+            return
+        response.expires_at = time.monotonic() + self.ttl
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = response
+            self._bytes += len(response.body)
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                self._drop(next(iter(self._entries)))
+
+    def _drop(self, key):
+        # Caller holds self._lock
+        entry = self._entries.pop(key)
+        self._bytes -= len(entry.body)
+
+
+class SharedIdempotencyStore:
+    """IdempotencyStore kept in SQLite, so every worker process of the server can replay a response"""
+
+    def __init__(self, db_path, ttl=3600, max_entries=64, max_bytes=256 * 1024 * 1024):
+        """
+        Initialize the store (the database is opened on first use, in each
+        worker process - SQLite connections must not be shared across fork)
+
+        Args:
+            db_path: SQLite database file shared by the workers
+            ttl: Seconds a completed response can be replayed
+            max_entries: Maximum number of stored responses
+            max_bytes: Maximum total size of stored bodies
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.db_path = db_path
+        self._conn = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        # Caller holds self._lock
+        if self._conn is None or self._pid != os.getpid():
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=30)
+            conn.row_factory = sqlite3.Row
+            with conn:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS idempotency (
+                        key TEXT PRIMARY KEY,
+                        fingerprint TEXT NOT NULL,
+                        body BLOB NOT NULL,
+                        media_type TEXT NOT NULL,
+                        headers TEXT NOT NULL,
+                        status_code INTEGER NOT NULL,
+                        size INTEGER NOT NULL,
+                        used_at REAL NOT NULL,
+                        expires_at REAL NOT NULL
+                    )
+                    """
+                )
+            self._conn = conn
+            self._pid = os.getpid()
+        return self._conn
+
+    def get(self, key):
+        """Return the StoredResponse for key, or None if unknown or expired"""
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                row = conn.execute(
+                    "SELECT fingerprint, body, media_type, headers, status_code, expires_at "
+                    "FROM idempotency WHERE key = ?", (key,)
+                ).fetchone()
+                if row is None:
+                    return None
+                if row["expires_at"] < now:
+                    conn.execute("DELETE FROM idempotency WHERE key = ?", (key,))
+                    return None
+                conn.execute("UPDATE idempotency SET used_at = ? WHERE key = ?", (now, key))
+        response = StoredResponse(row["fingerprint"], bytes(row["body"]), row["media_type"],
+                                  json.loads(row["headers"]), row["status_code"])
+        response.expires_at = row["expires_at"]
+        return response
+
+    def put(self, key, response):
+        """Store a completed response under key"""
+        size = len(response.body)
+        if size > self.max_bytes:
+            return
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO idempotency "
+                    "(key, fingerprint, body, media_type, headers, status_code, size, used_at, expires_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (key, response.fingerprint, sqlite3.Binary(response.body), response.media_type,
+                     json.dumps(response.headers), response.status_code, size, now, now + self.ttl)
+                )
+                conn.execute("DELETE FROM idempotency WHERE expires_at < ?", (now,))
+                # Most recently used are kept, as in IdempotencyStore
+                rows = conn.execute("SELECT key, size FROM idempotency ORDER BY used_at DESC").fetchall()
+                kept, total, evicted = 0, 0, []
+                for row in rows:
+                    if kept < self.max_entries and total + row["size"] <= self.max_bytes:
+                        kept += 1
+                        total += row["size"]
+                    else:
+                        evicted.append((row["key"],))
+                if evicted:
+                    conn.executemany("DELETE FROM idempotency WHERE key = ?", evicted)
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None and self._pid == os.getpid():
+                self._conn.close()
+            self._conn = None
@@ -1,18 +1,167 @@
 """Composite stylized face into template"""
 
 import os
-from PIL import Image, ImageFilter, ImageEnhance
+import functools
+from PIL import Image
 import numpy as np
-from config import TEMPLATE_DIR, DEFAULT_TEMPLATE
+import cv2
+from config import (
+    TEMPLATE_DIR,
+    DEFAULT_TEMPLATE,
+    FEATHER_SIZE,
+    MASK_SHAPE,
+    MASK_CACHE_SIZE,
+    COLOR_MATCH_STRENGTH,
+    PREVIEW_MAX_SIDE
+)
+from template_registry import TemplateRegistry
+from executors import get_executor
+
+MASK_SHAPES = ("rect", "ellipse", "landmarks")
+
+
+def _smoothstep(t):
+    """Soft ramp used in place of the old Gaussian blur pass"""
+    return t * t * (3.0 - 2.0 * t)
+
+
+def _ellipse_distance(width, height, cx, cy, ax, ay):
+    """Approximate distance in pixels from each pixel to the edge of an ellipse (negative outside)"""
+    xs = (np.arange(width, dtype=np.float32) - cx) / ax
+    ys = (np.arange(height, dtype=np.float32) - cy) / ay
+    radius = np.sqrt(ys[:, None] ** 2 + xs[None, :] ** 2)
+    return (1.0 - radius) * min(ax, ay)
+
+
+def _landmark_ellipse(width, height, landmarks):
+    """Ellipse (cx, cy, ax, ay) around the eyes, nose and mouth landmarks"""
+    points = np.asarray(landmarks, dtype=np.float32).reshape(-1, 2)
+    left_eye, right_eye = points[0], points[1]
+    mouth = points[3:5].mean(axis=0) if len(points) >= 5 else points[-1]
+    eyes = (left_eye + right_eye) / 2.0
+
+    eye_distance = max(float(np.linalg.norm(right_eye - left_eye)), 1.0)
+    eye_to_mouth = max(float(np.linalg.norm(mouth - eyes)), 1.0)
+
+    # Face is roughly two eye-distances wide, with the forehead and chin
+    # extending well past the eye and mouth lines
+    cx, cy = points.mean(axis=0)
+    ax = min(eye_distance * 1.1, cx, width - cx)
+    ay = min(eye_to_mouth * 1.9, cy, height - cy)
+    return float(cx), float(cy), max(float(ax), 1.0), max(float(ay), 1.0)
+
+
+@functools.lru_cache(maxsize=MASK_CACHE_SIZE)
+def feathered_mask(width, height, feather_size=FEATHER_SIZE, shape="rect", landmarks=None):
+    """
+    Build a feathered alpha mask in a single vectorized pass
+
+    Args:
+        width, height: Mask size
+        feather_size: Width of the edge ramp in pixels
+        shape: "rect", "ellipse" or "landmarks"
+        landmarks: Tuple of (x, y) points in mask coordinates (shape="landmarks")
+
+    Returns:
+        mask: PIL Image in mode "L" (shared between callers - do not modify)
+    """
+    if shape not in MASK_SHAPES:
+        raise ValueError(f"Unknown mask shape: {shape}")
+    feather = float(max(feather_size, 1))
+
+    if shape == "rect":
+        # Distance to the nearest border, separable in x and y
+        xs = np.arange(width, dtype=np.float32)
+        ys = np.arange(height, dtype=np.float32)
+        ramp_x = np.minimum(xs, width - 1 - xs)
+        ramp_y = np.minimum(ys, height - 1 - ys)
+        distance = np.minimum.outer(ramp_y, ramp_x)
+    elif shape == "landmarks" and landmarks:
+        distance = _ellipse_distance(width, height, *_landmark_ellipse(width, height, landmarks))
+    else:
+        distance = _ellipse_distance(width, height, (width - 1) / 2.0, (height - 1) / 2.0,
+                                     width / 2.0, height / 2.0)
+
+    alpha = _smoothstep(np.clip(distance / feather, 0.0, 1.0))
+    return Image.fromarray((alpha * 255.0 + 0.5).astype(np.uint8), mode="L")
+
+
+# RGB -> zero-centered YCbCr (BT.601). Linear, so a per-channel YCbCr transfer is one RGB color matrix
+_RGB_TO_YCC = np.array([
+    [0.299, 0.587, 0.114],
+    [-0.168736, -0.331264, 0.5],
+    [0.5, -0.418688, -0.081312],
+], dtype=np.float64)
+_YCC_TO_RGB = np.linalg.inv(_RGB_TO_YCC)
+
+
+def _color_stats(pixels, weights=None, stride=4):
+    """Mean and covariance of RGB pixels, on a strided subsample (optionally weighted)"""
+    sample = pixels[::stride, ::stride].reshape(-1, 3).astype(np.float64)
+    if weights is None:
+        w = np.ones(len(sample))
+    else:
+        w = weights[::stride, ::stride].reshape(-1).astype(np.float64)
+    total = w.sum()
+    if total <= 0:
+        return None, None
+    mean = (sample * w[:, None]).sum(axis=0) / total
+    centered = sample - mean
+    cov = (centered * w[:, None]).T @ centered / total
+    return mean, cov
+
+
+def color_transfer_matrix(face, reference, weights=None, strength=COLOR_MATCH_STRENGTH):
+    """
+    3x4 RGB matrix that moves the face's YCbCr mean and standard deviation towards the reference's
+
+    Statistics come from subsampled pixels; applying the matrix (cv2.transform)
+    is a single pass over the face.
+
+    Args:
+        face: (h, w, 3) uint8 RGB array
+        reference: (h2, w2, 3) uint8 RGB array whose statistics the face should take on
+        weights: Optional (h, w) array in [0, 1] - only these face pixels count (e.g. the blend mask)
+        strength: 0 leaves the face unchanged, 1 is a full transfer
+
+    Returns:
+        (3, 4) float32 matrix, or None when there is nothing to transfer
+    """
+    if strength <= 0:
+        return None
+    face_mean, face_cov = _color_stats(face, weights)
+    ref_mean, ref_cov = _color_stats(reference)
+    if face_mean is None or ref_mean is None:
+        return None
+
+    # Per-channel YCbCr statistics from the RGB mean and covariance
+    face_std = np.sqrt(np.maximum(np.einsum("ij,jk,ik->i", _RGB_TO_YCC, face_cov, _RGB_TO_YCC), 0.0))
+    ref_std = np.sqrt(np.maximum(np.einsum("ij,jk,ik->i", _RGB_TO_YCC, ref_cov, _RGB_TO_YCC), 0.0))
+
+    # Limit contrast changes so a flat template slot cannot wash the face out
+    scale = np.clip(ref_std / np.maximum(face_std, 1e-3), 0.5, 2.0)
+    gain = 1.0 + strength * (scale - 1.0)
+    offset = strength * (_RGB_TO_YCC @ ref_mean - scale * (_RGB_TO_YCC @ face_mean))
+
+    matrix = np.empty((3, 4))
+    matrix[:, :3] = _YCC_TO_RGB @ np.diag(gain) @ _RGB_TO_YCC
+    matrix[:, 3] = _YCC_TO_RGB @ offset
+    return matrix.astype(np.float32)
+
 
 class TemplateCompositor:
-    def __init__(self, template_path=None):
+    def __init__(self, template_path=None, registry=None):
         """Initialize with template path"""
         if template_path is None:
             template_path = os.path.join(TEMPLATE_DIR, DEFAULT_TEMPLATE)
         self.template_path = template_path
+        
+        # Decoded templates and face regions are cached across requests
+        if registry is None:
+            registry = TemplateRegistry(region_detector=self._detect_template_face_region)
+        self.registry = registry
     
-    def composite(self, stylized_face, face_bbox=None, template_path=None):
+    def composite(self, stylized_face, face_bbox=None, template_path=None, landmarks=None, mask_shape=None):
         """
         Composite stylized face into template
         
@@ -20,24 +169,84 @@ class TemplateCompositor:
             stylized_face: PIL Image of stylized face
             face_bbox: Original bounding box (x1, y1, x2, y2) - optional for auto-detection
             template_path: Path to template (uses default if None)
+            landmarks: Face landmarks in original image coordinates (for mask_shape="landmarks")
+            mask_shape: Blend mask shape - "rect", "ellipse" or "landmarks" (MASK_SHAPE if None)
             
         Returns:
             final_image: PIL Image of composited result
         """
         if template_path is None:
             template_path = self.template_path
+        if mask_shape is None:
+            mask_shape = MASK_SHAPE
         
-        # Load template
-        if not os.path.exists(template_path):
+        # Look up decoded template (loaded once, refreshed when the file changes)
+        entry = self.registry.get(template_path)
+        if entry is None:
             # Create a simple template if none exists
             return self._create_simple_template(stylized_face)
         
-        template = Image.open(template_path).convert("RGB")
+        # Face area comes from the template's sidecar manifest, or the
+        # center-region estimate computed once when the template was loaded
+        blended, paste_x, paste_y = self._blend(
+            stylized_face, entry.pixels, entry.face_region, face_bbox, landmarks, mask_shape, FEATHER_SIZE
+        )
+        
+        # Paste the blended box into a private copy of the page
+        result = entry.image
+        result.paste(Image.fromarray(blended), (paste_x, paste_y))
         
-        # Detect face area in template (simple approach: center region)
-        # In production, you'd have predefined coordinates or use face detection
-        face_region = self._detect_template_face_region(template)
+        return result
+    
+    def composite_preview(self, face, face_bbox=None, template_path=None, landmarks=None,
+                          mask_shape=None, max_side=PREVIEW_MAX_SIDE):
+        """
+        Composite a face into a reduced-resolution copy of the template (progressive previews)
+        
+        Uses the same template entry and memoized masks as composite(); the
+        downscaled template is computed once per template and size.
+        
+        Args:
+            face: PIL Image of the (preview) face
+            face_bbox: Original bounding box (x1, y1, x2, y2)
+            template_path: Path to template (uses default if None)
+            landmarks: Face landmarks in original image coordinates
+            mask_shape: Blend mask shape (MASK_SHAPE if None)
+            max_side: Long side of the preview in pixels
+            
+        Returns:
+            PIL Image no larger than max_side on its long side
+        """
+        if template_path is None:
+            template_path = self.template_path
+        if mask_shape is None:
+            mask_shape = MASK_SHAPE
+        
+        entry = self.registry.get(template_path)
+        if entry is None:
+            preview = self._create_simple_template(face)
+            preview.thumbnail((max_side, max_side), Image.BILINEAR)
+            return preview
+        
+        pixels, scale = entry.preview_pixels(max_side)
+        face_region = tuple(int(round(v * scale)) for v in entry.face_region)
+        if face_region[2] <= face_region[0] or face_region[3] <= face_region[1]:
+            return Image.fromarray(pixels)
+        
+        blended, paste_x, paste_y = self._blend(
+            face, pixels, face_region, face_bbox, landmarks, mask_shape, max(1, int(round(FEATHER_SIZE * scale)))
+        )
+        result = Image.fromarray(pixels)
+        result.paste(Image.fromarray(blended), (paste_x, paste_y))
+        return result
+    
+    def _blend(self, stylized_face, pixels, face_region, face_bbox, landmarks, mask_shape, feather_size):
+        """
+        Fit the face into a template face slot and alpha-blend it with the template pixels
         
+        Returns:
+            (blended uint8 array of the face's box, paste x, paste y)
+        """
         # Resize stylized face to match template face region
         target_width = face_region[2] - face_region[0]
         target_height = face_region[3] - face_region[1]
@@ -58,36 +267,59 @@ class TemplateCompositor:
         resized_face = stylized_face.resize((new_width, new_height), Image.LANCZOS)
         
         # Create mask for smooth blending
-        mask = self._create_feathered_mask(new_width, new_height, feather_size=20)
-        
-        # Paste face into template
-        result = template.copy()
+        mask = self._create_feathered_mask(
+            new_width, new_height, feather_size=feather_size, shape=mask_shape,
+            landmarks=self._landmarks_in_face(landmarks, face_bbox, new_width, new_height)
+        )
         
         # Calculate paste position (center in face region)
         paste_x = face_region[0] + (target_width - new_width) // 2
         paste_y = face_region[1] + (target_height - new_height) // 2
         
-        # Convert to RGBA for alpha blending
-        if resized_face.mode != "RGBA":
-            resized_face = resized_face.convert("RGBA")
+        # All per-pixel work is limited to the face's box: color matching and
+        # alpha blending run on arrays of that size, read straight from the
+        # (shared, read-only) template pixels
+        background = pixels[paste_y:paste_y + new_height, paste_x:paste_x + new_width]
+        alpha = np.asarray(mask, dtype=np.float32) / 255.0
+        face = self._match_colors(np.asarray(resized_face.convert("RGB")), pixels, face_region, alpha)
+        blended = cv2.blendLinear(face, np.ascontiguousarray(background), alpha, 1.0 - alpha)
         
-        # Apply mask as alpha channel
-        resized_face.putalpha(mask)
+        return blended, paste_x, paste_y
+    
+    def composite_pages(self, stylized_face, template_paths, face_bbox=None, landmarks=None,
+                        mask_shape=None, executor=None):
+        """
+        Composite one stylized face into several page templates in parallel
         
-        # Paste with alpha blending
-        result.paste(resized_face, (paste_x, paste_y), resized_face)
+        Blocks until every page is done, so call it from outside the executor
+        it runs pages on - waiting from one of that pool's own threads can
+        deadlock once the pool is busy.
         
-        # Optional: Color matching to template
-        result = self._match_colors(result, template, face_region)
+        Args:
+            stylized_face: PIL Image of stylized face
+            template_paths: List of page template paths
+            face_bbox: Original bounding box (x1, y1, x2, y2)
+            landmarks: Face landmarks in original image coordinates
+            mask_shape: Blend mask shape (MASK_SHAPE if None)
+            executor: Executor to run pages on (the shared compositing stage executor if None)
+            
+        Returns:
+            List of composited PIL Images, in the order of template_paths
+        """
+        def composite_page(template_path):
+            return self.composite(stylized_face, face_bbox, template_path,
+                                  landmarks=landmarks, mask_shape=mask_shape)
         
-        return result
+        if executor is None:
+            executor = get_executor("compositing")
+        return list(executor.map(composite_page, template_paths))
     
-    def _detect_template_face_region(self, template):
+    def _detect_template_face_region(self, size):
         """
         Detect or estimate face region in template
         For now, uses center region. In production, use predefined coordinates.
         """
-        width, height = template.size
+        width, height = size
         
         # Assume face is in center 30% of image
         face_width = int(width * 0.3)
@@ -100,43 +332,34 @@ class TemplateCompositor:
         
         return (x1, y1, x2, y2)
     
-    def _create_feathered_mask(self, width, height, feather_size=20):
-        """Create a feathered mask for smooth blending"""
-        # Create base mask
-        mask = Image.new("L", (width, height), 255)
-        
-        # Create gradient edges
-        mask_array = np.array(mask)
-        
-        # Feather edges
-        for i in range(feather_size):
-            alpha = int(255 * (i / feather_size))
-            # Top edge
-            mask_array[i, :] = np.minimum(mask_array[i, :], alpha)
-            # Bottom edge
-            mask_array[height - 1 - i, :] = np.minimum(mask_array[height - 1 - i, :], alpha)
-            # Left edge
-            mask_array[:, i] = np.minimum(mask_array[:, i], alpha)
-            # Right edge
-            mask_array[:, width - 1 - i] = np.minimum(mask_array[:, width - 1 - i], alpha)
-        
-        # Apply gaussian blur for smoother edges
-        mask = Image.fromarray(mask_array)
-        mask = mask.filter(ImageFilter.GaussianBlur(radius=feather_size // 4))
-        
-        return mask
+    def _create_feathered_mask(self, width, height, feather_size=FEATHER_SIZE, shape="rect", landmarks=None):
+        """Create a feathered mask for smooth blending (memoized by size, feather and shape)"""
+        if shape != "landmarks":
+            landmarks = None
+        return feathered_mask(width, height, feather_size, shape, landmarks)
     
-    def _match_colors(self, result, template, face_region):
-        """Match colors of pasted face to template style"""
-        # Extract template colors around face region
-        region = template.crop(face_region)
-        
-        # Simple color adjustment - can be enhanced
-        # For now, just slight brightness/contrast matching
-        enhancer = ImageEnhance.Brightness(result)
-        result = enhancer.enhance(0.98)  # Slight darkening
-        
-        return result
+    def _landmarks_in_face(self, landmarks, face_bbox, width, height):
+        """Map landmarks from original image coordinates into the resized face, as a hashable tuple"""
+        if landmarks is None or face_bbox is None:
+            return None
+        x1, y1, x2, y2 = face_bbox
+        if x2 <= x1 or y2 <= y1:
+            return None
+        scale_x = width / (x2 - x1)
+        scale_y = height / (y2 - y1)
+        # Rounded to whole pixels so similar faces share cached masks
+        return tuple(
+            (int(round((x - x1) * scale_x)), int(round((y - y1) * scale_y)))
+            for x, y in np.asarray(landmarks).reshape(-1, 2)
+        )
+    
+    def _match_colors(self, face, template_pixels, face_region, weights=None):
+        """Match colors of the face to the template's face slot (YCbCr mean/std transfer)"""
+        x1, y1, x2, y2 = face_region
+        matrix = color_transfer_matrix(face, template_pixels[y1:y2, x1:x2], weights)
+        if matrix is None:
+            return face
+        return cv2.transform(face, matrix)
     
     def _create_simple_template(self, face_image):
         """Create a simple template if none exists"""
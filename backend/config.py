@@ -5,6 +5,13 @@ import os
 # Face detection settings
 FACE_CROP_SIZE = 768  # Size for face crop (512, 768, or 1024)
 FACE_DETECTION_CONFIDENCE = 0.9
+DETECTION_MAX_SIDE = int(os.getenv("DETECTION_MAX_SIDE", "1024"))  # Long side of the detection proxy (0 = full resolution)
+DETECTION_RETRY_MAX_SIDE = int(os.getenv("DETECTION_RETRY_MAX_SIDE", "2048"))  # Retry resolution if the proxy finds no face (0 = no retry)
+DETECTION_BATCH_SIZE = int(os.getenv("DETECTION_BATCH_SIZE", "8"))  # Images per batched MTCNN call
+DETECTION_BACKEND = os.getenv("DETECTION_BACKEND", "mtcnn").lower()  # mtcnn (torch), yunet (OpenCV DNN) or onnx (SCRFD on ONNX Runtime)
+DETECTION_YUNET_MODEL = os.getenv("DETECTION_YUNET_MODEL", "models/face_detection_yunet_2023mar.onnx")  # OpenCV model zoo
+DETECTION_ONNX_MODEL = os.getenv("DETECTION_ONNX_MODEL", "models/scrfd_500m_bnkps.onnx")  # InsightFace SCRFD with keypoints
+DETECTION_ONNX_INPUT_SIZE = int(os.getenv("DETECTION_ONNX_INPUT_SIZE", "640"))  # Square input size of the SCRFD model
 
 # Stylization settings
 STYLIZATION_PROMPT = "illustrative child portrait, flat colors, cute large eyes, soft shading, clean cartoon style, children's book illustration, vibrant colors, friendly expression"
@@ -12,12 +19,35 @@ NEGATIVE_PROMPT = "photorealistic, realistic, photo, photograph, blurry, distort
 STYLIZATION_STRENGTH = 0.75  # How much to stylize (0.0-1.0)
 NUM_INFERENCE_STEPS = 30
 GUIDANCE_SCALE = 7.5
+STYLIZATION_SEED = int(os.getenv("STYLIZATION_SEED", "42"))  # Sent to every provider; 0 = random, results not cached
+
+# Stylization cache - repeat uploads skip the external API call
+STYLIZATION_CACHE_ENABLED = os.getenv("STYLIZATION_CACHE_ENABLED", "true").lower() == "true"
+STYLIZATION_CACHE_MEMORY_ITEMS = int(os.getenv("STYLIZATION_CACHE_MEMORY_ITEMS", "64"))
+STYLIZATION_CACHE_DIR = os.getenv("STYLIZATION_CACHE_DIR", os.path.join("cache", "stylization"))  # Empty disables disk tier
+STYLIZATION_CACHE_DISK_MB = int(os.getenv("STYLIZATION_CACHE_DISK_MB", "512"))
+
+# Provider routing - every configured API takes part; the fastest healthy one serves each request
+STYLIZATION_ROUTER_WINDOW = int(os.getenv("STYLIZATION_ROUTER_WINDOW", "50"))  # Calls per provider in the rolling stats
+STYLIZATION_ROUTER_MIN_SAMPLES = int(os.getenv("STYLIZATION_ROUTER_MIN_SAMPLES", "5"))  # Successes before latency stats are trusted
+STYLIZATION_BREAKER_FAILURES = int(os.getenv("STYLIZATION_BREAKER_FAILURES", "3"))  # Consecutive errors that open the circuit
+STYLIZATION_BREAKER_COOLDOWN = float(os.getenv("STYLIZATION_BREAKER_COOLDOWN", "30"))  # Seconds before a half-open probe
+STYLIZATION_HEDGING = os.getenv("STYLIZATION_HEDGING", "true").lower() == "true"  # Duplicate slow requests to the next provider
+STYLIZATION_HEDGE_DELAY = float(os.getenv("STYLIZATION_HEDGE_DELAY", "30"))  # Hedge delay until a provider's p95 is known
+STYLIZATION_MIN_HEDGE_DELAY = float(os.getenv("STYLIZATION_MIN_HEDGE_DELAY", "2"))  # Floor on the p95-based hedge delay
 
 # Model settings - Default to NVIDIA NIM API (fast and reliable)
 USE_NVIDIA_NIM = os.getenv("USE_NVIDIA_NIM", "true").lower() == "true"  # Default to true
 NVIDIA_NIM_API_KEY = os.getenv("NVIDIA_NIM_API_KEY", "")
 NVIDIA_NIM_MODEL = os.getenv("NVIDIA_NIM_MODEL", "stabilityai/stable-diffusion-3-medium")  # SD3 Medium
 NVIDIA_NIM_BASE_URL = os.getenv("NVIDIA_NIM_BASE_URL", "https://ai.api.nvidia.com/v1/genai")
+NVIDIA_NIM_TIMEOUT = float(os.getenv("NVIDIA_NIM_TIMEOUT", "120"))
+NVIDIA_NIM_MAX_CONNECTIONS = int(os.getenv("NVIDIA_NIM_MAX_CONNECTIONS", "32"))
+NVIDIA_NIM_MAX_KEEPALIVE = int(os.getenv("NVIDIA_NIM_MAX_KEEPALIVE", "16"))
+NVIDIA_NIM_KEEPALIVE_EXPIRY = float(os.getenv("NVIDIA_NIM_KEEPALIVE_EXPIRY", "60"))
+NVIDIA_NIM_HTTP2 = os.getenv("NVIDIA_NIM_HTTP2", "true").lower() == "true"  # Used when h2 is installed
+NVIDIA_NIM_MAX_RETRIES = int(os.getenv("NVIDIA_NIM_MAX_RETRIES", "3"))
+NVIDIA_NIM_RETRY_BACKOFF = float(os.getenv("NVIDIA_NIM_RETRY_BACKOFF", "0.5"))  # Seconds, doubled per retry
 
 # Alternative APIs
 USE_REPLICATE = os.getenv("USE_REPLICATE", "false").lower() == "true"
@@ -28,14 +58,93 @@ HUGGINGFACE_MODEL = os.getenv("HUGGINGFACE_MODEL", "ByteDance/SDXL-Lightning")
 HUGGINGFACE_PROVIDER = os.getenv("HUGGINGFACE_PROVIDER", "fal-ai")
 USE_LOCAL_SDXL = os.getenv("USE_LOCAL_SDXL", "false").lower() == "true"  # Only if explicitly enabled
 
+# Local diffusers pipeline - the only provider when no API is configured, otherwise the
+# last resort when every API fails. Defaults reproduce the original SDXL settings; for a
+# CPU node use e.g. LOCAL_MODEL=stabilityai/sdxl-turbo LOCAL_INFERENCE_STEPS=2
+# LOCAL_GUIDANCE_SCALE=0 LOCAL_STRENGTH=0.5 LOCAL_RESOLUTION=512, or LOCAL_SCHEDULER=lcm
+# with an LCM model or LOCAL_LCM_LORA
+LOCAL_MODEL = os.getenv("LOCAL_MODEL", "stabilityai/stable-diffusion-xl-base-1.0")
+LOCAL_SCHEDULER = os.getenv("LOCAL_SCHEDULER", "default").lower()  # default, lcm, euler_a or dpm
+LOCAL_LCM_LORA = os.getenv("LOCAL_LCM_LORA", "")  # LCM-LoRA adapter fused into the model (e.g. latent-consistency/lcm-lora-sdxl)
+LOCAL_INFERENCE_STEPS = int(os.getenv("LOCAL_INFERENCE_STEPS", str(NUM_INFERENCE_STEPS)))
+LOCAL_GUIDANCE_SCALE = float(os.getenv("LOCAL_GUIDANCE_SCALE", str(GUIDANCE_SCALE)))
+LOCAL_STRENGTH = float(os.getenv("LOCAL_STRENGTH", str(STYLIZATION_STRENGTH)))
+LOCAL_RESOLUTION = int(os.getenv("LOCAL_RESOLUTION", "1024"))  # Working size; size it to the template face slot (0 = the face crop's size)
+LOCAL_TORCH_THREADS = int(os.getenv("LOCAL_TORCH_THREADS", "0"))  # torch intra-op threads (0 = torch default)
+LOCAL_COMPILE = os.getenv("LOCAL_COMPILE", "none").lower()  # none, torch (torch.compile the UNet) or onnx (ONNX Runtime export via optimum)
+
 # Face restoration settings
 USE_FACE_RESTORATION = os.getenv("USE_FACE_RESTORATION", "true").lower() == "true"
+RESTORATION_MODE = os.getenv("RESTORATION_MODE", "aligned").lower()  # "aligned" feeds the detector's crop straight to GFPGAN; "full" re-detects and pastes back
+RESTORATION_SHARPNESS_THRESHOLD = float(os.getenv("RESTORATION_SHARPNESS_THRESHOLD", "100"))  # Skip faces whose Laplacian variance is above this (0 = always restore)
+RESTORATION_WEIGHT = float(os.getenv("RESTORATION_WEIGHT", "0.5"))  # GFPGAN blend weight
 
 # Template settings
 TEMPLATE_DIR = "templates"
 DEFAULT_TEMPLATE = "template1.png"
+BOOK_DIR = os.path.join(TEMPLATE_DIR, "books")  # One sub-directory of page templates per book
+MAX_BOOK_PAGES = int(os.getenv("MAX_BOOK_PAGES", "40"))
+FEATHER_SIZE = 20  # Width of the blend mask's edge ramp in pixels
+MASK_SHAPE = os.getenv("MASK_SHAPE", "rect")  # "rect", "ellipse" or "landmarks"
+MASK_CACHE_SIZE = 64  # Number of memoized blend masks
+COLOR_MATCH_STRENGTH = float(os.getenv("COLOR_MATCH_STRENGTH", "0.3"))  # YCbCr mean/std transfer to the face slot (0 = off, 1 = full)
+PREVIEW_MAX_SIDE = int(os.getenv("PREVIEW_MAX_SIDE", "512"))  # Long side of progressive previews
+TEMPLATE_RECHECK_SECONDS = float(os.getenv("TEMPLATE_RECHECK_SECONDS", "5"))  # How often cached templates are re-stat'ed
+TEMPLATE_STORE_DIR = os.getenv("TEMPLATE_STORE_DIR", os.path.join("cache", "templates"))  # Raw RGB files mapped by all workers (empty = decode in-process)
+
+# Concurrency settings - size of the executor pool used by each pipeline stage
+DECODE_WORKERS = int(os.getenv("DECODE_WORKERS", "2"))  # Upload decoding and hashing
+DETECTION_WORKERS = int(os.getenv("DETECTION_WORKERS", "2"))
+STYLIZATION_WORKERS = int(os.getenv("STYLIZATION_WORKERS", "16"))  # I/O-bound API calls
+RESTORATION_WORKERS = int(os.getenv("RESTORATION_WORKERS", "1"))
+COMPOSITING_WORKERS = int(os.getenv("COMPOSITING_WORKERS", "2"))
+ENCODING_WORKERS = int(os.getenv("ENCODING_WORKERS", "2"))
+
+# Upload limits - request bodies are cut off while streaming in (single-photo routes at
+# UPLOAD_MAX_MB, batches at MAX_BATCH_SIZE * UPLOAD_MAX_MB), pixel counts are checked
+# from the header before decoding
+UPLOAD_MAX_MB = int(os.getenv("UPLOAD_MAX_MB", "20"))  # Per photo (0 = no limit)
+REQUEST_MAX_MB = int(os.getenv("REQUEST_MAX_MB", "200"))  # Whole request body on other routes (0 = no limit)
+UPLOAD_MAX_MEGAPIXELS = float(os.getenv("UPLOAD_MAX_MEGAPIXELS", "60"))  # Larger images are rejected undecoded (0 = only Pillow's ~179 MP bomb guard)
+UPLOAD_DECODE_MAX_SIDE = int(os.getenv("UPLOAD_DECODE_MAX_SIDE", "2560"))  # JPEGs decode at 1/2-1/8 scale down to this long side (0 = full resolution)
+
+# Serving - more than one worker runs gunicorn with pre-forked uvicorn workers that
+# share the models loaded once in the master process (copy-on-write)
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))  # Worker processes
+WORKER_THREADS = int(os.getenv("WORKER_THREADS", "0"))  # torch/OpenCV threads per worker (0 = cores / workers)
+WORKER_TIMEOUT = int(os.getenv("WORKER_TIMEOUT", "120"))  # Seconds before gunicorn restarts a silent worker
+METRICS_DIR = os.getenv("METRICS_DIR", os.path.join("data", "metrics"))  # Per-worker metric snapshots merged by /metrics
+METRICS_FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", "5"))  # How often each worker writes its snapshot
+SERVER_LOCK_PATH = os.getenv("SERVER_LOCK_PATH", os.path.join("data", "server.lock"))  # Lets the first worker to start reset the previous run's state
+
+# Batch endpoint settings
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "50"))  # Max photos per /personalize/batch request
+BATCH_MAX_MEGAPIXELS = float(os.getenv("BATCH_MAX_MEGAPIXELS", "300"))  # Decoded pixels of a whole batch, held in memory together (0 = no limit)
+
+# Async job settings
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", os.path.join("data", "jobs.sqlite3"))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))  # Jobs processed concurrently
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", "100"))  # Pending jobs before POST /jobs returns 503
+JOB_TTL_SECONDS = int(os.getenv("JOB_TTL_SECONDS", str(24 * 3600)))  # How long finished jobs are kept
+JOB_EVENT_POLL_SECONDS = float(os.getenv("JOB_EVENT_POLL_SECONDS", "1.0"))
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "300"))  # Running jobs without a heartbeat for this long are requeued
+
+# Duplicate request handling for /personalize
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", "3600"))
+IDEMPOTENCY_MAX_ENTRIES = int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", "64"))
+IDEMPOTENCY_MAX_MB = int(os.getenv("IDEMPOTENCY_MAX_MB", "256"))  # Total size of stored responses
+IDEMPOTENCY_DB_PATH = os.getenv("IDEMPOTENCY_DB_PATH", JOB_DB_PATH)  # Shared by the workers when WEB_CONCURRENCY > 1
+
+# Session artifacts kept for /recomposite (stylized face, crop, bbox, landmarks)
+SESSION_STORE_DIR = os.getenv("SESSION_STORE_DIR", os.path.join("cache", "sessions"))  # Empty disables sessions
+SESSION_TTL_SECONDS = int(os.getenv("SESSION_TTL_SECONDS", "3600"))
+SESSION_STORE_MB = int(os.getenv("SESSION_STORE_MB", "512"))  # Least recently used sessions are evicted beyond this
 
 # Output settings
-OUTPUT_FORMAT = "PNG"
-OUTPUT_QUALITY = 95
+OUTPUT_FORMAT = os.getenv("OUTPUT_FORMAT", "PNG").upper()  # Default when a request does not choose (PNG, JPEG, WEBP, AVIF)
+OUTPUT_QUALITY = int(os.getenv("OUTPUT_QUALITY", "95"))  # JPEG quality of the "balanced" preset
+OUTPUT_PRESET = os.getenv("OUTPUT_PRESET", "balanced").lower()  # Encoder preset: fast, balanced or small
+PNG_COMPRESS_LEVEL = int(os.getenv("PNG_COMPRESS_LEVEL", "6"))  # zlib level of the "balanced" preset (1 = fastest, 9 = smallest)
+THUMBNAIL_SIZE = int(os.getenv("THUMBNAIL_SIZE", "256"))  # Long side of preview thumbnails
+RESULT_CACHE_MAX_AGE = int(os.getenv("RESULT_CACHE_MAX_AGE", "3600"))  # Cache-Control max-age for binary results
 
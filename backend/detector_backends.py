@@ -0,0 +1,274 @@
+"""Interchangeable face-detector backends
+
+Every backend takes an RGB uint8 array and returns (boxes, probs, landmarks)
+in the same format as facenet_pytorch's MTCNN.detect(..., landmarks=True):
+boxes is an (N, 4) array of x1, y1, x2, y2, probs an (N,) array of scores and
+landmarks an (N, 5, 2) array of eye, eye, nose, mouth, mouth points ordered
+left to right in image space. (None, None, None) means no face was found.
+"""
+
+import os
+import threading
+import numpy as np
+import cv2
+from config import (
+    DETECTION_BACKEND,
+    DETECTION_YUNET_MODEL,
+    DETECTION_ONNX_MODEL,
+    DETECTION_BATCH_SIZE,
+    DETECTION_ONNX_INPUT_SIZE,
+    FACE_DETECTION_CONFIDENCE
+)
+
+NO_FACE = (None, None, None)
+
+
+class DetectorBackend:
+    name = None
+
+    def __init__(self, device=None):
+        self.device = device
+        self._model = None
+        self._load_lock = threading.Lock()
+
+    @property
+    def model(self):
+        if self._model is None:
+            self.load()
+        return self._model
+
+    def load(self):
+        """Build the model (safe to call more than once)"""
+        with self._load_lock:
+            if self._model is None:
+                self._model = self._build()
+
+    def _build(self):
+        raise NotImplementedError
+
+    def detect(self, rgb):
+        """Detect faces in one RGB uint8 array, returning (boxes, probs, landmarks)"""
+        raise NotImplementedError
+
+    def detect_batch(self, arrays, batch_size=DETECTION_BATCH_SIZE):
+        """
+        Detect faces in several RGB arrays (backends without batching detect one at a time)
+
+        Returns:
+            List with one entry per array: (boxes, probs, landmarks) or the exception raised
+        """
+        results = []
+        for array in arrays:
+            try:
+                results.append(self.detect(array))
+            except Exception as e:
+                results.append(e)
+        return results
+
+
+class MTCNNBackend(DetectorBackend):
+    """facenet_pytorch MTCNN - accurate, batches on GPU, but needs torch"""
+
+    name = "mtcnn"
+
+    def _build(self):
+        # Deferred so selecting another backend never imports torch
+        import torch
+        from facenet_pytorch import MTCNN
+
+        if self.device is None:
+            self.device = 'cuda' if torch.cuda.is_available() else 'cpu'
+
+        return MTCNN(
+            image_size=512,
+            margin=40,
+            min_face_size=40,
+            thresholds=[0.6, 0.7, 0.7],
+            factor=0.709,
+            post_process=False,
+            device=self.device
+        )
+
+    def detect(self, rgb):
+        return self.model.detect(rgb, landmarks=True)
+
+    def detect_batch(self, arrays, batch_size=DETECTION_BATCH_SIZE):
+        """MTCNN can only stack images of identical size: group by shape, then chunk"""
+        results = [None] * len(arrays)
+        groups = {}
+        for idx, array in enumerate(arrays):
+            groups.setdefault(array.shape, []).append(idx)
+
+        for indices in groups.values():
+            for start in range(0, len(indices), batch_size):
+                chunk = indices[start:start + batch_size]
+                try:
+                    batch_boxes, batch_probs, batch_landmarks = self.model.detect(
+                        np.stack([arrays[idx] for idx in chunk]), landmarks=True
+                    )
+                except Exception as e:
+                    for idx in chunk:
+                        results[idx] = e
+                    continue
+                for pos, idx in enumerate(chunk):
+                    results[idx] = (batch_boxes[pos], batch_probs[pos], batch_landmarks[pos])
+
+        return results
+
+
+class YuNetBackend(DetectorBackend):
+    """OpenCV DNN YuNet - a ~100k parameter CPU detector, no torch required"""
+
+    name = "yunet"
+
+    def __init__(self, device=None, model_path=None, score_threshold=FACE_DETECTION_CONFIDENCE, nms_threshold=0.3):
+        super().__init__(device)
+        self.model_path = model_path or DETECTION_YUNET_MODEL
+        self.score_threshold = score_threshold
+        self.nms_threshold = nms_threshold
+        # FaceDetectorYN keeps the input size as state, so calls are serialized
+        self._infer_lock = threading.Lock()
+
+    def _build(self):
+        if not hasattr(cv2, "FaceDetectorYN"):
+            raise RuntimeError("The yunet backend needs OpenCV >= 4.5.4 (cv2.FaceDetectorYN)")
+        if not os.path.exists(self.model_path):
+            raise FileNotFoundError(
+                f"YuNet model not found at {self.model_path}. Download face_detection_yunet_2023mar.onnx "
+                "from the OpenCV model zoo or set DETECTION_YUNET_MODEL."
+            )
+        return cv2.FaceDetectorYN.create(self.model_path, "", (320, 320), self.score_threshold, self.nms_threshold)
+
+    def detect(self, rgb):
+        height, width = rgb.shape[:2]
+        bgr = cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR)
+        model = self.model
+        with self._infer_lock:
+            model.setInputSize((width, height))
+            _, faces = model.detect(bgr)
+        if faces is None or len(faces) == 0:
+            return NO_FACE
+
+        # Rows are x, y, w, h, five landmark points, score
+        boxes = faces[:, :4].astype(np.float32)
+        boxes[:, 2:] += boxes[:, :2]
+        landmarks = faces[:, 4:14].reshape(-1, 5, 2).astype(np.float32)
+        return boxes, faces[:, 14].astype(np.float32), landmarks
+
+
+class ONNXBackend(DetectorBackend):
+    """SCRFD (InsightFace) with keypoints, run by ONNX Runtime - no torch required"""
+
+    name = "onnx"
+    strides = (8, 16, 32)
+    anchors_per_cell = 2
+
+    def __init__(self, device=None, model_path=None, score_threshold=0.5, nms_threshold=0.4,
+                 input_size=DETECTION_ONNX_INPUT_SIZE):
+        super().__init__(device)
+        self.model_path = model_path or DETECTION_ONNX_MODEL
+        self.score_threshold = score_threshold
+        self.nms_threshold = nms_threshold
+        self.input_size = input_size
+        self._centers = {}
+
+    def _build(self):
+        import onnxruntime as ort
+
+        if not os.path.exists(self.model_path):
+            raise FileNotFoundError(
+                f"SCRFD model not found at {self.model_path}. Download a *_bnkps.onnx model "
+                "from the InsightFace model zoo or set DETECTION_ONNX_MODEL."
+            )
+        # Available providers come in priority order (CUDA before CPU)
+        providers = ort.get_available_providers()
+        if self.device == 'cpu':
+            providers = ['CPUExecutionProvider']
+        session = ort.InferenceSession(self.model_path, providers=providers)
+        if len(session.get_outputs()) != 3 * len(self.strides):
+            raise ValueError(f"{self.model_path} is not an SCRFD model with keypoints (expected 9 outputs)")
+        return session
+
+    def detect(self, rgb):
+        session = self.model
+        blob, scale = self._letterbox(rgb)
+        outputs = session.run(None, {session.get_inputs()[0].name: blob})
+
+        boxes, probs, landmarks = self._decode(outputs)
+        if len(probs) == 0:
+            return NO_FACE
+
+        xywh = np.concatenate([boxes[:, :2], boxes[:, 2:] - boxes[:, :2]], axis=1)
+        keep = np.asarray(
+            cv2.dnn.NMSBoxes(xywh.tolist(), probs.tolist(), self.score_threshold, self.nms_threshold)
+        ).reshape(-1)
+        if len(keep) == 0:
+            return NO_FACE
+        return boxes[keep] / scale, probs[keep], landmarks[keep] / scale
+
+    def _letterbox(self, rgb):
+        """Resize into the top-left of a square input, keeping the aspect ratio"""
+        size = self.input_size
+        height, width = rgb.shape[:2]
+        scale = min(size / height, size / width)
+        resized = cv2.resize(rgb, (max(1, round(width * scale)), max(1, round(height * scale))))
+        canvas = np.zeros((size, size, 3), dtype=np.float32)
+        canvas[:resized.shape[0], :resized.shape[1]] = resized
+        blob = ((canvas - 127.5) / 128.0).transpose(2, 0, 1)[np.newaxis]
+        return np.ascontiguousarray(blob), scale
+
+    def _anchor_centers(self, stride):
+        centers = self._centers.get(stride)
+        if centers is None:
+            cells = self.input_size // stride
+            ys, xs = np.mgrid[:cells, :cells]
+            centers = np.stack([xs, ys], axis=-1).reshape(-1, 2).astype(np.float32) * stride
+            centers = np.repeat(centers, self.anchors_per_cell, axis=0)
+            self._centers[stride] = centers
+        return centers
+
+    def _decode(self, outputs):
+        """Turn per-stride score, distance and keypoint maps into input-space detections"""
+        levels = len(self.strides)
+        all_boxes, all_probs, all_landmarks = [], [], []
+        for level, stride in enumerate(self.strides):
+            scores = outputs[level].reshape(-1)
+            keep = scores >= self.score_threshold
+            if not keep.any():
+                continue
+            centers = self._anchor_centers(stride)[keep]
+            distances = outputs[level + levels].reshape(-1, 4)[keep] * stride
+            points = outputs[level + 2 * levels].reshape(-1, 5, 2)[keep] * stride
+
+            all_boxes.append(np.concatenate([centers - distances[:, :2], centers + distances[:, 2:]], axis=1))
+            all_probs.append(scores[keep])
+            all_landmarks.append(centers[:, np.newaxis, :] + points)
+
+        if not all_probs:
+            return np.empty((0, 4), np.float32), np.empty(0, np.float32), np.empty((0, 5, 2), np.float32)
+        return np.concatenate(all_boxes), np.concatenate(all_probs), np.concatenate(all_landmarks)
+
+
+DETECTOR_BACKENDS = {
+    MTCNNBackend.name: MTCNNBackend,
+    YuNetBackend.name: YuNetBackend,
+    ONNXBackend.name: ONNXBackend,
+}
+
+
+def create_backend(name=None, device=None, **kwargs):
+    """
+    Instantiate a detector backend by name
+
+    Args:
+        name: One of DETECTOR_BACKENDS (defaults to the DETECTION_BACKEND setting)
+        device: 'cpu' or 'cuda' (None = auto)
+        **kwargs: Backend-specific options (model_path, score_threshold, ...)
+
+    Returns:
+        DetectorBackend instance (the model is loaded on first use)
+    """
+    name = (name or DETECTION_BACKEND).lower()
+    if name not in DETECTOR_BACKENDS:
+        raise ValueError(f"Unknown detection backend '{name}' (choose from {', '.join(DETECTOR_BACKENDS)})")
+    return DETECTOR_BACKENDS[name](device=device, **kwargs)
@@ -0,0 +1,217 @@
+"""Output image encoding and Accept-header content negotiation"""
+
+import io
+import time
+from PIL import Image
+from config import OUTPUT_FORMAT, OUTPUT_QUALITY, OUTPUT_PRESET, PNG_COMPRESS_LEVEL, THUMBNAIL_SIZE
+
+try:
+    import pillow_avif  # noqa: F401 - registers AVIF with Pillow < 11.3
+except ImportError:
+    pass
+
+Image.init()
+AVIF_AVAILABLE = "AVIF" in Image.SAVE
+
+# Pillow format name -> media type for the binary response formats
+MEDIA_TYPES = {
+    "PNG": "image/png",
+    "JPEG": "image/jpeg",
+    "WEBP": "image/webp",
+}
+if AVIF_AVAILABLE:
+    MEDIA_TYPES["AVIF"] = "image/avif"
+FORMATS_BY_MEDIA_TYPE = {media_type: fmt for fmt, media_type in MEDIA_TYPES.items()}
+
+DEFAULT_FORMAT = OUTPUT_FORMAT if OUTPUT_FORMAT in MEDIA_TYPES else "PNG"
+if DEFAULT_FORMAT != OUTPUT_FORMAT:
+    print(f"Output format {OUTPUT_FORMAT} is not available, defaulting to PNG")
+FORMAT_ALIASES = {"JPG": "JPEG"}
+FILE_EXTENSIONS = {"PNG": "png", "JPEG": "jpg", "WEBP": "webp", "AVIF": "avif"}
+
+# Encoder settings per preset: "fast" favors encode time, "small" favors payload size.
+# "quality" is the default for lossy formats and is overridden by a per-request quality.
+ENCODING_PRESETS = {
+    "fast": {
+        "PNG": {"compress_level": 1},
+        "JPEG": {"quality": 85, "progressive": False, "optimize": False},
+        "WEBP": {"quality": 80, "method": 0},
+        "AVIF": {"quality": 60, "speed": 9},
+    },
+    "balanced": {
+        "PNG": {"compress_level": PNG_COMPRESS_LEVEL},
+        "JPEG": {"quality": OUTPUT_QUALITY, "progressive": True, "optimize": False},
+        "WEBP": {"quality": 85, "method": 4},
+        "AVIF": {"quality": 70, "speed": 7},
+    },
+    "small": {
+        "PNG": {"compress_level": 9, "optimize": True},
+        "JPEG": {"quality": 80, "progressive": True, "optimize": True},
+        "WEBP": {"quality": 75, "method": 6},
+        "AVIF": {"quality": 55, "speed": 5},
+    },
+}
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+class OutputOptions:
+    """Validated per-request output settings"""
+
+    def __init__(self, fmt=DEFAULT_FORMAT, quality=None, preset=OUTPUT_PRESET, thumbnail=0):
+        self.format = fmt
+        self.quality = quality
+        self.preset = preset
+        self.thumbnail = thumbnail
+
+    @classmethod
+    def parse(cls, fmt=None, quality=None, preset=None, thumbnail=None):
+        """
+        Build options from request parameters, falling back to the configured defaults
+
+        Raises:
+            ValueError: For an unknown format or preset, or an out-of-range quality/thumbnail size
+        """
+        fmt = parse_format(fmt) if fmt else DEFAULT_FORMAT
+        preset = (preset or OUTPUT_PRESET).lower()
+        if preset not in ENCODING_PRESETS:
+            raise ValueError(f"Unknown output preset '{preset}' (choose from {', '.join(ENCODING_PRESETS)})")
+        if quality is not None and not 1 <= quality <= 100:
+            raise ValueError("Output quality must be between 1 and 100")
+        if thumbnail is None:
+            thumbnail = 0
+        if thumbnail and not 16 <= thumbnail <= 2048:
+            raise ValueError("Thumbnail size must be between 16 and 2048 pixels")
+        return cls(fmt, quality, preset, thumbnail)
+
+    def key(self):
+        """Hashable identity (part of coalescing and idempotency fingerprints)"""
+        return f"{self.format}:{self.quality}:{self.preset}:{self.thumbnail}"
+
+
+class EncodedImage:
+    """Encoded bytes plus what it cost to produce them"""
+
+    def __init__(self, data, fmt, encode_ms, size):
+        self.data = data
+        self.format = fmt
+        self.encode_ms = encode_ms
+        self.size = size
+
+    @property
+    def media_type(self):
+        return MEDIA_TYPES[self.format]
+
+    def metadata(self):
+        return {
+            "format": self.format.lower(),
+            "bytes": len(self.data),
+            "encode_ms": round(self.encode_ms, 1),
+            "width": self.size[0],
+            "height": self.size[1],
+        }
+
+
+def parse_format(name):
+    """Map a format name ("png", "jpg", "webp", "avif", ...) to its Pillow name"""
+    fmt = name.strip().upper()
+    fmt = FORMAT_ALIASES.get(fmt, fmt)
+    if fmt not in MEDIA_TYPES:
+        raise ValueError(f"Unsupported output format '{name}' (choose from {', '.join(f.lower() for f in MEDIA_TYPES)})")
+    return fmt
+
+
+def encoder_settings(fmt, quality=None, preset=OUTPUT_PRESET):
+    """Pillow save() keyword arguments for a format under a preset"""
+    settings = dict(ENCODING_PRESETS[preset][fmt])
+    if quality is not None and fmt != "PNG":
+        settings["quality"] = quality
+    return settings
+
+
+def encode_image(image, fmt=DEFAULT_FORMAT, quality=None, preset=OUTPUT_PRESET):
+    """
+    Encode a PIL Image
+
+    Args:
+        image: PIL Image
+        fmt: Pillow format name ("PNG", "JPEG", "WEBP" or "AVIF")
+        quality: Quality for lossy formats (the preset's default if None)
+        preset: Encoder preset - "fast", "balanced" or "small"
+
+    Returns:
+        Encoded bytes
+    """
+    if fmt == "JPEG" and image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    buf = io.BytesIO()
+    image.save(buf, format=fmt, **encoder_settings(fmt, quality, preset))
+    return buf.getvalue()
+
+
+def encode_timed(image, options):
+    """Encode with the request's options and measure the encode time"""
+    started = time.perf_counter()
+    data = encode_image(image, options.format, options.quality, options.preset)
+    return EncodedImage(data, options.format, (time.perf_counter() - started) * 1000.0, image.size)
+
+
+def encode_thumbnail(image, options, max_side=None):
+    """Downscale to a preview (long side max_side) and encode it with the request's options"""
+    max_side = max_side or options.thumbnail or THUMBNAIL_SIZE
+    started = time.perf_counter()
+    thumb = image.copy()
+    thumb.thumbnail((max_side, max_side), Image.BILINEAR, reducing_gap=2.0)
+    data = encode_image(thumb, options.format, options.quality, options.preset)
+    return EncodedImage(data, options.format, (time.perf_counter() - started) * 1000.0, thumb.size)
+
+
+def negotiate_format(accept_header):
+    """
+    Pick a binary output format from an Accept header
+
+    Clients must ask for an image type explicitly; a missing header, */* or a
+    preference for application/json keep the legacy base64-in-JSON response.
+
+    Returns:
+        Pillow format name, or None for the JSON response
+    """
+    if not accept_header:
+        return None
+
+    best_format, best_q = None, 0.0
+    json_q = 0.0
+    for position, item in enumerate(accept_header.split(",")):
+        parts = [part.strip() for part in item.split(";")]
+        media_type = parts[0].lower()
+        q = 1.0
+        for param in parts[1:]:
+            if param.startswith("q="):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        if q <= 0:
+            continue
+
+        if media_type == "application/json":
+            json_q = max(json_q, q)
+            continue
+        if media_type == "image/*":
+            fmt = DEFAULT_FORMAT
+        else:
+            fmt = FORMATS_BY_MEDIA_TYPE.get(media_type)
+        # Strictly greater keeps the client's first listed type on ties
+        if fmt is not None and q > best_q:
+            best_format, best_q = fmt, q
+
+    if best_format is None or json_q >= best_q:
+        return None
+    return best_format
+
+
+def iter_chunks(data, chunk_size=STREAM_CHUNK_SIZE):
+    """Yield zero-copy slices of encoded bytes for a streamed response"""
+    view = memoryview(data)
+    for start in range(0, len(view), chunk_size):
+        yield view[start:start + chunk_size]
@@ -0,0 +1,74 @@
+"""Dedicated executors for the blocking stages of the personalization pipeline"""
+
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from config import (
+    DECODE_WORKERS,
+    DETECTION_WORKERS,
+    STYLIZATION_WORKERS,
+    RESTORATION_WORKERS,
+    COMPOSITING_WORKERS,
+    ENCODING_WORKERS
+)
+
+# Pool size per pipeline stage. Stylization is I/O-bound (remote API calls) and
+# gets a wide pool; the CPU-bound stages release the GIL inside torch, OpenCV
+# and Pillow, so small thread pools give real parallelism without pickling
+# images across process boundaries.
+STAGE_POOL_SIZES = {
+    "decode": DECODE_WORKERS,
+    "detection": DETECTION_WORKERS,
+    "stylization": STYLIZATION_WORKERS,
+    "restoration": RESTORATION_WORKERS,
+    "compositing": COMPOSITING_WORKERS,
+    "encoding": ENCODING_WORKERS,
+}
+
+_executors = {}
+_lock = threading.Lock()
+
+
+def get_executor(stage):
+    """Return the (lazily created) executor for a pipeline stage"""
+    if stage not in STAGE_POOL_SIZES:
+        raise KeyError(f"Unknown pipeline stage: {stage}")
+
+    executor = _executors.get(stage)
+    if executor is None:
+        with _lock:
+            executor = _executors.get(stage)
+            if executor is None:
+                executor = ThreadPoolExecutor(
+                    max_workers=max(1, STAGE_POOL_SIZES[stage]),
+                    thread_name_prefix=f"pictobook-{stage}"
+                )
+                _executors[stage] = executor
+    return executor
+
+
+async def run_in_stage(stage, func, *args, **kwargs):
+    """
+    Run a blocking callable on the executor of the given stage
+
+    Args:
+        stage: Pipeline stage name (see STAGE_POOL_SIZES)
+        func: Blocking callable
+        *args, **kwargs: Arguments forwarded to func
+
+    Returns:
+        The callable's return value
+    """
+    loop = asyncio.get_running_loop()
+    call = functools.partial(func, *args, **kwargs)
+    return await loop.run_in_executor(get_executor(stage), call)
+
+
+def shutdown_executors(wait=True):
+    """Shut down all stage executors (called on application shutdown)"""
+    with _lock:
+        executors = list(_executors.values())
+        _executors.clear()
+    for executor in executors:
+        executor.shutdown(wait=wait)
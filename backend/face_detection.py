@@ -1,28 +1,29 @@
-"""Face detection and alignment using MTCNN"""
+"""Face detection and alignment on top of a pluggable detector backend"""
 
-import torch
-from facenet_pytorch import MTCNN
 from PIL import Image
 import numpy as np
 import cv2
+from config import DETECTION_BATCH_SIZE, DETECTION_MAX_SIDE, DETECTION_RETRY_MAX_SIDE
+from detector_backends import create_backend
 
 class FaceDetector:
-    def __init__(self, device=None):
-        """Initialize MTCNN face detector"""
-        if device is None:
-            self.device = 'cuda' if torch.cuda.is_available() else 'cpu'
-        else:
-            self.device = device
-        
-        self.mtcnn = MTCNN(
-            image_size=512,
-            margin=40,
-            min_face_size=40,
-            thresholds=[0.6, 0.7, 0.7],
-            factor=0.709,
-            post_process=False,
-            device=self.device
-        )
+    def __init__(self, device=None, backend=None):
+        """
+        Initialize the face detector (the model is loaded on first use or by load())
+        
+        Args:
+            device: 'cpu' or 'cuda' (None = auto)
+            backend: Detector backend name, e.g. 'mtcnn', 'yunet' or 'onnx' (None = DETECTION_BACKEND)
+        """
+        self.backend = create_backend(backend, device=device)
+    
+    def load(self):
+        """Load the detector model (safe to call more than once)"""
+        self.backend.load()
+    
+    def warmup(self):
+        """Run one dummy detection so the first request does not pay for lazy initialization"""
+        self.backend.detect(np.zeros((256, 256, 3), dtype=np.uint8))
     
     def detect_and_align(self, pil_image, target_size=768):
         """
@@ -37,12 +38,97 @@ class FaceDetector:
             bbox: (x1, y1, x2, y2) bounding box coordinates
             landmarks: Face landmarks (eyes, nose, mouth)
         """
-        # Convert PIL to numpy array
-        img_array = np.array(pil_image.convert('RGB'))
+        # Detect on a downscaled proxy - the crop below still comes from the full image
+        boxes, probs, landmarks = self._detect_on_proxy(pil_image, DETECTION_MAX_SIDE)
+        
+        # Small faces can vanish in the proxy: retry once at a higher resolution
+        if boxes is None and self._needs_retry(pil_image):
+            print("No face found on detection proxy, retrying at higher resolution")
+            boxes, probs, landmarks = self._detect_on_proxy(pil_image, DETECTION_RETRY_MAX_SIDE)
+        
+        return self._select_face(pil_image, boxes, probs, landmarks, target_size)
+    
+    def _proxy_scale(self, pil_image, max_side):
+        """Scale factor that bounds the long side of the image by max_side (never upscales)"""
+        long_side = max(pil_image.size)
+        if not max_side or long_side <= max_side:
+            return 1.0
+        return max_side / long_side
+    
+    def _make_proxy(self, pil_image, max_side):
+        """Return (RGB array of the detection proxy, scale factor)"""
+        scale = self._proxy_scale(pil_image, max_side)
+        proxy = pil_image
+        if proxy.mode in ('1', 'P'):
+            proxy = proxy.convert('RGB')  # These modes can only be resized with NEAREST
+        # Downscale first, so any mode conversion only copies the small proxy
+        if scale < 1.0:
+            width, height = pil_image.size
+            proxy = proxy.resize(
+                (max(1, round(width * scale)), max(1, round(height * scale))),
+                Image.BILINEAR,
+                reducing_gap=2.0
+            )
+        if proxy.mode != 'RGB':
+            proxy = proxy.convert('RGB')
+        return np.array(proxy), scale
+    
+    def _detect_on_proxy(self, pil_image, max_side):
+        """Run the detector on a proxy and map boxes and landmarks back to full resolution"""
+        proxy, scale = self._make_proxy(pil_image, max_side)
+        boxes, probs, landmarks = self.backend.detect(proxy)
+        return self._rescale(boxes, probs, landmarks, scale)
+    
+    def _rescale(self, boxes, probs, landmarks, scale):
+        if boxes is None or scale == 1.0:
+            return boxes, probs, landmarks
+        return boxes / scale, probs, landmarks / scale
+    
+    def _needs_retry(self, pil_image):
+        """True if a retry would see more pixels than the first proxy did"""
+        if not DETECTION_RETRY_MAX_SIDE:
+            return False
+        return self._proxy_scale(pil_image, DETECTION_RETRY_MAX_SIDE) > self._proxy_scale(pil_image, DETECTION_MAX_SIDE)
+    
+    def detect_and_align_batch(self, pil_images, target_size=768, batch_size=DETECTION_BATCH_SIZE):
+        """
+        Detect faces in many images, batching detector calls where the backend can
         
-        # Detect faces and landmarks
-        boxes, probs, landmarks = self.mtcnn.detect(img_array, landmarks=True)
+        Detection runs on bounded-size proxies. MTCNN can only stack images of
+        identical size, so its backend groups proxies by size and detects each
+        group in chunks of batch_size; other backends detect one proxy at a
+        time. Images with no face on the proxy get the same higher-resolution
+        retry as detect_and_align.
         
+        Args:
+            pil_images: List of PIL Images
+            target_size: Size to resize cropped faces to
+            batch_size: Maximum number of images per batched detector call
+            
+        Returns:
+            List with one entry per image: (face_image, bbox, landmarks), or the
+            exception raised for that image (e.g. ValueError when no face is found)
+        """
+        proxies = [self._make_proxy(img, DETECTION_MAX_SIDE) for img in pil_images]
+        detections = self.backend.detect_batch([proxy for proxy, _ in proxies], batch_size)
+        results = []
+        
+        for idx, detection in enumerate(detections):
+            if isinstance(detection, Exception):
+                results.append(detection)
+                continue
+            try:
+                boxes, probs, landmarks = self._rescale(*detection, proxies[idx][1])
+                if boxes is None and self._needs_retry(pil_images[idx]):
+                    boxes, probs, landmarks = self._detect_on_proxy(pil_images[idx], DETECTION_RETRY_MAX_SIDE)
+                results.append(self._select_face(pil_images[idx], boxes, probs, landmarks, target_size))
+            except Exception as e:
+                results.append(e)
+        
+        return results
+    
+    def _select_face(self, pil_image, boxes, probs, landmarks, target_size):
+        """Pick the most confident detection and return the cropped face, bbox and landmarks"""
         if boxes is None or len(boxes) == 0:
             raise ValueError("No face detected in the image. Please upload a photo with a clear face.")
         
@@ -82,7 +168,7 @@ class FaceDetector:
         
         Args:
             pil_image: PIL Image
-            landmarks: Face landmarks from MTCNN
+            landmarks: Face landmarks from the detector
             target_size: Output size
             
         Returns:
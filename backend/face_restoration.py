@@ -1,23 +1,59 @@
 """Optional face restoration using GFPGAN"""
 
-import os
+import time
+import threading
 from PIL import Image
 import numpy as np
-from config import USE_FACE_RESTORATION
+import cv2
+from config import USE_FACE_RESTORATION, RESTORATION_MODE, RESTORATION_SHARPNESS_THRESHOLD, RESTORATION_WEIGHT
+from metrics import RESTORATION_OUTCOMES, RESTORATION_DURATION
+
+# GFPGAN's native input size (FFHQ-aligned 512x512 crops)
+GFPGAN_SIZE = 512
+# Long side the sharpness score is measured at, so it does not depend on the face's resolution
+SHARPNESS_SIZE = 256
+
+
+def sharpness_score(image):
+    """
+    Variance of the Laplacian of the grayscale image, measured at SHARPNESS_SIZE
+
+    Blurry or smeared faces score low; crisp ones score high.
+    """
+    gray = np.asarray(image.convert("L"))
+    height, width = gray.shape
+    scale = SHARPNESS_SIZE / max(width, height)
+    if scale < 1.0:
+        gray = cv2.resize(gray, (max(1, int(width * scale)), max(1, int(height * scale))), interpolation=cv2.INTER_AREA)
+    return float(cv2.Laplacian(gray, cv2.CV_32F).var())
+
 
 class FaceRestorer:
     def __init__(self):
-        """Initialize face restoration"""
+        """Initialize face restoration (GFPGAN is loaded on first use or by load())"""
         self.use_restoration = USE_FACE_RESTORATION
+        self.mode = RESTORATION_MODE
+        self.sharpness_threshold = RESTORATION_SHARPNESS_THRESHOLD
         self.restorer = None
-        
-        if self.use_restoration:
+        self._load_lock = threading.Lock()
+    
+    def load(self):
+        """Load GFPGAN if restoration is enabled (safe to call more than once)"""
+        with self._load_lock:
+            if not self.use_restoration or self.restorer is not None:
+                return
             try:
                 self._load_restorer()
             except Exception as e:
                 print(f"Could not initialize face restoration: {e}")
                 self.use_restoration = False
     
+    def warmup(self):
+        """Run one dummy restoration so the first request does not pay for lazy initialization"""
+        self.load()
+        if self.restorer is not None:
+            self.restore(Image.new("RGB", (GFPGAN_SIZE, GFPGAN_SIZE), (128, 128, 128)), force=True, record=False)
+    
     def _load_restorer(self):
         """Load GFPGAN model"""
         try:
@@ -39,37 +75,90 @@ class FaceRestorer:
             self.use_restoration = False
             self.restorer = None
     
-    def restore(self, face_image):
+    def needs_restoration(self, face_image):
+        """True unless the face is already sharper than RESTORATION_SHARPNESS_THRESHOLD (0 = always restore)"""
+        if self.sharpness_threshold <= 0:
+            return True
+        return sharpness_score(face_image) < self.sharpness_threshold
+    
+    def restore(self, face_image, force=False, record=True):
         """
         Restore/enhance face image
         
         Args:
             face_image: PIL Image
+            force: Restore even if the sharpness gate says the face does not need it
+            record: Count the outcome and duration in the restoration metrics (off for warm-up)
             
         Returns:
             restored_face: PIL Image
         """
+        if self.use_restoration and self.restorer is None:
+            self.load()
         if not self.use_restoration or self.restorer is None:
             return face_image
         
+        if not force and not self.needs_restoration(face_image):
+            if record:
+                RESTORATION_OUTCOMES.inc(outcome="skipped")
+            return face_image
+        
+        started = time.perf_counter()
         try:
-            # Convert to numpy array
-            img_array = np.array(face_image.convert('RGB'))
-            
-            # Restore
-            _, _, restored = self.restorer.enhance(
-                img_array,
-                has_aligned=False,
-                only_center_face=False,
-                paste_back=True,
-                weight=0.5
-            )
-            
-            # Convert back to PIL
-            restored_pil = Image.fromarray(restored)
-            return restored_pil
-            
+            if self.mode == "aligned":
+                restored = self._restore_aligned(face_image)
+            else:
+                restored = self._restore_full(face_image)
         except Exception as e:
             print(f"Error in face restoration: {e}")
+            if record:
+                RESTORATION_OUTCOMES.inc(outcome="error")
             return face_image
+        
+        if record:
+            RESTORATION_OUTCOMES.inc(outcome="restored")
+            RESTORATION_DURATION.observe(time.perf_counter() - started, mode=self.mode)
+        return restored
+    
+    def _restore_aligned(self, face_image):
+        """
+        Restore the already-aligned crop directly at GFPGAN's native 512x512
+        
+        FaceDetector has already found and aligned the face, so facexlib's
+        detection, alignment and paste-back are skipped.
+        """
+        size = face_image.size
+        # GFPGAN works on BGR arrays
+        bgr = cv2.cvtColor(np.asarray(face_image.convert('RGB')), cv2.COLOR_RGB2BGR)
+        if size != (GFPGAN_SIZE, GFPGAN_SIZE):
+            bgr = cv2.resize(bgr, (GFPGAN_SIZE, GFPGAN_SIZE), interpolation=cv2.INTER_LINEAR)
+        
+        _, restored_faces, _ = self.restorer.enhance(
+            bgr,
+            has_aligned=True,
+            only_center_face=True,
+            paste_back=False,
+            weight=RESTORATION_WEIGHT
+        )
+        if not restored_faces:
+            raise RuntimeError("GFPGAN returned no face")
+        
+        restored = restored_faces[0]
+        if size != (GFPGAN_SIZE, GFPGAN_SIZE):
+            restored = cv2.resize(restored, size, interpolation=cv2.INTER_AREA)
+        return Image.fromarray(cv2.cvtColor(restored, cv2.COLOR_BGR2RGB))
+    
+    def _restore_full(self, face_image):
+        """Let GFPGAN detect, align and paste back the face itself"""
+        bgr = cv2.cvtColor(np.asarray(face_image.convert('RGB')), cv2.COLOR_RGB2BGR)
+        _, _, restored = self.restorer.enhance(
+            bgr,
+            has_aligned=False,
+            only_center_face=False,
+            paste_back=True,
+            weight=RESTORATION_WEIGHT
+        )
+        if restored is None:
+            raise RuntimeError("GFPGAN found no face to restore")
+        return Image.fromarray(cv2.cvtColor(restored, cv2.COLOR_BGR2RGB))
 
@@ -0,0 +1,203 @@
+"""Upload ingest: request body size limits, streamed hashing and bounded image decoding"""
+
+import io
+import hashlib
+from PIL import Image, ImageOps
+from fastapi import HTTPException
+from config import UPLOAD_MAX_MB, REQUEST_MAX_MB, UPLOAD_MAX_MEGAPIXELS, UPLOAD_DECODE_MAX_SIDE
+
+UPLOAD_MAX_BYTES = UPLOAD_MAX_MB * 1024 * 1024
+REQUEST_MAX_BYTES = REQUEST_MAX_MB * 1024 * 1024
+UPLOAD_MAX_PIXELS = int(UPLOAD_MAX_MEGAPIXELS * 1e6) or None  # None = no limit of our own
+HASH_CHUNK_SIZE = 1024 * 1024
+# Multipart boundaries, part headers and small form fields on top of the photos themselves
+MULTIPART_OVERHEAD_BYTES = 1024 * 1024
+
+
+class UploadTooLarge(ValueError):
+    """A photo over UPLOAD_MAX_MB or UPLOAD_MAX_MEGAPIXELS (answered with 413)"""
+
+
+def upload_body_limit(photos=1, max_bytes=UPLOAD_MAX_BYTES):
+    """Request body limit for a route taking up to `photos` uploads (REQUEST_MAX_BYTES if photos are unlimited)"""
+    if max_bytes <= 0:
+        return REQUEST_MAX_BYTES
+    return photos * max_bytes + MULTIPART_OVERHEAD_BYTES
+
+
+class BodySizeLimit:
+    """
+    ASGI middleware rejecting request bodies over a per-route limit
+
+    A declared Content-Length over the limit is refused before any of the
+    body is read; chunked bodies are counted as they stream in and cut off
+    as soon as they pass the limit, so nothing over it is ever spooled.
+    """
+
+    def __init__(self, app, max_bytes=REQUEST_MAX_BYTES, route_limits=None):
+        """
+        Args:
+            app: ASGI application
+            max_bytes: Limit for paths not in route_limits (0 = no limit)
+            route_limits: {path: limit in bytes} for routes with a tighter (or looser) limit
+        """
+        self.app = app
+        self.max_bytes = max_bytes
+        self.route_limits = dict(route_limits or {})
+
+    async def __call__(self, scope, receive, send):
+        max_bytes = self.route_limits.get(scope.get("path"), self.max_bytes) if scope["type"] == "http" else 0
+        if max_bytes <= 0:
+            await self.app(scope, receive, send)
+            return
+
+        detail = f"Request body too large (max {max(1, round(max_bytes / (1024 * 1024)))} MB)"
+        for name, value in scope.get("headers", ()):
+            if name == b"content-length":
+                try:
+                    declared = int(value)
+                except ValueError:
+                    declared = 0
+                if declared > max_bytes:
+                    await _send_413(send, detail)
+                    return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > max_bytes:
+                    # Raised inside the body parser, FastAPI turns this into the 413 response
+                    raise HTTPException(status_code=413, detail=detail)
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+async def _send_413(send, detail):
+    body = ('{"detail": "%s"}' % detail).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": 413,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+def _check_size(size, max_bytes):
+    if max_bytes > 0 and size > max_bytes:
+        raise UploadTooLarge(f"Photo too large (max {max_bytes // (1024 * 1024)} MB)")
+
+
+def upload_size(source, max_bytes=UPLOAD_MAX_BYTES):
+    """
+    Size in bytes of an upload (bytes or a seekable file, which is rewound)
+
+    Raises:
+        UploadTooLarge: If it is larger than max_bytes
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        size = len(source)
+    else:
+        size = source.seek(0, io.SEEK_END)
+        source.seek(0)
+    _check_size(size, max_bytes)
+    return size
+
+
+def hash_upload(fileobj, max_bytes=UPLOAD_MAX_BYTES):
+    """
+    SHA-256 and size of a spooled upload, read in chunks (the file is rewound afterwards)
+
+    Raises:
+        UploadTooLarge: If the file is larger than max_bytes
+    """
+    digest = hashlib.sha256()
+    size = 0
+    fileobj.seek(0)
+    while True:
+        chunk = fileobj.read(HASH_CHUNK_SIZE)
+        if not chunk:
+            break
+        size += len(chunk)
+        _check_size(size, max_bytes)
+        digest.update(chunk)
+    fileobj.seek(0)
+    return digest.hexdigest(), size
+
+
+def _open_image(source, max_pixels, max_side):
+    """Open an upload without decoding it: pixel cap checked, JPEG draft scale applied"""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+    try:
+        img = Image.open(source)
+    except Image.DecompressionBombError as e:
+        raise UploadTooLarge(f"Image too large: {e}")
+    except Exception as e:
+        # The exception text can name the spooled temporary file - keep it in the log only
+        print(f"Could not open upload: {e}")
+        raise ValueError("Could not read image: unsupported or corrupt file")
+
+    width, height = img.size
+    if max_pixels and width * height > max_pixels:
+        raise UploadTooLarge(
+            f"Image too large: {width}x{height} ({width * height / 1e6:.0f} MP, max {max_pixels / 1e6:.0f} MP)"
+        )
+
+    if img.format == "JPEG" and max_side > 0 and max(width, height) > max_side:
+        scale = max_side / max(width, height)
+        img.draft("RGB", (int(width * scale + 0.5), int(height * scale + 0.5)))
+    return img
+
+
+def decoded_pixels(source, max_pixels=UPLOAD_MAX_PIXELS, max_side=UPLOAD_DECODE_MAX_SIDE):
+    """
+    Pixels decode_image() will produce for an upload, read from the header only
+    (a file is rewound afterwards)
+
+    Raises:
+        UploadTooLarge, ValueError: As decode_image()
+    """
+    try:
+        width, height = _open_image(source, max_pixels, max_side).size
+    finally:
+        if hasattr(source, "seek"):
+            source.seek(0)
+    return width * height
+
+
+def decode_image(source, max_pixels=UPLOAD_MAX_PIXELS, max_side=UPLOAD_DECODE_MAX_SIDE):
+    """
+    Decode an upload into an upright RGB PIL Image with bounded memory
+
+    The header is checked against max_pixels before any pixel data is
+    decoded. JPEGs larger than max_side are decoded at a reduced scale by the
+    JPEG decoder itself (1/2, 1/4 or 1/8 - never below max_side), and the
+    EXIF orientation is applied.
+
+    Args:
+        source: Encoded bytes or a binary file object (e.g. a spooled upload)
+        max_pixels: Largest accepted width * height (None or 0 = no limit; Pillow's own
+            decompression-bomb guard still refuses images it considers bombs)
+        max_side: Long side a JPEG may be reduced to while decoding (0 = full resolution)
+
+    Raises:
+        UploadTooLarge: If the image has more than max_pixels
+        ValueError: If the image cannot be read
+    """
+    img = _open_image(source, max_pixels, max_side)
+    try:
+        img.load()
+    except Image.DecompressionBombError as e:
+        raise UploadTooLarge(f"Image too large: {e}")
+    except Exception as e:
+        print(f"Could not decode upload: {e}")
+        raise ValueError("Could not read image: unsupported or corrupt file")
+    ImageOps.exif_transpose(img, in_place=True)
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    return img
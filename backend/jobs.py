@@ -0,0 +1,387 @@
+"""Asynchronous personalization jobs: SQLite-backed store, worker pool and progress events"""
+
+import os
+import json
+import time
+import uuid
+import sqlite3
+import asyncio
+import threading
+import traceback
+
+# Job lifecycle
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+TERMINAL_STATUSES = (COMPLETED, FAILED)
+
+# Progress stages reported while a job is running
+STAGES = ("detected", "stylized", "restored", "composited")
+
+
+class QueueFullError(Exception):
+    """Raised when the job queue cannot accept more work"""
+
+
+class JobStore:
+    def __init__(self, db_path):
+        """Open (and create if needed) the SQLite job database"""
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    stage TEXT,
+                    filename TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    input BLOB,
+                    result BLOB,
+                    result_format TEXT,
+                    error TEXT
+                )
+                """
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status)")
+
+    def create(self, contents, filename=None):
+        """Persist a new queued job and return its id"""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO jobs (id, status, filename, created_at, updated_at, input) VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, QUEUED, filename, now, now, sqlite3.Binary(contents))
+            )
+        return job_id
+
+    def get(self, job_id):
+        """Job metadata as a dict (without input/result blobs), or None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, status, stage, filename, created_at, updated_at, result_format, error "
+                "FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        return dict(row) if row is not None else None
+
+    def get_input(self, job_id):
+        with self._lock:
+            row = self._conn.execute("SELECT input FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return bytes(row["input"]) if row is not None and row["input"] is not None else None
+
+    def get_result(self, job_id):
+        """(result bytes, format) of a completed job, or None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT result, result_format FROM jobs WHERE id = ? AND status = ?", (job_id, COMPLETED)
+            ).fetchone()
+        if row is None or row["result"] is None:
+            return None
+        return bytes(row["result"]), row["result_format"]
+
+    def claim(self, job_id):
+        """Atomically move a queued job to running; False if someone else has it"""
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = ?, updated_at = ? WHERE id = ? AND status = ?",
+                (RUNNING, time.time(), job_id, QUEUED)
+            )
+        return cursor.rowcount == 1
+
+    def touch(self, job_id):
+        """Renew a running job's lease"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE jobs SET updated_at = ? WHERE id = ? AND status = ?", (time.time(), job_id, RUNNING)
+            )
+
+    def set_stage(self, job_id, stage):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE jobs SET stage = ?, updated_at = ? WHERE id = ?", (stage, time.time(), job_id)
+            )
+
+    def complete(self, job_id, result, result_format):
+        # The input is no longer needed once the result exists
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, result_format = ?, input = NULL, updated_at = ? "
+                "WHERE id = ?",
+                (COMPLETED, sqlite3.Binary(result), result_format, time.time(), job_id)
+            )
+
+    def fail(self, job_id, error):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, input = NULL, updated_at = ? WHERE id = ?",
+                (FAILED, error, time.time(), job_id)
+            )
+
+    def requeue_interrupted(self):
+        """Reset jobs left running by a previous process and return all queued job ids"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, stage = NULL, updated_at = ? WHERE status = ?",
+                (QUEUED, time.time(), RUNNING)
+            )
+        return self.queued()
+
+    def requeue_stale(self, lease):
+        """Reset running jobs whose lease (last update) is older than lease seconds; return their ids"""
+        cutoff = time.time() - lease
+        with self._lock, self._conn:
+            rows = self._conn.execute(
+                "SELECT id FROM jobs WHERE status = ? AND updated_at < ?", (RUNNING, cutoff)
+            ).fetchall()
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, stage = NULL, updated_at = ? WHERE status = ? AND updated_at < ?",
+                (QUEUED, time.time(), RUNNING, cutoff)
+            )
+        return [row["id"] for row in rows]
+
+    def queued(self):
+        """Ids of all queued jobs, oldest first"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id FROM jobs WHERE status = ? ORDER BY created_at", (QUEUED,)
+            ).fetchall()
+        return [row["id"] for row in rows]
+
+    def purge(self, max_age):
+        """Delete finished jobs older than max_age seconds"""
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?",
+                (COMPLETED, FAILED, time.time() - max_age)
+            )
+        return cursor.rowcount
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class JobManager:
+    def __init__(self, store, runner, workers=4, max_queue=100, ttl=86400, poll_interval=1.0, lease=300):
+        """
+        Initialize the job manager
+
+        Args:
+            store: JobStore
+            runner: async callable(contents, on_stage) -> (result bytes, format);
+                on_stage(stage) is awaited as each pipeline stage finishes
+            workers: Number of concurrent jobs
+            max_queue: Queue capacity before submit() is rejected
+            ttl: Seconds finished jobs are kept
+            poll_interval: Seconds between store polls while streaming events
+            lease: Seconds a running job may go without a heartbeat before any
+                process sharing the store requeues it (its worker died or was recycled)
+        """
+        self.store = store
+        self.runner = runner
+        self.workers = workers
+        self.ttl = ttl
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self._queue = asyncio.Queue(maxsize=max_queue)
+        self._tasks = []
+        self._changed = {}  # Job id -> change events of its SSE subscribers
+
+    async def start(self, requeue=True):
+        """
+        Resume persisted jobs and start the worker pool
+
+        Args:
+            requeue: Reset jobs left running to queued first. Only safe when no other
+                process shares the store - with several workers, pass False and requeue
+                once per server start instead (see serving.join_server); claim() keeps
+                each job to one worker.
+        """
+        await asyncio.to_thread(self.store.purge, self.ttl)
+        if requeue:
+            pending = await asyncio.to_thread(self.store.requeue_interrupted)
+        else:
+            pending = await asyncio.to_thread(self.store.queued)
+        for job_id in pending:
+            if self._queue.full():
+                break  # Left queued in the store; picked up on next restart
+            self._queue.put_nowait(job_id)
+        if pending:
+            print(f"Resuming {len(pending)} queued job(s)")
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._purge_loop()))
+        self._tasks.append(asyncio.create_task(self._lease_loop()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self.store.close()
+
+    async def submit(self, contents, filename=None):
+        """Persist and enqueue a job; raises QueueFullError when saturated"""
+        if self._queue.full():
+            raise QueueFullError("Job queue is full, please retry later")
+        job_id = await asyncio.to_thread(self.store.create, contents, filename)
+        try:
+            self._queue.put_nowait(job_id)
+        except asyncio.QueueFull:
+            await asyncio.to_thread(self.store.fail, job_id, "Job queue is full")
+            raise QueueFullError("Job queue is full, please retry later")
+        return job_id
+
+    async def get(self, job_id):
+        return await asyncio.to_thread(self.store.get, job_id)
+
+    async def get_result(self, job_id):
+        return await asyncio.to_thread(self.store.get_result, job_id)
+
+    async def events(self, job_id):
+        """
+        Yield Server-Sent Events for a job until it finishes
+
+        Updates made by this process wake subscribers immediately; the store is
+        also polled so jobs processed elsewhere are reported too.
+        """
+        last = None
+        changed = asyncio.Event()
+        try:
+            job = await self.get(job_id)
+            while job is not None:
+                state = (job["status"], job["stage"])
+                if state != last:
+                    last = state
+                    yield sse_event("progress", job_summary(job))
+                if job["status"] in TERMINAL_STATUSES:
+                    yield sse_event(job["status"], job_summary(job))
+                    return
+
+                # Only jobs that exist get a change event; the poll covers updates in between
+                changed.clear()
+                self._changed.setdefault(job_id, set()).add(changed)
+                try:
+                    await asyncio.wait_for(changed.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                job = await self.get(job_id)
+
+            # Unknown, or purged while streaming
+            yield sse_event("error", {"id": job_id, "error": "Job not found"})
+        finally:
+            # Also reached when the client disconnects mid-stream (the generator is closed)
+            self._unsubscribe(job_id, changed)
+
+    def _unsubscribe(self, job_id, changed):
+        subscribers = self._changed.get(job_id)
+        if subscribers is not None:
+            subscribers.discard(changed)
+            if not subscribers:
+                del self._changed[job_id]
+
+    def _notify(self, job_id):
+        for changed in self._changed.pop(job_id, ()):
+            changed.set()
+
+    async def _purge_loop(self):
+        """Keep enforcing the TTL while the server runs, not just at startup"""
+        interval = max(60.0, self.ttl / 4)
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                purged = await asyncio.to_thread(self.store.purge, self.ttl)
+                if purged:
+                    print(f"Purged {purged} finished job(s)")
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                print(traceback.format_exc())
+
+    async def _lease_loop(self):
+        """Requeue jobs whose worker stopped renewing their lease"""
+        while True:
+            await asyncio.sleep(max(1.0, self.lease / 2))
+            try:
+                stale = await asyncio.to_thread(self.store.requeue_stale, self.lease)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                print(traceback.format_exc())
+                continue
+            for job_id in stale:
+                print(f"Job {job_id}: lease expired, requeued")
+                self._notify(job_id)
+                if self._queue.full():
+                    break  # Left queued in the store for the next lease check or restart
+                self._queue.put_nowait(job_id)
+
+    async def _heartbeat(self, job_id):
+        while True:
+            await asyncio.sleep(max(1.0, self.lease / 3))
+            await asyncio.to_thread(self.store.touch, job_id)
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._process(job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                print(traceback.format_exc())
+            finally:
+                self._queue.task_done()
+
+    async def _process(self, job_id):
+        if not await asyncio.to_thread(self.store.claim, job_id):
+            return
+        self._notify(job_id)
+        print(f"Job {job_id}: started")
+
+        async def on_stage(stage):
+            await asyncio.to_thread(self.store.set_stage, job_id, stage)
+            self._notify(job_id)
+
+        heartbeat = asyncio.create_task(self._heartbeat(job_id))
+        try:
+            contents = await asyncio.to_thread(self.store.get_input, job_id)
+            result, result_format = await self.runner(contents, on_stage)
+            await asyncio.to_thread(self.store.complete, job_id, result, result_format)
+            print(f"Job {job_id}: completed")
+        except asyncio.CancelledError:
+            # Shutting down - leave the job running so it is requeued on restart
+            raise
+        except Exception as e:
+            message = str(e) if isinstance(e, ValueError) else f"Processing error: {e}"
+            if not isinstance(e, ValueError):
+                print(traceback.format_exc())
+            await asyncio.to_thread(self.store.fail, job_id, message)
+            print(f"Job {job_id}: failed - {message}")
+        finally:
+            heartbeat.cancel()
+            self._notify(job_id)
+
+
+def job_summary(job):
+    """Job fields exposed to clients"""
+    return {
+        "id": job["id"],
+        "status": job["status"],
+        "stage": job["stage"],
+        "error": job["error"],
+        "created_at": job["created_at"],
+        "updated_at": job["updated_at"],
+    }
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
@@ -0,0 +1,193 @@
+"""Local diffusers img2img pipeline with a CPU-friendly few-step configuration"""
+
+import math
+from PIL import Image
+from serving import thread_limit
+from config import (
+    LOCAL_MODEL,
+    LOCAL_SCHEDULER,
+    LOCAL_LCM_LORA,
+    LOCAL_INFERENCE_STEPS,
+    LOCAL_GUIDANCE_SCALE,
+    LOCAL_STRENGTH,
+    LOCAL_RESOLUTION,
+    LOCAL_TORCH_THREADS,
+    LOCAL_COMPILE,
+    STYLIZATION_SEED
+)
+
+# diffusers scheduler class per LOCAL_SCHEDULER ("default" keeps the model's own)
+SCHEDULERS = {
+    "lcm": "LCMScheduler",
+    "euler_a": "EulerAncestralDiscreteScheduler",
+    "dpm": "DPMSolverMultistepScheduler",
+}
+COMPILE_MODES = ("none", "torch", "onnx")
+
+
+def working_size(size, resolution=LOCAL_RESOLUTION, multiple=64):
+    """
+    Size the pipeline runs at: the long side scaled to resolution (0 = keep the
+    input's size), both sides rounded to a multiple of 64 for the UNet
+    """
+    width, height = size
+    if resolution > 0:
+        scale = resolution / max(width, height)
+        width, height = width * scale, height * scale
+    return (max(multiple, int(round(width / multiple)) * multiple),
+            max(multiple, int(round(height / multiple)) * multiple))
+
+
+class LocalDiffusionPipeline:
+    def __init__(self, model=LOCAL_MODEL, scheduler=LOCAL_SCHEDULER, steps=LOCAL_INFERENCE_STEPS,
+                 guidance_scale=LOCAL_GUIDANCE_SCALE, strength=LOCAL_STRENGTH, resolution=LOCAL_RESOLUTION,
+                 threads=LOCAL_TORCH_THREADS, compile_mode=LOCAL_COMPILE, lcm_lora=LOCAL_LCM_LORA):
+        """
+        Initialize the pipeline settings (nothing is loaded until load())
+
+        Args:
+            model: diffusers model id or local directory (any SD 1.x/2.x/SDXL/Turbo checkpoint)
+            scheduler: "default", "lcm", "euler_a" or "dpm"
+            steps: Inference steps (before img2img strength is applied)
+            guidance_scale: Classifier-free guidance (0 or 1 disables the unconditional pass)
+            strength: img2img strength
+            resolution: Long side of the working size (0 = the input's size)
+            threads: torch intra-op threads (0 = torch default)
+            compile_mode: "none", "torch" (torch.compile the UNet) or "onnx" (ONNX Runtime via optimum)
+            lcm_lora: Optional LCM-LoRA adapter to fuse into the model
+        """
+        if scheduler != "default" and scheduler not in SCHEDULERS:
+            raise ValueError(f"Unknown local scheduler: {scheduler} (choose from default, {', '.join(SCHEDULERS)})")
+        if compile_mode not in COMPILE_MODES:
+            raise ValueError(f"Unknown local compile mode: {compile_mode} (choose from {', '.join(COMPILE_MODES)})")
+        self.model = model
+        self.scheduler = scheduler
+        self.steps = steps
+        self.guidance_scale = guidance_scale
+        self.strength = strength
+        self.resolution = resolution
+        self.threads = threads
+        self.compile_mode = compile_mode
+        self.lcm_lora = lcm_lora
+        self.device = None
+        self.pipe = None
+
+    @property
+    def identity(self):
+        """Everything that changes the output (part of the stylization cache key)"""
+        lora = f"+{self.lcm_lora}" if self.lcm_lora else ""
+        return (f"{self.model}{lora}:{self.scheduler}:steps={self.steps}:cfg={self.guidance_scale}"
+                f":strength={self.strength}:res={self.resolution}")
+
+    @property
+    def deterministic(self):
+        """True if the same input always gives the same output (a seed is set; the ONNX path takes none)"""
+        return bool(STYLIZATION_SEED) and self.compile_mode != "onnx"
+
+    def load(self):
+        """Load the model onto the GPU if there is one, else the CPU"""
+        import torch
+
+        # A model loaded after the fork must not lift the worker's cap from limit_threads
+        threads = [n for n in (self.threads, thread_limit()) if n > 0]
+        if threads:
+            torch.set_num_threads(min(threads))
+        self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        dtype = torch.float16 if self.device == "cuda" else torch.float32
+
+        print(f"Loading local diffusion pipeline {self.model} on {self.device} "
+              f"({self.scheduler} scheduler, {self.steps} steps, compile={self.compile_mode})...")
+        if self.compile_mode == "onnx":
+            pipe = self._load_onnx()
+        else:
+            pipe = self._load_torch(dtype)
+
+        if self.scheduler != "default":
+            import diffusers
+            scheduler_class = getattr(diffusers, SCHEDULERS[self.scheduler])
+            pipe.scheduler = scheduler_class.from_config(pipe.scheduler.config)
+        pipe.set_progress_bar_config(disable=True)
+
+        if self.device == "cpu" and self.steps > 8:
+            print("Warning: Running many diffusion steps on CPU. Consider LOCAL_SCHEDULER=lcm or a Turbo model.")
+        self.pipe = pipe
+        print("Local diffusion pipeline loaded")
+
+    def _load_torch(self, dtype):
+        import torch
+        try:
+            from diffusers import AutoPipelineForImage2Image
+        except ImportError:
+            # diffusers < 0.21 has no auto pipeline; the model must be SDXL
+            from diffusers import StableDiffusionXLImg2ImgPipeline as AutoPipelineForImage2Image
+
+        pipe = AutoPipelineForImage2Image.from_pretrained(
+            self.model,
+            torch_dtype=dtype,
+            variant="fp16" if dtype == torch.float16 else None
+        )
+        if self.lcm_lora:
+            pipe.load_lora_weights(self.lcm_lora)
+            pipe.fuse_lora()
+        pipe = pipe.to(self.device)
+        if self.device == "cuda":
+            pipe.enable_attention_slicing()  # Reduce memory usage
+
+        if self.compile_mode == "torch":
+            if hasattr(torch, "compile"):
+                pipe.unet = torch.compile(pipe.unet, mode="reduce-overhead", fullgraph=False)
+            else:
+                print("Warning: torch.compile needs torch >= 2.0, running the UNet uncompiled")
+        return pipe
+
+    def _load_onnx(self):
+        """Export (or load an exported) model to ONNX Runtime via optimum"""
+        from optimum.onnxruntime import ORTStableDiffusionImg2ImgPipeline, ORTStableDiffusionXLImg2ImgPipeline
+
+        pipeline_class = ORTStableDiffusionXLImg2ImgPipeline if "xl" in self.model.lower() else ORTStableDiffusionImg2ImgPipeline
+        # export=True converts a PyTorch checkpoint on first load; an exported directory loads as-is
+        return pipeline_class.from_pretrained(self.model, export=True)
+
+    def __call__(self, face_image, prompt, negative_prompt):
+        """
+        Stylize one face
+
+        Args:
+            face_image: PIL Image of face
+            prompt: Prompt
+            negative_prompt: Negative prompt
+
+        Returns:
+            PIL Image at the input's size
+        """
+        if self.pipe is None:
+            raise RuntimeError("Local diffusion pipeline is not loaded")
+        size = face_image.size
+        image = face_image.convert("RGB").resize(working_size(size, self.resolution), Image.LANCZOS)
+
+        # img2img runs int(steps * strength) steps - keep at least one
+        steps = max(self.steps, math.ceil(1.0 / max(self.strength, 1e-3)))
+        kwargs = {
+            "prompt": prompt,
+            "image": image,
+            "strength": self.strength,
+            "num_inference_steps": steps,
+            "guidance_scale": self.guidance_scale,
+        }
+        # Negative prompts only apply with classifier-free guidance
+        if self.guidance_scale > 1.0:
+            kwargs["negative_prompt"] = negative_prompt
+
+        if self.compile_mode == "onnx":
+            result = self.pipe(**kwargs)
+        else:
+            import torch
+            if STYLIZATION_SEED:
+                kwargs["generator"] = torch.Generator(device=self.device).manual_seed(STYLIZATION_SEED)
+            with torch.inference_mode():
+                result = self.pipe(**kwargs)
+
+        stylized = result.images[0]
+        if stylized.size != size:
+            stylized = stylized.resize(size, Image.LANCZOS)
+        return stylized
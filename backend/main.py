@@ -1,20 +1,72 @@
 """FastAPI backend for photo personalization"""
 
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi import FastAPI, File, Form, Header, Query, UploadFile, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-import uvicorn
-from PIL import Image
-import io
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.routing import Match
+from typing import List
+import asyncio
+import hashlib
 import base64
+import json
 import os
+import time
 import traceback
 
 from face_detection import FaceDetector
 from stylization import FaceStylizer
 from compositing import TemplateCompositor
 from face_restoration import FaceRestorer
-from config import OUTPUT_FORMAT, OUTPUT_QUALITY
+from template_registry import resolve_template, book_pages
+from encoding import (
+    MEDIA_TYPES, FILE_EXTENSIONS, OutputOptions, encode_timed, encode_thumbnail, negotiate_format, iter_chunks
+)
+from warmup import ComponentWarmup
+from coalescing import SingleFlight, IdempotencyStore, SharedIdempotencyStore, StoredResponse
+from jobs import JobStore, JobManager, QueueFullError, COMPLETED, job_summary, sse_event
+from executors import run_in_stage, shutdown_executors
+from serving import run as serve, join_server
+from ingest import (
+    BodySizeLimit, UploadTooLarge, decode_image, decoded_pixels, hash_upload, upload_size, upload_body_limit
+)
+from session_store import SessionStore, SessionArtifacts
+from metrics import (
+    REGISTRY,
+    REQUEST_DURATION,
+    REQUESTS_TOTAL,
+    REQUESTS_IN_FLIGHT,
+    STYLIZATION_CACHE,
+    INPUT_BYTES,
+    INPUT_MEGAPIXELS,
+    clear_snapshots,
+    track_stage,
+    start_trace,
+    end_trace,
+    annotate
+)
+from config import (
+    MAX_BATCH_SIZE,
+    BATCH_MAX_MEGAPIXELS,
+    MAX_BOOK_PAGES,
+    RESULT_CACHE_MAX_AGE,
+    JOB_DB_PATH,
+    WEB_CONCURRENCY,
+    METRICS_DIR,
+    METRICS_FLUSH_SECONDS,
+    SERVER_LOCK_PATH,
+    JOB_WORKERS,
+    JOB_QUEUE_SIZE,
+    JOB_TTL_SECONDS,
+    JOB_EVENT_POLL_SECONDS,
+    JOB_LEASE_SECONDS,
+    IDEMPOTENCY_TTL_SECONDS,
+    IDEMPOTENCY_MAX_ENTRIES,
+    IDEMPOTENCY_MAX_MB,
+    IDEMPOTENCY_DB_PATH,
+    SESSION_STORE_DIR,
+    SESSION_TTL_SECONDS,
+    SESSION_STORE_MB
+)
 
 app = FastAPI(title="PictoBook AI Personalization API")
 
@@ -32,6 +84,18 @@ if os.getenv("FRONTEND_URL"):
     if frontend_url not in allowed_origins:
         allowed_origins.append(frontend_url)
 
+# Request bodies are refused while they stream in once they pass their route's limit:
+# one photo (UPLOAD_MAX_MB) for single-photo routes, MAX_BATCH_SIZE photos for a batch,
+# REQUEST_MAX_MB elsewhere
+app.add_middleware(BodySizeLimit, route_limits={
+    "/personalize": upload_body_limit(),
+    "/personalize/progressive": upload_body_limit(),
+    "/personalize/book": upload_body_limit(),
+    "/jobs": upload_body_limit(),
+    "/recomposite": upload_body_limit(photos=0),
+    "/personalize/batch": upload_body_limit(photos=MAX_BATCH_SIZE),
+})
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=allowed_origins,
@@ -42,86 +106,807 @@ app.add_middleware(
     max_age=3600,  # Cache preflight requests for 1 hour
 )
 
-# Initialize components
+# Initialize components - construction is cheap, models load in the background at startup
 face_detector = FaceDetector()
 stylizer = FaceStylizer()
 compositor = TemplateCompositor()
 restorer = FaceRestorer()
 
+warmup = ComponentWarmup()
+warmup.add("detection", face_detector.load, warmup=face_detector.warmup)
+warmup.add("stylization", stylizer.load)
+warmup.add("templates", compositor.registry.scan)
+warmup.add("restoration", restorer.load, warmup=restorer.warmup,
+           enabled=lambda: restorer.use_restoration, required=False)
+
+# Duplicate uploads share one pipeline run; Idempotency-Key responses are replayed.
+# Coalescing is per worker process - with several workers, duplicates racing on
+# different workers both run, but the disk stylization cache serves finished
+# results to all of them. Stored responses are shared through SQLite.
+pipeline_flight = SingleFlight()
+idempotency_limits = dict(
+    ttl=IDEMPOTENCY_TTL_SECONDS,
+    max_entries=IDEMPOTENCY_MAX_ENTRIES,
+    max_bytes=IDEMPOTENCY_MAX_MB * 1024 * 1024
+)
+if WEB_CONCURRENCY > 1:
+    idempotency_store = SharedIdempotencyStore(IDEMPOTENCY_DB_PATH, **idempotency_limits)
+else:
+    idempotency_store = IdempotencyStore(**idempotency_limits)
+
+# Stylized faces kept per upload, so other templates can be tried without re-stylizing
+session_store = SessionStore(
+    SESSION_STORE_DIR,
+    ttl=SESSION_TTL_SECONDS,
+    max_bytes=SESSION_STORE_MB * 1024 * 1024
+) if SESSION_STORE_DIR else None
+
+job_manager = None
+metrics_flush = None
+
+# Endpoints that are polled by probes/scrapers - counted, but not logged per request
+UNLOGGED_PATHS = ("/", "/health", "/ready", "/metrics")
+
+def _collect_cache_stats():
+    if stylizer.cache is None:
+        return
+    for stat, value in stylizer.cache.stats().items():
+        STYLIZATION_CACHE.set(value, stat=stat)
+
+REGISTRY.add_collector(_collect_cache_stats)
+REGISTRY.add_collector(stylizer.router.collect_metrics)
+
+def _route_path(scope):
+    """Route template for a request (e.g. /jobs/{job_id}) to keep metric labels bounded"""
+    for route in app.router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return getattr(route, "path", "unmatched")
+    return "unmatched"
+
+class ObserveRequests:
+    """
+    ASGI middleware recording request metrics and the structured log line
+    
+    Runs around the whole response, so streamed bodies (/personalize/progressive,
+    job events) are measured until their last chunk rather than their headers.
+    """
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        endpoint = _route_path(scope)
+        trace, token = start_trace(endpoint)
+        REQUESTS_IN_FLIGHT.inc(endpoint=endpoint)
+        status = 500
+        
+        async def observed_send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+        
+        try:
+            await self.app(scope, receive, observed_send)
+        finally:
+            REQUESTS_IN_FLIGHT.dec(endpoint=endpoint)
+            REQUESTS_TOTAL.inc(endpoint=endpoint, status=status)
+            REQUEST_DURATION.observe(time.perf_counter() - trace.started, endpoint=endpoint)
+            if endpoint not in UNLOGGED_PATHS:
+                trace.log(status)
+            end_trace(token)
+
+app.add_middleware(ObserveRequests)
+
+@app.on_event("startup")
+async def startup():
+    global job_manager, metrics_flush
+    
+    # Load models, run dummy inferences and decode templates without blocking startup
+    warmup.start()
+    
+    job_manager = JobManager(
+        JobStore(JOB_DB_PATH),
+        _run_job,
+        workers=JOB_WORKERS,
+        max_queue=JOB_QUEUE_SIZE,
+        ttl=JOB_TTL_SECONDS,
+        poll_interval=JOB_EVENT_POLL_SECONDS,
+        lease=JOB_LEASE_SECONDS
+    )
+    # The first process of the server requeues interrupted jobs, while the others wait
+    await asyncio.to_thread(join_server, SERVER_LOCK_PATH, _reset_previous_run)
+    await job_manager.start(requeue=False)
+    
+    if WEB_CONCURRENCY > 1:
+        metrics_flush = asyncio.create_task(_flush_metrics())
+
+@app.on_event("shutdown")
+async def shutdown():
+    if metrics_flush is not None:
+        metrics_flush.cancel()
+        # Final snapshot, so a recycled worker's counts are kept in full
+        await asyncio.to_thread(REGISTRY.write_snapshot, METRICS_DIR)
+    if job_manager is not None:
+        await job_manager.stop()
+    await stylizer.aclose()
+    shutdown_executors(wait=False)
+
+async def _flush_metrics():
+    """Write this worker's metrics snapshot periodically for /metrics in any worker to merge"""
+    while True:
+        try:
+            await asyncio.to_thread(REGISTRY.write_snapshot, METRICS_DIR)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Could not write metrics snapshot: {e}")
+        await asyncio.sleep(METRICS_FLUSH_SECONDS)
+
+def _preload():
+    """Master process of the pre-fork server: load models once, before forking"""
+    warmup.preload()
+
+def _reset_previous_run():
+    """Run by the first server process to start: drop stale metric snapshots, requeue interrupted jobs"""
+    clear_snapshots(METRICS_DIR)
+    store = JobStore(JOB_DB_PATH)
+    try:
+        store.requeue_interrupted()
+    finally:
+        store.close()
+
+def _decode_upload(source):
+    """Decode an upload (bytes or spooled file) into an upright RGB PIL Image, within the size limits"""
+    size = upload_size(source)
+    img = decode_image(source)
+    INPUT_BYTES.observe(size)
+    INPUT_MEGAPIXELS.observe(img.width * img.height / 1e6)
+    return img
+
+async def _read_upload(photo):
+    """Upload bytes for requests that outlive the handler (stream, job); 413 past UPLOAD_MAX_MB"""
+    try:
+        await run_in_stage("decode", upload_size, photo.file)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    return await photo.read()
+
+async def _run_stage(stage, func, *args, **kwargs):
+    """run_in_stage with per-stage timing and in-flight metrics"""
+    with track_stage(stage):
+        return await run_in_stage(stage, func, *args, **kwargs)
+
+def _output_options(output_format=None, quality=None, preset=None, thumbnail=None):
+    """Validate per-request output parameters (400 on a bad value)"""
+    try:
+        return OutputOptions.parse(output_format, quality, preset, thumbnail)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+async def _encode(image, options, thumbnail=True):
+    """
+    Encode the final image, plus its preview thumbnail if requested, in parallel
+    
+    Returns:
+        (EncodedImage, EncodedImage or None)
+    """
+    if not (thumbnail and options.thumbnail):
+        return await _run_stage("encoding", encode_timed, image, options), None
+    encoded, thumb = await asyncio.gather(
+        _run_stage("encoding", encode_timed, image, options),
+        _run_stage("encoding", encode_thumbnail, image, options)
+    )
+    return encoded, thumb
+
+def _encoded_fields(encoded, thumb=None):
+    """JSON fields for an encoded result: base64 image, format and encoding metadata"""
+    fields = {
+        "image_base64": base64.b64encode(encoded.data).decode("utf-8"),
+        "format": encoded.format.lower(),
+        "encoding": encoded.metadata(),
+    }
+    if thumb is not None:
+        fields["thumbnail_base64"] = base64.b64encode(thumb.data).decode("utf-8")
+        fields["encoding"]["thumbnail"] = thumb.metadata()
+    return fields
+
+def _image_headers(data, fmt, filename="personalized", encoded=None):
+    """Length and caching headers for an encoded image"""
+    extension = FILE_EXTENSIONS[fmt]
+    headers = {
+        "Content-Length": str(len(data)),
+        "Cache-Control": f"private, max-age={RESULT_CACHE_MAX_AGE}",
+        "ETag": f'"{hashlib.blake2b(data, digest_size=16).hexdigest()}"',
+        "Content-Disposition": f'inline; filename="{filename}.{extension}"',
+        "Vary": "Accept",
+    }
+    if encoded is not None:
+        headers["X-Encode-Ms"] = f"{encoded.encode_ms:.1f}"
+    return headers
+
+def _image_response(data, fmt, filename="personalized", encoded=None):
+    """Stream encoded image bytes with length and caching headers"""
+    return StreamingResponse(iter_chunks(data), media_type=MEDIA_TYPES[fmt],
+                             headers=_image_headers(data, fmt, filename, encoded))
+
+def _replay_response(stored):
+    """Rebuild a response stored for an Idempotency-Key"""
+    headers = dict(stored.headers)
+    headers["Idempotent-Replayed"] = "true"
+    return Response(content=stored.body, media_type=stored.media_type,
+                    headers=headers, status_code=stored.status_code)
+
+async def _save_session(face_img, stylized_face, bbox, landmarks, filename=None):
+    """Store a request's artifacts for /recomposite; returns the session token (None if disabled or failed)"""
+    if session_store is None:
+        return None
+    artifacts = SessionArtifacts(stylized_face, face_img, bbox, landmarks=landmarks, filename=filename)
+    try:
+        return await run_in_stage("encoding", session_store.save, artifacts)
+    except Exception as e:
+        # A missing token only costs the client a re-stylization later
+        print(f"Warning: Could not store session: {e}")
+        return None
+
+async def _personalize_image(img, filename=None):
+    """
+    Steps 1-4 of the pipeline for a decoded photo
+    
+    Returns:
+        (composited PIL Image, session token or None)
+    """
+    print(f"Processing image: {filename}, size: {img.size}")
+    
+    # Step 1: Detect and align face
+    print("Step 1: Detecting face...")
+    face_img, bbox, landmarks = await _run_stage("detection", face_detector.detect_and_align, img)
+    print(f"Face detected at: {bbox}")
+    
+    # Step 2-3: Stylize face, then optional face restoration
+    print("Step 2: Stylizing face...")
+    stylized_face = await _stylize_and_restore(face_img)
+    print("Stylization complete")
+    
+    # Step 4: Composite into template, storing the session's artifacts meanwhile
+    print("Step 4: Compositing into template...")
+    final_image, session_token = await asyncio.gather(
+        _run_stage("compositing", compositor.composite, stylized_face, bbox, landmarks=landmarks),
+        _save_session(face_img, stylized_face, bbox, landmarks, filename)
+    )
+    print("Compositing complete")
+    
+    return final_image, session_token
+
+async def _stylize_and_restore(face_img):
+    """Stylize a detected face and run optional face restoration"""
+    with track_stage("stylization"):
+        stylized_face = await stylizer.stylize_face_async(face_img)
+    if restorer.use_restoration:
+        stylized_face = await _run_stage("restoration", restorer.restore, stylized_face)
+    return stylized_face
+
+async def _run_job(contents, on_stage):
+    """Full pipeline for a queued job, reporting progress after each stage"""
+    img = await _run_stage("decode", _decode_upload, contents)
+    
+    face_img, bbox, landmarks = await _run_stage("detection", face_detector.detect_and_align, img)
+    await on_stage("detected")
+    
+    with track_stage("stylization"):
+        stylized_face = await stylizer.stylize_face_async(face_img)
+    await on_stage("stylized")
+    
+    if restorer.use_restoration:
+        stylized_face = await _run_stage("restoration", restorer.restore, stylized_face)
+        await on_stage("restored")
+    
+    final_image = await _run_stage("compositing", compositor.composite, stylized_face, bbox, landmarks=landmarks)
+    await on_stage("composited")
+    
+    encoded = await _run_stage("encoding", encode_timed, final_image, OutputOptions())
+    return encoded.data, encoded.format
+
+def _render_preview(face_img, bbox, landmarks):
+    """Basic-enhanced detected face composited into a reduced-resolution template"""
+    return compositor.composite_preview(stylizer.preview_face(face_img), bbox, landmarks=landmarks)
+
+async def _progressive_events(contents, filename, options):
+    """
+    Server-Sent Events for /personalize/progressive: a preview as soon as the
+    face is found, then the full result once stylization finishes
+    """
+    started = time.perf_counter()
+    stylization = None
+    
+    def elapsed_ms():
+        return round((time.perf_counter() - started) * 1000.0, 1)
+    
+    try:
+        img = await _run_stage("decode", _decode_upload, contents)
+        print(f"Processing progressive request: {filename}, size: {img.size}")
+        face_img, bbox, landmarks = await _run_stage("detection", face_detector.detect_and_align, img)
+        
+        # Start the real stylization right away; the preview is built while it runs
+        stylization = asyncio.ensure_future(_stylize_and_restore(face_img))
+        preview = await _run_stage("compositing", _render_preview, face_img, bbox, landmarks)
+        encoded = await _run_stage("encoding", encode_timed, preview, OutputOptions(options.format, preset="fast"))
+        yield sse_event("preview", dict({"elapsed_ms": elapsed_ms()}, **_encoded_fields(encoded)))
+        
+        stylized_face = await stylization
+        final_image, session_token = await asyncio.gather(
+            _run_stage("compositing", compositor.composite, stylized_face, bbox, landmarks=landmarks),
+            _save_session(face_img, stylized_face, bbox, landmarks, filename)
+        )
+        encoded, thumb = await _encode(final_image, options)
+        result = {"status": "success", "elapsed_ms": elapsed_ms(), "session_token": session_token}
+        yield sse_event("result", dict(result, **_encoded_fields(encoded, thumb)))
+        
+    except UploadTooLarge as e:
+        yield sse_event("error", {"status_code": 413, "detail": str(e)})
+    except ValueError as e:
+        yield sse_event("error", {"status_code": 400, "detail": str(e)})
+    except Exception as e:
+        print(f"Error: {e}")
+        print(traceback.format_exc())
+        yield sse_event("error", {"status_code": 500, "detail": f"Processing error: {e}"})
+    finally:
+        # The client went away before the result - don't keep paying for the stylization
+        if stylization is not None and not stylization.done():
+            stylization.cancel()
+
 @app.get("/")
 async def root():
     return {"message": "PictoBook AI Personalization API", "status": "running"}
 
 @app.get("/health")
 async def health():
+    """Liveness probe - the process is up and serving"""
     return {"status": "healthy"}
 
+@app.get("/ready")
+async def ready():
+    """Readiness probe - passes once every component is loaded and warm"""
+    status = warmup.status()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
+@app.get("/metrics")
+async def metrics():
+    """
+    Prometheus metrics: stage latencies, in-flight gauges, provider outcomes, cache stats
+    
+    With several workers, the snapshots of all of them are merged (at most
+    METRICS_FLUSH_SECONDS old); gauges carry a worker label.
+    """
+    if WEB_CONCURRENCY > 1:
+        text = await asyncio.to_thread(REGISTRY.render_multiprocess, METRICS_DIR)
+    else:
+        text = REGISTRY.render()
+    return PlainTextResponse(text, media_type="text/plain; version=0.0.4")
+
 @app.post("/personalize")
-async def personalize(photo: UploadFile = File(...)):
+async def personalize(
+    photo: UploadFile = File(...),
+    accept: str = Header(None),
+    idempotency_key: str = Header(None),
+    output_format: str = Query(None, alias="format"),
+    quality: int = Query(None),
+    preset: str = Query(None),
+    thumbnail: int = Query(None)
+):
     """
     Personalize a photo by detecting face, stylizing, and compositing into template
     
+    Concurrent requests for the same upload share one pipeline run. With an
+    Idempotency-Key header, a repeated request replays the stored response.
+    
     Args:
         photo: Uploaded image file
+        accept: Accept header - image/png, image/jpeg, image/webp or image/avif returns raw bytes
+        idempotency_key: Optional Idempotency-Key header
+        output_format: ?format= png, jpeg, webp or avif (overrides the Accept header's image type)
+        quality: ?quality= 1-100 for lossy formats (default from the preset)
+        preset: ?preset= fast, balanced or small
+        thumbnail: ?thumbnail= long side of a preview thumbnail returned alongside (JSON only)
         
     Returns:
-        JSON with base64 encoded result image
+        The encoded image, or JSON with base64 encoded result image and encoding metadata (legacy default).
+        Either carries a session token for /recomposite (X-Session-Token header / session_token field).
     """
     try:
-        # Read uploaded image
-        contents = await photo.read()
-        img = Image.open(io.BytesIO(contents)).convert("RGB")
-        
-        print(f"Processing image: {photo.filename}, size: {img.size}")
-        
-        # Step 1: Detect and align face
-        print("Step 1: Detecting face...")
-        face_img, bbox, landmarks = face_detector.detect_and_align(img)
-        print(f"Face detected at: {bbox}")
-        
-        # Step 2: Stylize face
-        print("Step 2: Stylizing face...")
-        stylized_face = stylizer.stylize_face(face_img)
-        print("Stylization complete")
-        
-        # Step 3: Optional face restoration
-        if restorer.use_restoration:
-            print("Step 3: Restoring face...")
-            stylized_face = restorer.restore(stylized_face)
-            print("Face restoration complete")
-        
-        # Step 4: Composite into template
-        print("Step 4: Compositing into template...")
-        final_image = compositor.composite(stylized_face, bbox)
-        print("Compositing complete")
-        
-        # Step 5: Convert to base64
-        buf = io.BytesIO()
-        if OUTPUT_FORMAT == "PNG":
-            final_image.save(buf, format="PNG")
+        options = _output_options(output_format, quality, preset, thumbnail)
+        binary_format = negotiate_format(accept)
+        if binary_format is not None and output_format:
+            binary_format = options.format
+        elif binary_format is not None:
+            options.format = binary_format
+        # Hash the spooled upload in chunks - it is never read into memory as a whole
+        upload_hash, upload_size_bytes = await run_in_stage("decode", hash_upload, photo.file)
+        
+        fingerprint = f"{upload_hash}:{binary_format}:{options.key()}"
+        if idempotency_key:
+            stored = await asyncio.to_thread(idempotency_store.get, idempotency_key)
+            if stored is not None:
+                if stored.fingerprint != fingerprint:
+                    raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request")
+                print(f"Replaying stored response for Idempotency-Key {idempotency_key}")
+                return _replay_response(stored)
+        
+        # Decoded here rather than in the shared run: the upload's spooled file is
+        # closed when its own request ends, which may be before the run completes
+        img = await _run_stage("decode", _decode_upload, photo.file)
+        annotate(input_size=list(img.size), input_bytes=upload_size_bytes)
+        
+        # Steps 1-4, shared with any identical request already in flight
+        final_image, session_token = await pipeline_flight.run(
+            upload_hash, lambda: _personalize_image(img, photo.filename)
+        )
+        
+        # Step 5: Encode - raw bytes if the client asked for an image type
+        if binary_format is not None:
+            encoded, _ = await _encode(final_image, options, thumbnail=False)
+            data = encoded.data
+            headers = _image_headers(data, binary_format, encoded=encoded)
+            if session_token:
+                headers["X-Session-Token"] = session_token
+            stored = StoredResponse(fingerprint, data, MEDIA_TYPES[binary_format], headers)
+            response = StreamingResponse(iter_chunks(data), media_type=MEDIA_TYPES[binary_format], headers=headers)
         else:
-            final_image.save(buf, format="JPEG", quality=OUTPUT_QUALITY)
+            encoded, thumb = await _encode(final_image, options)
+            body = {"status": "success", "session_token": session_token}
+            body.update(_encoded_fields(encoded, thumb))
+            stored = StoredResponse(fingerprint, json.dumps(body).encode("utf-8"), "application/json")
+            response = JSONResponse(body)
         
-        b64 = base64.b64encode(buf.getvalue()).decode("utf-8")
+        if idempotency_key:
+            await asyncio.to_thread(idempotency_store.put, idempotency_key, stored)
         
         print("Processing complete!")
+        return response
+        
+    except HTTPException:
+        raise
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValueError as e:
+        # Face detection error
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        # Other errors
+        error_msg = str(e)
+        print(f"Error: {error_msg}")
+        print(traceback.format_exc())
+        raise HTTPException(status_code=500, detail=f"Processing error: {error_msg}")
+
+@app.post("/personalize/batch")
+async def personalize_batch(
+    photos: List[UploadFile] = File(...),
+    output_format: str = Query(None, alias="format"),
+    quality: int = Query(None),
+    preset: str = Query(None),
+    thumbnail: int = Query(None)
+):
+    """
+    Personalize many photos in one request
+    
+    Faces are detected with batched MTCNN calls, then stylization and
+    compositing fan out concurrently. A failing photo does not fail the batch.
+    
+    Args:
+        photos: Uploaded image files
+        output_format, quality, preset, thumbnail: Output options, as for /personalize
+        
+    Returns:
+        JSON with one result (base64 image or error) per photo, in upload order
+    """
+    options = _output_options(output_format, quality, preset, thumbnail)
+    if len(photos) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=400, detail=f"Too many photos (max {MAX_BATCH_SIZE})")
+    
+    print(f"Processing batch of {len(photos)} photos")
+    
+    # Every decoded image is held until batched detection, so bound the batch's total
+    # from the headers first (unreadable photos fail individually below)
+    if BATCH_MAX_MEGAPIXELS > 0:
+        pixels = await asyncio.gather(
+            *(run_in_stage("decode", decoded_pixels, photo.file) for photo in photos),
+            return_exceptions=True
+        )
+        total = sum(count for count in pixels if isinstance(count, int)) / 1e6
+        if total > BATCH_MAX_MEGAPIXELS:
+            raise HTTPException(
+                status_code=413,
+                detail=f"Batch too large: {total:.0f} MP of images (max {BATCH_MAX_MEGAPIXELS:.0f} MP), split it up"
+            )
+    
+    # Decoded straight from the spooled uploads, DECODE_WORKERS at a time
+    decoded = await asyncio.gather(
+        *(_run_stage("decode", _decode_upload, photo.file) for photo in photos),
+        return_exceptions=True
+    )
+    
+    # Batched detection over every image that decoded
+    valid = [idx for idx, img in enumerate(decoded) if not isinstance(img, Exception)]
+    detections = dict(zip(valid, await _run_stage(
+        "detection", face_detector.detect_and_align_batch, [decoded[idx] for idx in valid]
+    )))
+    
+    async def process(idx):
+        result = {"index": idx, "filename": photos[idx].filename}
+        try:
+            if isinstance(decoded[idx], ValueError):
+                raise decoded[idx]
+            if isinstance(decoded[idx], Exception):
+                raise ValueError(f"Could not read image: {decoded[idx]}")
+            detection = detections[idx]
+            if isinstance(detection, Exception):
+                raise detection
+            face_img, bbox, landmarks = detection
+            
+            stylized_face = await _stylize_and_restore(face_img)
+            final_image = await _run_stage("compositing", compositor.composite, stylized_face, bbox, landmarks=landmarks)
+            encoded, thumb = await _encode(final_image, options)
+            result["status"] = "success"
+            result.update(_encoded_fields(encoded, thumb))
+        except ValueError as e:
+            result.update({"status": "error", "error": str(e)})
+        except Exception as e:
+            print(f"Error processing {photos[idx].filename}: {e}")
+            print(traceback.format_exc())
+            result.update({"status": "error", "error": f"Processing error: {e}"})
+        return result
+    
+    results = await asyncio.gather(*(process(idx) for idx in range(len(photos))))
+    succeeded = sum(1 for result in results if result["status"] == "success")
+    print(f"Batch complete: {succeeded}/{len(photos)} succeeded")
+    
+    if succeeded == len(photos):
+        status = "success"
+    elif succeeded == 0:
+        status = "error"
+    else:
+        status = "partial"
+    
+    return JSONResponse({"status": status, "results": results})
+
+@app.post("/personalize/book")
+async def personalize_book(
+    photo: UploadFile = File(...),
+    book: str = Form(None),
+    templates: str = Form(None),
+    output_format: str = Query(None, alias="format"),
+    quality: int = Query(None),
+    preset: str = Query(None),
+    thumbnail: int = Query(None)
+):
+    """
+    Personalize every page of a book from one photo
+    
+    The face is detected and stylized once, then composited into all pages
+    in parallel.
+    
+    Args:
+        photo: Uploaded image file
+        book: Name of a book directory under BOOK_DIR
+        templates: Comma-separated template ids (alternative to book)
+        output_format, quality, preset, thumbnail: Output options, as for /personalize
+        
+    Returns:
+        JSON with one base64 encoded image per page, in page order
+    """
+    options = _output_options(output_format, quality, preset, thumbnail)
+    try:
+        if book:
+            page_paths = book_pages(book)
+        elif templates:
+            page_paths = [resolve_template(t.strip()) for t in templates.split(",") if t.strip()]
+        else:
+            raise ValueError("Provide either a book name or a list of templates")
+        if not page_paths:
+            raise ValueError("No templates given")
+        if len(page_paths) > MAX_BOOK_PAGES:
+            raise ValueError(f"Too many pages (max {MAX_BOOK_PAGES})")
+        
+        img = await _run_stage("decode", _decode_upload, photo.file)
+        print(f"Processing book ({len(page_paths)} pages) for image: {photo.filename}, size: {img.size}")
+        
+        # Detect and stylize once for the whole book
+        face_img, bbox, landmarks = await _run_stage("detection", face_detector.detect_and_align, img)
+        stylized_face = await _stylize_and_restore(face_img)
+        
+        # Composite every page in parallel on the compositing executor (waited on from
+        # a default-pool thread, never from the pool itself), then encode them in parallel
+        with track_stage("compositing"):
+            pages = await asyncio.to_thread(
+                compositor.composite_pages, stylized_face, page_paths, bbox, landmarks=landmarks
+            )
+        encoded_pages = await asyncio.gather(*(_encode(page, options) for page in pages))
+        print(f"Book complete: {len(encoded_pages)} pages")
         
         return JSONResponse({
             "status": "success",
-            "image_base64": b64,
-            "format": OUTPUT_FORMAT.lower()
+            "format": options.format.lower(),
+            "encoding": {
+                "bytes": sum(len(encoded.data) for encoded, _ in encoded_pages),
+                "encode_ms": round(sum(encoded.encode_ms for encoded, _ in encoded_pages), 1),
+            },
+            "pages": [
+                dict({"page": idx + 1, "template": os.path.basename(path)}, **_encoded_fields(encoded, thumb))
+                for idx, (path, (encoded, thumb)) in enumerate(zip(page_paths, encoded_pages))
+            ]
         })
         
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
     except ValueError as e:
-        # Face detection error
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        # Other errors
         error_msg = str(e)
         print(f"Error: {error_msg}")
         print(traceback.format_exc())
         raise HTTPException(status_code=500, detail=f"Processing error: {error_msg}")
 
+@app.post("/recomposite")
+async def recomposite(
+    session_token: str = Form(...),
+    template: str = Form(...),
+    accept: str = Header(None),
+    output_format: str = Query(None, alias="format"),
+    quality: int = Query(None),
+    preset: str = Query(None),
+    thumbnail: int = Query(None)
+):
+    """
+    Composite a stored session's stylized face into another template
+    
+    Only compositing and encoding run - no detection, stylization or
+    restoration - so trying out templates for one photo is cheap.
+    
+    Args:
+        session_token: Token returned by /personalize or /personalize/progressive
+        template: Template id
+        accept: Accept header - an image type returns raw bytes, as for /personalize
+        output_format, quality, preset, thumbnail: Output options, as for /personalize
+        
+    Returns:
+        The encoded image, or JSON with base64 encoded result image and encoding metadata
+    """
+    options = _output_options(output_format, quality, preset, thumbnail)
+    binary_format = negotiate_format(accept)
+    if binary_format is not None and output_format:
+        binary_format = options.format
+    elif binary_format is not None:
+        options.format = binary_format
+    
+    if session_store is None:
+        raise HTTPException(status_code=404, detail="Sessions are disabled")
+    try:
+        template_path = resolve_template(template)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    session = await _run_stage("decode", session_store.get, session_token)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Session not found or expired")
+    
+    try:
+        final_image = await _run_stage("compositing", compositor.composite, session.face, session.bbox,
+                                       template_path, landmarks=session.landmarks)
+        
+        if binary_format is not None:
+            encoded, _ = await _encode(final_image, options, thumbnail=False)
+            return _image_response(encoded.data, binary_format, encoded=encoded)
+        encoded, thumb = await _encode(final_image, options)
+        body = {"status": "success", "session_token": session_token, "template": os.path.basename(template_path)}
+        body.update(_encoded_fields(encoded, thumb))
+        return JSONResponse(body)
+        
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        error_msg = str(e)
+        print(f"Error: {error_msg}")
+        print(traceback.format_exc())
+        raise HTTPException(status_code=500, detail=f"Processing error: {error_msg}")
+
+@app.post("/personalize/progressive")
+async def personalize_progressive(
+    photo: UploadFile = File(...),
+    output_format: str = Query(None, alias="format"),
+    quality: int = Query(None),
+    preset: str = Query(None),
+    thumbnail: int = Query(None)
+):
+    """
+    Personalize a photo, streaming a quick preview before the full result
+    
+    The response is a Server-Sent Events stream:
+        preview: the detected face with basic enhancement, composited into a
+            reduced-resolution template (sent before stylization finishes)
+        result: the full stylized composite, with the same fields as /personalize
+        error: {"status_code", "detail"} if the request fails
+    
+    Args:
+        photo: Uploaded image file
+        output_format, quality, preset, thumbnail: Output options for the result, as for /personalize
+    """
+    options = _output_options(output_format, quality, preset, thumbnail)
+    contents = await _read_upload(photo)
+    return StreamingResponse(
+        _progressive_events(contents, photo.filename, options),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.post("/jobs", status_code=202)
+async def create_job(photo: UploadFile = File(...)):
+    """
+    Queue a personalization job and return immediately
+    
+    Args:
+        photo: Uploaded image file
+        
+    Returns:
+        JSON with the job id and URLs for status, progress events and result
+    """
+    contents = await _read_upload(photo)
+    try:
+        job_id = await job_manager.submit(contents, photo.filename)
+    except QueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "10"})
+    
+    return {
+        "job_id": job_id,
+        "status": "queued",
+        "status_url": f"/jobs/{job_id}",
+        "events_url": f"/jobs/{job_id}/events",
+        "result_url": f"/jobs/{job_id}/result",
+    }
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Job status, with the base64 encoded result once completed"""
+    job = await job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    
+    response = job_summary(job)
+    if job["status"] == COMPLETED:
+        result = await job_manager.get_result(job_id)
+        if result is not None:
+            data, fmt = result
+            response["image_base64"] = base64.b64encode(data).decode("utf-8")
+            response["format"] = fmt.lower()
+    return response
+
+@app.get("/jobs/{job_id}/result")
+async def get_job_result(job_id: str):
+    """Raw encoded result image of a completed job"""
+    result = await job_manager.get_result(job_id)
+    if result is None:
+        job = await job_manager.get(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail="Job not found")
+        raise HTTPException(status_code=409, detail=f"Job is {job['status']}")
+    data, fmt = result
+    return _image_response(data, fmt, filename=job_id)
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    """Server-Sent Events stream of per-stage progress"""
+    if await job_manager.get(job_id) is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return StreamingResponse(
+        job_manager.events(job_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 if __name__ == "__main__":
     # Create templates directory if it doesn't exist
     os.makedirs("templates", exist_ok=True)
@@ -135,5 +920,5 @@ if __name__ == "__main__":
     print(f"API docs at: http://0.0.0.0:{port}/docs")
     print("=" * 50)
     
-    uvicorn.run(app, host="0.0.0.0", port=port, log_level="info")
+    serve(app, port, WEB_CONCURRENCY, preload=_preload)
 
@@ -0,0 +1,352 @@
+"""Lightweight in-process metrics with Prometheus text exposition"""
+
+import os
+import json
+import time
+import bisect
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# Default latency buckets in seconds (pipeline stages range from ms to minutes)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        escaped = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{escaped}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def snapshot(self):
+        """Copy of the current values, keyed by label values"""
+        with self._lock:
+            return dict(self._values)
+
+    def merge(self, values, key, value):
+        """Add another process's value for key into values"""
+        values[key] = values.get(key, 0) + value
+
+    def render(self, values=None, label_names=None):
+        """Exposition lines for this metric's values (or the given merged values and label names)"""
+        values = self.snapshot() if values is None else values
+        label_names = self.label_names if label_names is None else label_names
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+        for key, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(label_names, key)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, description, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {key: [[*counts], total, count] for key, (counts, total, count) in self._values.items()}
+
+    def merge(self, values, key, value):
+        counts, total, count = value
+        state = values.get(key)
+        if state is None:
+            values[key] = [[*counts], total, count]
+            return
+        state[0] = [a + b for a, b in zip(state[0], counts)]
+        state[1] += total
+        state[2] += count
+
+    def render(self, values=None, label_names=None):
+        values = self.snapshot() if values is None else values
+        label_names = self.label_names if label_names is None else label_names
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+        names = label_names + ("le",)
+        for key, (counts, total, count) in sorted(values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_format_labels(names, key + (_format_value(bound),))} {cumulative}")
+            labels = _format_labels(label_names, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name, description, labels=()):
+        return self._register(Counter(name, description, labels))
+
+    def gauge(self, name, description, labels=()):
+        return self._register(Gauge(name, description, labels))
+
+    def histogram(self, name, description, labels=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, description, labels, buckets))
+
+    def add_collector(self, collector):
+        """Register a callable run before each scrape (e.g. to copy cache stats into gauges)"""
+        self._collectors.append(collector)
+
+    def collect(self):
+        """Run the registered collectors"""
+        for collector in self._collectors:
+            try:
+                collector()
+            except Exception as e:
+                print(f"Metrics collector failed: {e}")
+
+    def render(self):
+        """Prometheus text exposition format"""
+        self.collect()
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def write_snapshot(self, directory):
+        """Save this process's values as directory/<pid>.json, for render_multiprocess() in any worker"""
+        self.collect()
+        data = {
+            metric.name: [[list(key), value] for key, value in metric.snapshot().items()]
+            for metric in self._metrics
+        }
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{os.getpid()}.json")
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    def render_multiprocess(self, directory):
+        """
+        Exposition merged from every worker's snapshot in directory
+
+        Counters and histograms are summed over all snapshots, including those
+        of workers that have exited, so totals do not drop when gunicorn
+        recycles a worker. Gauges describe a live process: they get a worker
+        label, and exited workers' gauges are left out.
+        """
+        self.write_snapshot(directory)
+        merged = {metric.name: {} for metric in self._metrics}
+        for name in os.listdir(directory):
+            if not name.endswith(".json"):
+                continue
+            try:
+                pid = int(name[:-len(".json")])
+                with open(os.path.join(directory, name), "r", encoding="utf-8") as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            alive = _process_alive(pid)
+            for metric in self._metrics:
+                values = merged[metric.name]
+                for key, value in data.get(metric.name, ()):
+                    key = tuple(key)
+                    if metric.kind == "gauge":
+                        if alive:
+                            values[key + (str(pid),)] = value
+                    else:
+                        metric.merge(values, key, value)
+
+        lines = []
+        for metric in self._metrics:
+            label_names = metric.label_names + ("worker",) if metric.kind == "gauge" else None
+            lines.extend(metric.render(merged[metric.name], label_names))
+        return "\n".join(lines) + "\n"
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+
+def _process_alive(pid):
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass  # Exists, owned by someone else
+    return True
+
+
+def clear_snapshots(directory):
+    """Start a multi-worker server with an empty snapshot directory"""
+    os.makedirs(directory, exist_ok=True)
+    for name in os.listdir(directory):
+        if name.endswith((".json", ".tmp")):
+            os.remove(os.path.join(directory, name))
+
+
+REGISTRY = Registry()
+
+STAGE_DURATION = REGISTRY.histogram(
+    "pictobook_stage_duration_seconds", "Time spent in each pipeline stage", ("stage",)
+)
+STAGE_IN_FLIGHT = REGISTRY.gauge(
+    "pictobook_stage_in_flight", "Pipeline stages currently executing", ("stage",)
+)
+REQUEST_DURATION = REGISTRY.histogram(
+    "pictobook_request_duration_seconds", "End-to-end request latency", ("endpoint",)
+)
+REQUESTS_TOTAL = REGISTRY.counter(
+    "pictobook_requests_total", "Requests by endpoint and status code", ("endpoint", "status")
+)
+REQUESTS_IN_FLIGHT = REGISTRY.gauge(
+    "pictobook_requests_in_flight", "Requests currently being handled", ("endpoint",)
+)
+STYLIZATION_OUTCOMES = REGISTRY.counter(
+    "pictobook_stylization_total", "Stylization results by provider and outcome (success, fallback, cache_hit)",
+    ("provider", "outcome")
+)
+PROVIDER_LATENCY = REGISTRY.histogram(
+    "pictobook_stylization_provider_seconds", "Stylization provider call latency", ("provider", "outcome")
+)
+PROVIDER_HEDGES = REGISTRY.counter(
+    "pictobook_stylization_hedges_total", "Hedged duplicate requests by the provider they were sent to", ("provider",)
+)
+PROVIDER_CIRCUIT_OPEN = REGISTRY.gauge(
+    "pictobook_stylization_circuit_open", "1 while a provider's circuit breaker is open", ("provider",)
+)
+RESTORATION_OUTCOMES = REGISTRY.counter(
+    "pictobook_restoration_total", "Face restoration calls by outcome (restored, skipped, error)", ("outcome",)
+)
+RESTORATION_DURATION = REGISTRY.histogram(
+    "pictobook_restoration_seconds", "GFPGAN time per restored face", ("mode",)
+)
+STYLIZATION_CACHE = REGISTRY.gauge(
+    "pictobook_stylization_cache", "Stylization cache counters and hit ratio", ("stat",)
+)
+INPUT_MEGAPIXELS = REGISTRY.histogram(
+    "pictobook_input_megapixels", "Decoded upload size in megapixels", (),
+    buckets=(0.5, 1, 2, 4, 8, 12, 16, 24, 32, 48, 64)
+)
+INPUT_BYTES = REGISTRY.histogram(
+    "pictobook_input_bytes", "Upload size in bytes", (),
+    buckets=(1e5, 5e5, 1e6, 2e6, 5e6, 1e7, 2e7, 5e7)
+)
+
+
+# Per-request trace collected for the structured log line
+_current_trace = contextvars.ContextVar("pictobook_trace", default=None)
+
+
+class RequestTrace:
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.fields = {}
+
+    def add_stage(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def log(self, status):
+        record = {
+            "event": "request",
+            "endpoint": self.endpoint,
+            "status": status,
+            "duration_ms": round((time.perf_counter() - self.started) * 1000, 1),
+            "stages_ms": {stage: round(seconds * 1000, 1) for stage, seconds in self.stages.items()},
+        }
+        record.update(self.fields)
+        print(json.dumps(record))
+
+
+def start_trace(endpoint):
+    """Begin collecting stage timings for the current request"""
+    trace = RequestTrace(endpoint)
+    return trace, _current_trace.set(trace)
+
+
+def end_trace(token):
+    _current_trace.reset(token)
+
+
+def annotate(**fields):
+    """Attach extra fields to the current request's log line"""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.fields.update(fields)
+
+
+@contextmanager
+def track_stage(stage):
+    """Time a pipeline stage: histogram, in-flight gauge and the request's log line"""
+    STAGE_IN_FLIGHT.inc(stage=stage)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_IN_FLIGHT.dec(stage=stage)
+        STAGE_DURATION.observe(elapsed, stage=stage)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add_stage(stage, elapsed)
@@ -0,0 +1,275 @@
+"""Latency-aware routing between stylization providers with hedging and circuit breakers"""
+
+import time
+import asyncio
+import threading
+from collections import deque
+from metrics import PROVIDER_LATENCY, PROVIDER_HEDGES, PROVIDER_CIRCUIT_OPEN
+
+
+class NoProviderAvailable(RuntimeError):
+    """Every configured provider is disabled or has an open circuit"""
+
+
+class ProviderStats:
+    """Rolling window of call latencies and outcomes for one provider"""
+
+    def __init__(self, window=50):
+        self._calls = deque(maxlen=window)  # (latency seconds, ok)
+        self._lock = threading.Lock()
+
+    def record(self, latency, ok):
+        with self._lock:
+            self._calls.append((latency, ok))
+
+    def snapshot(self):
+        with self._lock:
+            calls = list(self._calls)
+        successes = sorted(latency for latency, ok in calls if ok)
+        return {
+            "calls": len(calls),
+            "error_rate": (len(calls) - len(successes)) / len(calls) if calls else 0.0,
+            "p50": _percentile(successes, 0.50),
+            "p95": _percentile(successes, 0.95),
+            "samples": len(successes),
+        }
+
+
+class CircuitBreaker:
+    """
+    Closed -> open after `failures` consecutive errors; after `cooldown`
+    seconds a single half-open probe decides whether it closes again.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failures=3, cooldown=30.0):
+        self.failures = failures
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self._consecutive = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def available(self):
+        """True if a call may be routed here (without claiming the half-open probe)"""
+        with self._lock:
+            if self.state == self.OPEN:
+                return time.monotonic() - self._opened_at >= self.cooldown
+            return not (self.state == self.HALF_OPEN and self._probing)
+
+    def acquire(self):
+        """Claim permission for one call; False if the circuit is open or a probe is in flight"""
+        with self._lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.cooldown:
+                    return False
+                self.state = self.HALF_OPEN
+                self._probing = False
+            if self.state == self.HALF_OPEN:
+                if self._probing:
+                    return False
+                self._probing = True
+            return True
+
+    def release(self):
+        """Give back a claimed call that was cancelled before it produced an outcome"""
+        with self._lock:
+            self._probing = False
+
+    def record(self, ok):
+        with self._lock:
+            self._probing = False
+            if ok:
+                self._consecutive = 0
+                self.state = self.CLOSED
+                return
+            self._consecutive += 1
+            if self.state == self.HALF_OPEN or self._consecutive >= self.failures:
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+
+
+class ProviderRouter:
+    def __init__(self, window=50, min_samples=5, breaker_failures=3, breaker_cooldown=30.0,
+                 hedging=True, hedge_delay=30.0, min_hedge_delay=2.0):
+        """
+        Initialize the router
+
+        Args:
+            window: Calls per provider kept for latency and error statistics
+            min_samples: Successful calls needed before a provider's p95 is trusted
+            breaker_failures: Consecutive failures that open a provider's circuit
+            breaker_cooldown: Seconds an open circuit waits before a half-open probe
+            hedging: Start a duplicate request on the next provider when the first is slow
+            hedge_delay: Hedge delay used until the primary has min_samples successes
+            min_hedge_delay: Lower bound on the hedge delay (keeps fast providers from always hedging)
+        """
+        self.window = window
+        self.min_samples = min_samples
+        self.breaker_failures = breaker_failures
+        self.breaker_cooldown = breaker_cooldown
+        self.hedging = hedging
+        self.hedge_delay = hedge_delay
+        self.min_hedge_delay = min_hedge_delay
+        self._stats = {}
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def _state(self, name):
+        with self._lock:
+            if name not in self._stats:
+                self._stats[name] = ProviderStats(self.window)
+                self._breakers[name] = CircuitBreaker(self.breaker_failures, self.breaker_cooldown)
+            return self._stats[name], self._breakers[name]
+
+    def rank(self, names):
+        """
+        Order providers for one request: healthy providers with enough history
+        by expected latency (p50 inflated by error rate), then untried ones in
+        configured priority order. Providers with an open circuit are left out.
+        """
+        measured, untried = [], []
+        for priority, name in enumerate(names):
+            stats, breaker = self._state(name)
+            if not breaker.available():
+                continue
+            snapshot = stats.snapshot()
+            if snapshot["samples"] >= self.min_samples:
+                cost = snapshot["p50"] / max(0.05, 1.0 - snapshot["error_rate"])
+                measured.append((cost, priority, name))
+            else:
+                untried.append((priority, name))
+        return [name for _, _, name in sorted(measured)] + [name for _, name in sorted(untried)]
+
+    def hedge_after(self, name):
+        """Seconds to wait on a provider before hedging: its p95, once known"""
+        snapshot = self._state(name)[0].snapshot()
+        if snapshot["samples"] < self.min_samples:
+            return self.hedge_delay
+        return max(self.min_hedge_delay, snapshot["p95"])
+
+    def _record(self, name, latency, ok):
+        stats, breaker = self._state(name)
+        stats.record(latency, ok)
+        breaker.record(ok)
+        PROVIDER_LATENCY.observe(latency, provider=name, outcome="success" if ok else "error")
+
+    def call(self, providers):
+        """
+        Synchronous routing: try providers in rank order until one succeeds (no hedging)
+
+        Args:
+            providers: Ordered dict-like {name: zero-argument callable}, in priority order
+
+        Returns:
+            (result, provider name)
+        """
+        last_error = None
+        for name in self.rank(list(providers)):
+            breaker = self._state(name)[1]
+            if not breaker.acquire():
+                continue
+            started = time.perf_counter()
+            try:
+                result = providers[name]()
+            except Exception as e:
+                self._record(name, time.perf_counter() - started, False)
+                print(f"Stylization provider {name} failed: {e}")
+                last_error = e
+                continue
+            self._record(name, time.perf_counter() - started, True)
+            return result, name
+        raise last_error or NoProviderAvailable("No stylization provider available")
+
+    async def call_async(self, providers):
+        """
+        Route one request: start the best provider, hedge onto the next one if
+        it runs past its p95, fail over on errors, and return the first success
+
+        Args:
+            providers: Ordered dict-like {name: zero-argument coroutine function}, in priority order
+
+        Returns:
+            (result, provider name)
+        """
+        queue = self.rank(list(providers))
+        pending = {}
+        last_error = None
+        hedged = False
+
+        async def attempt(name):
+            started = time.perf_counter()
+            try:
+                result = await providers[name]()
+            except asyncio.CancelledError:
+                self._state(name)[1].release()
+                raise
+            except Exception:
+                self._record(name, time.perf_counter() - started, False)
+                raise
+            self._record(name, time.perf_counter() - started, True)
+            return result
+
+        def start_next():
+            while queue:
+                name = queue.pop(0)
+                if self._state(name)[1].acquire():
+                    pending[asyncio.ensure_future(attempt(name))] = name
+                    return name
+            return None
+
+        primary = start_next()
+        try:
+            while pending:
+                timeout = None
+                if self.hedging and not hedged and queue and len(pending) == 1:
+                    timeout = self.hedge_after(primary)
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+                if not done:
+                    hedged = True
+                    backup = start_next()
+                    if backup is not None:
+                        PROVIDER_HEDGES.inc(provider=backup)
+                        print(f"Stylization provider {primary} slower than {timeout:.1f}s, hedging with {backup}")
+                    continue
+
+                for task in done:
+                    name = pending.pop(task)
+                    if task.exception() is None:
+                        return task.result(), name
+                    last_error = task.exception()
+                    print(f"Stylization provider {name} failed: {last_error}")
+
+                if not pending:
+                    primary = start_next()
+        finally:
+            # The losing hedge (or anything left after an error) is no longer needed
+            for task in pending:
+                task.cancel()
+
+        raise last_error or NoProviderAvailable("No stylization provider available")
+
+    def status(self):
+        """Per-provider statistics and circuit state (for /metrics)"""
+        with self._lock:
+            names = list(self._stats)
+        status = {}
+        for name in names:
+            stats, breaker = self._state(name)
+            status[name] = dict(stats.snapshot(), circuit=breaker.state)
+        return status
+
+    def collect_metrics(self):
+        for name, status in self.status().items():
+            PROVIDER_CIRCUIT_OPEN.set(1 if status["circuit"] == CircuitBreaker.OPEN else 0, provider=name)
+
+
+def _percentile(ordered, fraction):
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
@@ -0,0 +1,170 @@
+"""Multi-worker serving: gunicorn with pre-forked uvicorn workers sharing preloaded models"""
+
+import gc
+import os
+import sys
+import importlib.util
+
+import uvicorn
+from config import WEB_CONCURRENCY, WORKER_THREADS, WORKER_TIMEOUT
+
+try:
+    import fcntl
+except ImportError:  # Windows - only a single worker is served there
+    fcntl = None
+
+# Held (shared) by every running server process for as long as it lives
+_server_lock = None
+# Per-worker thread cap set by limit_threads (0 = none)
+_thread_limit = 0
+
+
+def available_cores():
+    """CPU cores this process may run on (respects container/affinity limits)"""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def threads_per_worker(workers=WEB_CONCURRENCY, threads=WORKER_THREADS):
+    """Intra-op threads for each worker: configured, or the cores split evenly between workers"""
+    if threads > 0:
+        return threads
+    return max(1, available_cores() // max(1, workers))
+
+
+def limit_threads(threads):
+    """Cap torch and OpenCV intra-op threads in this process"""
+    global _thread_limit
+    _thread_limit = threads
+    try:
+        import cv2
+        cv2.setNumThreads(threads)
+    except ImportError:
+        pass
+    # Only if the detector/stylizer already imported torch - importing it here would defeat lazy loading
+    torch = sys.modules.get("torch")
+    if torch is not None:
+        # Never raise a lower count already set (LOCAL_TORCH_THREADS on a preloaded model)
+        torch.set_num_threads(min(threads, torch.get_num_threads()))
+
+
+def join_server(lock_path, reset=None):
+    """
+    Register this process as a running server process; the first one resets
+    what the previous run left behind
+
+    Every server process holds a shared lock on lock_path until it exits. A
+    process that can take the lock exclusively is the only one running, so
+    the server is (re)starting - however it was launched (gunicorn, uvicorn
+    --workers, a single process). Startups are serialized on a second lock
+    file and reset() runs while it is held, so no other worker gets going
+    before the reset is done.
+
+    Args:
+        lock_path: Lock file shared by all processes of the server
+        reset: Called in the first process only, before any other process proceeds
+
+    Returns:
+        True if this was the first process
+    """
+    global _server_lock
+    if _server_lock is not None:
+        return False
+    if fcntl is None:
+        _server_lock = True
+        if reset is not None:
+            reset()
+        return True
+    directory = os.path.dirname(lock_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    lock = open(lock_path, "a")
+    with open(lock_path + ".startup", "a") as startup:
+        fcntl.flock(startup, fcntl.LOCK_EX)
+        try:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                first = True
+            except BlockingIOError:
+                first = False
+            if first and reset is not None:
+                reset()
+            # Other processes only test the lock while holding the startup lock, so
+            # downgrading (which briefly releases it) cannot let one slip in
+            fcntl.flock(lock, fcntl.LOCK_SH)
+        finally:
+            fcntl.flock(startup, fcntl.LOCK_UN)
+    _server_lock = lock
+    return first
+
+
+def thread_limit():
+    """Per-worker thread cap set by limit_threads, or 0 if there is none"""
+    return _thread_limit
+
+
+def _worker_class():
+    # uvicorn.workers is deprecated in favor of the separate uvicorn-worker package
+    if importlib.util.find_spec("uvicorn_worker") is not None:
+        return "uvicorn_worker.UvicornWorker"
+    return "uvicorn.workers.UvicornWorker"
+
+
+def run(app, port, workers=WEB_CONCURRENCY, preload=None, host="0.0.0.0"):
+    """
+    Serve the app; with more than one worker, pre-fork under gunicorn
+
+    Args:
+        app: ASGI application (already imported in this, the master, process)
+        port: Port to bind
+        workers: Number of worker processes
+        preload: Optional callable run in the master before forking (load models, ...)
+        host: Interface to bind
+    """
+    if workers <= 1:
+        uvicorn.run(app, host=host, port=port, log_level="info")
+        return
+
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        print("Warning: gunicorn is not installed (or not supported on this platform); "
+              "serving with a single worker. Install it with: pip install gunicorn")
+        uvicorn.run(app, host=host, port=port, log_level="info")
+        return
+
+    threads = threads_per_worker(workers)
+    # Read by OpenMP/MKL when torch first initializes them, in the master and every worker
+    for name in ("OMP_NUM_THREADS", "MKL_NUM_THREADS"):
+        os.environ.setdefault(name, str(threads))
+
+    if preload is not None:
+        preload()
+    # Move everything allocated so far out of the garbage collector's reach, so
+    # collections in the workers do not write to (and un-share) the preloaded pages
+    gc.freeze()
+
+    def post_fork(server, worker):
+        limit_threads(threads)
+
+    class PreforkApplication(BaseApplication):
+        def load_config(self):
+            options = {
+                "bind": f"{host}:{port}",
+                "workers": workers,
+                "worker_class": _worker_class(),
+                "preload_app": True,
+                "timeout": WORKER_TIMEOUT,
+                "graceful_timeout": WORKER_TIMEOUT,
+                "post_fork": post_fork,
+            }
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return app
+
+    print(f"Serving with {workers} workers, {threads} torch/OpenCV thread(s) each")
+    PreforkApplication().run()
@@ -0,0 +1,176 @@
+"""Per-session pipeline artifacts on local disk, so a photo can be re-composited without re-stylizing"""
+
+import os
+import io
+import json
+import time
+import shutil
+import secrets
+import tempfile
+import threading
+import numpy as np
+from PIL import Image
+
+META_FILE = "session.json"
+FACE_FILE = "face.png"
+CROP_FILE = "crop.png"
+TOKEN_BYTES = 24
+TMP_PREFIX = ".tmp-"
+TMP_GRACE_SECONDS = 600  # Temporary directories older than this are left over from crashed saves
+
+
+class SessionArtifacts:
+    """What the expensive steps produced for one upload"""
+
+    def __init__(self, face, crop, bbox, landmarks=None, filename=None):
+        self.face = face  # Stylized (and restored) face
+        self.crop = crop  # Aligned face crop before stylization
+        self.bbox = bbox
+        self.landmarks = landmarks
+        self.filename = filename
+
+
+class SessionStore:
+    def __init__(self, store_dir, ttl=3600, max_bytes=512 * 1024 * 1024, sweep_interval=30.0):
+        """
+        Initialize the store
+
+        Each session is a directory named by its token, shared by every worker
+        process on the host. Expired sessions are dropped when read, and a save
+        sweeps the store at most every sweep_interval seconds; beyond max_bytes
+        the least recently used go first.
+
+        Args:
+            store_dir: Directory holding one sub-directory per session
+            ttl: Seconds a session stays usable after it was created
+            max_bytes: Size cap of all sessions together (may be exceeded for up to sweep_interval)
+            sweep_interval: Minimum seconds between sweeps triggered by save()
+        """
+        self.store_dir = store_dir
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sweep_interval = sweep_interval
+        self._last_sweep = 0.0
+        self._sweep_lock = threading.Lock()
+        os.makedirs(self.store_dir, exist_ok=True)
+
+    def save(self, artifacts):
+        """Store a session's artifacts and return its token"""
+        token = secrets.token_urlsafe(TOKEN_BYTES)
+        landmarks = artifacts.landmarks
+        meta = {
+            "created_at": time.time(),
+            "bbox": [int(v) for v in artifacts.bbox],
+            "landmarks": np.asarray(landmarks, dtype=float).reshape(-1, 2).tolist() if landmarks is not None else None,
+            "filename": artifacts.filename,
+        }
+
+        # Written to a temporary directory first, so a session is either complete or absent
+        tmp_dir = tempfile.mkdtemp(dir=self.store_dir, prefix=TMP_PREFIX)
+        try:
+            artifacts.face.save(os.path.join(tmp_dir, FACE_FILE), format="PNG", compress_level=1)
+            artifacts.crop.save(os.path.join(tmp_dir, CROP_FILE), format="PNG", compress_level=1)
+            with open(os.path.join(tmp_dir, META_FILE), "w", encoding="utf-8") as f:
+                json.dump(meta, f)
+            os.replace(tmp_dir, os.path.join(self.store_dir, token))
+        except BaseException:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+
+        # Sweeping stats every session, so it is not done on every save
+        if time.monotonic() - self._last_sweep >= self.sweep_interval:
+            self.sweep()
+        return token
+
+    def get(self, token):
+        """Return the SessionArtifacts for a token, or None if unknown or expired"""
+        path = self._session_path(token)
+        if path is None:
+            return None
+        meta_path = os.path.join(path, META_FILE)
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if time.time() - meta["created_at"] > self.ttl:
+                self._remove(path)
+                return None
+            face = _read_image(os.path.join(path, FACE_FILE))
+            crop = _read_image(os.path.join(path, CROP_FILE))
+            os.utime(meta_path)  # Track recency for eviction
+        except (OSError, ValueError, KeyError) as e:
+            if os.path.isdir(path):
+                print(f"Discarding unreadable session {token[:8]}: {e}")
+                self._remove(path)
+            return None
+
+        landmarks = meta.get("landmarks")
+        return SessionArtifacts(
+            face, crop, tuple(meta["bbox"]),
+            landmarks=np.asarray(landmarks, dtype=np.float32) if landmarks is not None else None,
+            filename=meta.get("filename")
+        )
+
+    def delete(self, token):
+        path = self._session_path(token)
+        if path is not None:
+            self._remove(path)
+
+    def sweep(self):
+        """Remove expired sessions, then least recently used ones until the store fits max_bytes"""
+        if not self._sweep_lock.acquire(blocking=False):
+            return  # Another thread is already sweeping
+        try:
+            self._last_sweep = time.monotonic()
+            now = time.time()
+            live = []
+            for name in os.listdir(self.store_dir):
+                path = os.path.join(self.store_dir, name)
+                if name.startswith(TMP_PREFIX):
+                    # A save in progress (possibly in another worker) - only leftovers are removed
+                    if _age(path, now) > TMP_GRACE_SECONDS:
+                        self._remove(path)
+                    continue
+                try:
+                    # The face is never rewritten, so its mtime is the creation time;
+                    # the metadata's mtime is bumped on every read
+                    created = os.stat(os.path.join(path, FACE_FILE)).st_mtime
+                    last_used = os.stat(os.path.join(path, META_FILE)).st_mtime
+                    size = sum(entry.stat().st_size for entry in os.scandir(path))
+                except OSError:
+                    continue  # Removed meanwhile
+                if now - created > self.ttl:
+                    self._remove(path)
+                    continue
+                live.append((last_used, size, path))
+
+            total = sum(size for _, size, _ in live)
+            for _, size, path in sorted(live):
+                if total <= self.max_bytes:
+                    break
+                self._remove(path)
+                total -= size
+        finally:
+            self._sweep_lock.release()
+
+    def _session_path(self, token):
+        # Tokens are URL-safe base64; anything else never names a session directory
+        if not token or len(token) > 64 or not all(c.isalnum() or c in "-_" for c in token):
+            return None
+        return os.path.join(self.store_dir, token)
+
+    def _remove(self, path):
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def _read_image(path):
+    with open(path, "rb") as f:
+        image = Image.open(io.BytesIO(f.read()))
+        image.load()
+    return image
+
+
+def _age(path, now):
+    try:
+        return now - os.stat(path).st_mtime
+    except OSError:
+        return 0.0
@@ -3,90 +3,183 @@
 import os
 import io
 import base64
+import asyncio
+import random
+import functools
+import threading
+import importlib.util
 from PIL import Image
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
+from executors import run_in_stage
+from stylization_cache import StylizationCache
+from metrics import STYLIZATION_OUTCOMES
+from provider_router import ProviderRouter
+from local_diffusion import LocalDiffusionPipeline
 from config import (
     STYLIZATION_PROMPT,
     NEGATIVE_PROMPT,
     STYLIZATION_STRENGTH,
     NUM_INFERENCE_STEPS,
     GUIDANCE_SCALE,
+    STYLIZATION_SEED,
+    STYLIZATION_CACHE_ENABLED,
+    STYLIZATION_CACHE_MEMORY_ITEMS,
+    STYLIZATION_CACHE_DIR,
+    STYLIZATION_CACHE_DISK_MB,
+    STYLIZATION_ROUTER_WINDOW,
+    STYLIZATION_ROUTER_MIN_SAMPLES,
+    STYLIZATION_BREAKER_FAILURES,
+    STYLIZATION_BREAKER_COOLDOWN,
+    STYLIZATION_HEDGING,
+    STYLIZATION_HEDGE_DELAY,
+    STYLIZATION_MIN_HEDGE_DELAY,
     USE_NVIDIA_NIM,
     NVIDIA_NIM_API_KEY,
     NVIDIA_NIM_MODEL,
     NVIDIA_NIM_BASE_URL,
+    NVIDIA_NIM_TIMEOUT,
+    NVIDIA_NIM_MAX_CONNECTIONS,
+    NVIDIA_NIM_MAX_KEEPALIVE,
+    NVIDIA_NIM_KEEPALIVE_EXPIRY,
+    NVIDIA_NIM_HTTP2,
+    NVIDIA_NIM_MAX_RETRIES,
+    NVIDIA_NIM_RETRY_BACKOFF,
     USE_REPLICATE,
     REPLICATE_API_TOKEN,
     USE_HUGGINGFACE,
     HUGGINGFACE_API_TOKEN,
     HUGGINGFACE_MODEL,
     HUGGINGFACE_PROVIDER,
-    USE_LOCAL_SDXL
+    USE_LOCAL_SDXL,
+    LOCAL_MODEL
 )
 
-# Optional imports for local models (only if USE_LOCAL_SDXL is True)
-try:
-    import replicate
-    REPLICATE_AVAILABLE = True
-except ImportError:
-    REPLICATE_AVAILABLE = False
+def _module_available(name):
+    """Check for an optional dependency without importing it"""
+    try:
+        return importlib.util.find_spec(name) is not None
+    except (ImportError, ValueError):
+        return False
+
+# Optional provider SDKs are only imported once their backend is actually used
+REPLICATE_AVAILABLE = _module_available("replicate")
+DIFFUSERS_AVAILABLE = _module_available("diffusers") and _module_available("torch")
+HF_CLIENT_AVAILABLE = _module_available("huggingface_hub")
 
-# Check if diffusers is available (only import if needed)
-DIFFUSERS_AVAILABLE = False
+# Async HTTP client for the NVIDIA NIM path (HTTP/2 only if h2 is installed)
 try:
-    import torch
-    from diffusers import StableDiffusionXLImg2ImgPipeline
-    DIFFUSERS_AVAILABLE = True
+    import httpx
+    HTTPX_AVAILABLE = True
 except ImportError:
-    # diffusers not installed - that's fine, we'll use API
-    pass
+    httpx = None
+    HTTPX_AVAILABLE = False
 
-# Import HuggingFace InferenceClient
 try:
-    from huggingface_hub import InferenceClient
-    HF_CLIENT_AVAILABLE = True
+    import h2  # noqa: F401
+    H2_AVAILABLE = True
 except ImportError:
-    HF_CLIENT_AVAILABLE = False
-    InferenceClient = None
-    print("Warning: huggingface_hub not installed. Install with: pip install huggingface_hub")
+    H2_AVAILABLE = False
+
+# Status codes worth retrying against the NIM API: rate limits and gateway errors, where
+# the generation did not run. A 500 may have been billed, and a read timeout certainly was.
+RETRY_STATUS_CODES = (429, 502, 503, 504)
+
+# Transport errors raised before the request reached the API - safe to resend
+RETRY_TRANSPORT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout) if HTTPX_AVAILABLE else ()
+
+
+class _CappedRetry(Retry):
+    """urllib3 Retry whose Retry-After wait is capped at NVIDIA_NIM_TIMEOUT"""
+    
+    def get_retry_after(self, response):
+        retry_after = super().get_retry_after(response)
+        if retry_after is None:
+            return None
+        return min(retry_after, NVIDIA_NIM_TIMEOUT)
+
+# Model used by each provider, in routing priority order
+PROVIDER_MODELS = {
+    "nvidia_nim": NVIDIA_NIM_MODEL,
+    "huggingface": HUGGINGFACE_MODEL,
+    "replicate": "stability-ai/sdxl",
+    "local": LOCAL_MODEL,
+}
 
 class FaceStylizer:
     def __init__(self):
         """Initialize stylization pipeline - defaults to NVIDIA NIM API"""
-        # Priority: NVIDIA NIM > HuggingFace API > Replicate API > Local (if enabled) > Basic enhancement
-        # Check NVIDIA NIM first (default and preferred)
-        self.use_nvidia_nim = USE_NVIDIA_NIM and NVIDIA_NIM_API_KEY
+        # Every configured API is routed to; priority (used until latency stats exist):
+        # NVIDIA NIM > HuggingFace API > Replicate API > Local (if enabled) > Basic enhancement
+        self.use_nvidia_nim = bool(USE_NVIDIA_NIM and NVIDIA_NIM_API_KEY)
         
-        # Check Hugging Face if NVIDIA NIM is not available
         self.use_huggingface = False
-        if not self.use_nvidia_nim and USE_HUGGINGFACE and HUGGINGFACE_API_TOKEN:
-            self.use_huggingface = True
+        if USE_HUGGINGFACE and HUGGINGFACE_API_TOKEN:
+            if HF_CLIENT_AVAILABLE:
+                self.use_huggingface = True
+            else:
+                print("Warning: huggingface_hub not installed. Install with: pip install huggingface_hub")
+        
+        # Replicate only if explicitly enabled
+        self.use_replicate = bool(USE_REPLICATE and REPLICATE_AVAILABLE and REPLICATE_API_TOKEN)
         
-        # Only use Replicate if other APIs are not available AND Replicate is explicitly enabled
-        self.use_replicate = False
-        if not self.use_nvidia_nim and not self.use_huggingface and USE_REPLICATE and REPLICATE_AVAILABLE and REPLICATE_API_TOKEN:
-            self.use_replicate = True
+        # Per-request choice between the enabled providers
+        self.router = ProviderRouter(
+            window=STYLIZATION_ROUTER_WINDOW,
+            min_samples=STYLIZATION_ROUTER_MIN_SAMPLES,
+            breaker_failures=STYLIZATION_BREAKER_FAILURES,
+            breaker_cooldown=STYLIZATION_BREAKER_COOLDOWN,
+            hedging=STYLIZATION_HEDGING,
+            hedge_delay=STYLIZATION_HEDGE_DELAY,
+            min_hedge_delay=STYLIZATION_MIN_HEDGE_DELAY
+        )
         
         self.pipeline = None
+        self._load_lock = threading.Lock()
         
-        # Only load local models if explicitly enabled AND no API is available
-        if USE_LOCAL_SDXL and not self.use_nvidia_nim and not self.use_huggingface and not self.use_replicate:
-            if DIFFUSERS_AVAILABLE:
-                self._load_local_pipeline()
-            else:
+        # Long-lived HTTP clients for NVIDIA NIM (created on first use)
+        self._session = None
+        self._async_client = None
+        
+        # Content-addressed cache of stylization results
+        self.cache = None
+        if STYLIZATION_CACHE_ENABLED:
+            self.cache = StylizationCache(
+                max_memory_items=STYLIZATION_CACHE_MEMORY_ITEMS,
+                disk_dir=STYLIZATION_CACHE_DIR or None,
+                max_disk_bytes=STYLIZATION_CACHE_DISK_MB * 1024 * 1024
+            )
+        
+        # Local models only if explicitly enabled: the routed provider when no API is
+        # available, otherwise a last resort once every API has failed (never hedged onto).
+        # The pipeline itself is loaded by load() (background warm-up) or on first use.
+        self.use_local = False
+        self.local_fallback = False
+        self.local = LocalDiffusionPipeline() if USE_LOCAL_SDXL else None
+        if USE_LOCAL_SDXL:
+            if not DIFFUSERS_AVAILABLE:
                 print("Warning: Local SDXL requested but diffusers not available. Using API or basic enhancement.")
+            elif self.use_nvidia_nim or self.use_huggingface or self.use_replicate:
+                self.local_fallback = True
+            else:
+                self.use_local = True
         
         # Print status
         if self.use_nvidia_nim:
             print(f"✓ Using NVIDIA NIM API for stylization (model: {NVIDIA_NIM_MODEL})")
-        elif self.use_huggingface:
+        if self.use_huggingface:
             print(f"✓ Using HuggingFace API for stylization (model: {HUGGINGFACE_MODEL})")
-        elif self.use_replicate:
+        if self.use_replicate:
             print("✓ Using Replicate API for stylization (no local models needed)")
-        elif self.pipeline is not None:
-            print("✓ Using local SDXL model (large download required)")
-        else:
+        if self.use_local:
+            print(f"✓ Using local diffusion model {LOCAL_MODEL} (large download required)")
+        if self.local_fallback:
+            print(f"✓ Local diffusion model {LOCAL_MODEL} is the fallback when every API fails")
+        if len(self._provider_names()) > 1:
+            print(f"  Routing between {', '.join(self._provider_names())} by latency and error rate")
+        elif not self._provider_names():
             print("⚠ No API configured. Using basic enhancement.")
             if not NVIDIA_NIM_API_KEY:
                 print("  Set NVIDIA_NIM_API_KEY for AI stylization (recommended)")
@@ -95,29 +188,23 @@ class FaceStylizer:
             if not REPLICATE_API_TOKEN:
                 print("  Or set REPLICATE_API_TOKEN as alternative")
     
+    def load(self):
+        """Load the selected backend's model, if it has one (safe to call more than once)"""
+        with self._load_lock:
+            if (self.use_local or self.local_fallback) and self.pipeline is None:
+                self._load_local_pipeline()
+    
     def _load_local_pipeline(self):
-        """Load local SDXL img2img pipeline"""
+        """Load the local diffusers img2img pipeline"""
         try:
-            device = "cuda" if torch.cuda.is_available() else "cpu"
-            dtype = torch.float16 if device == "cuda" else torch.float32
-            
-            print(f"Loading SDXL pipeline on {device}...")
-            self.pipeline = StableDiffusionXLImg2ImgPipeline.from_pretrained(
-                "stabilityai/stable-diffusion-xl-base-1.0",
-                torch_dtype=dtype,
-                variant="fp16" if dtype == torch.float16 else None
-            )
-            self.pipeline = self.pipeline.to(device)
-            self.pipeline.enable_attention_slicing()  # Reduce memory usage
-            
-            if device == "cpu":
-                print("Warning: Running on CPU. This will be very slow. Consider using Replicate API.")
-            
-            print("SDXL pipeline loaded successfully")
+            self.local.load()
+            self.pipeline = self.local
         except Exception as e:
-            print(f"Failed to load local SDXL: {e}")
+            print(f"Failed to load local diffusion model: {e}")
             print("Falling back to Replicate API or basic stylization")
-            self.use_replicate = True
+            self.use_local = False
+            self.local_fallback = False
+            self.use_replicate = bool(USE_REPLICATE and REPLICATE_AVAILABLE and REPLICATE_API_TOKEN)
     
     def stylize_face(self, face_image, prompt=None, negative_prompt=None):
         """
@@ -136,119 +223,361 @@ class FaceStylizer:
         if negative_prompt is None:
             negative_prompt = NEGATIVE_PROMPT
         
-        # Try APIs first (no local models needed) - NVIDIA NIM has priority
-        if self.use_nvidia_nim:
-            return self._stylize_with_nvidia_nim(face_image, prompt, negative_prompt)
-        elif self.use_huggingface:
-            return self._stylize_with_huggingface(face_image, prompt, negative_prompt)
-        elif self.use_replicate:
-            return self._stylize_with_replicate(face_image, prompt, negative_prompt)
-        elif self.pipeline is not None:
-            return self._stylize_local(face_image, prompt, negative_prompt)
-        else:
-            # Fallback: basic enhancement (no actual AI stylization)
+        cache_key, cached = self._cache_lookup(face_image, prompt, negative_prompt)
+        if cached is not None:
+            self._record_outcome("cache_hit")
+            return cached
+        
+        stylized, provider = self._stylize_uncached(face_image, prompt, negative_prompt)
+        self._record_outcome(stylized, provider)
+        self._cache_store(cache_key, stylized)
+        return stylized
+    
+    def _stylize_uncached(self, face_image, prompt, negative_prompt):
+        """Route to the fastest healthy provider; returns (image, provider or None)"""
+        calls = self._provider_calls(face_image, prompt, negative_prompt)
+        if not calls:
+            return self._fallback(face_image), None
+        try:
+            return self.router.call(calls)
+        except Exception as e:
+            return self._last_resort(face_image, prompt, negative_prompt, e)
+    
+    def _provider_names(self):
+        """Enabled providers in priority order"""
+        enabled = {
+            "nvidia_nim": self.use_nvidia_nim,
+            "huggingface": self.use_huggingface,
+            "replicate": self.use_replicate,
+            "local": self.use_local,
+        }
+        return [name for name in PROVIDER_MODELS if enabled[name]]
+    
+    def _provider_calls(self, face_image, prompt, negative_prompt):
+        """{provider: zero-argument callable} for every enabled provider, in priority order"""
+        methods = {
+            "nvidia_nim": self._stylize_with_nvidia_nim,
+            "huggingface": self._stylize_with_huggingface,
+            "replicate": self._stylize_with_replicate,
+            "local": self._stylize_local,
+        }
+        return {
+            name: functools.partial(methods[name], face_image, prompt, negative_prompt)
+            for name in self._provider_names()
+        }
+    
+    def _provider_calls_async(self, face_image, prompt, negative_prompt):
+        """Like _provider_calls, but coroutine functions (blocking SDKs run on the stylization executor)"""
+        calls = {}
+        for name, call in self._provider_calls(face_image, prompt, negative_prompt).items():
+            if name == "nvidia_nim" and HTTPX_AVAILABLE:
+                calls[name] = functools.partial(self._stylize_with_nvidia_nim_async, face_image, prompt, negative_prompt)
+            else:
+                calls[name] = functools.partial(run_in_stage, "stylization", call)
+        return calls
+    
+    def _last_resort(self, face_image, prompt, negative_prompt, error):
+        """After every routed provider failed: the local pipeline if it is the fallback, else basic enhancement"""
+        if self.local_fallback:
+            print(f"Stylization failed on every API ({error}). Using the local model.")
+            try:
+                stylized = self._stylize_local(face_image, prompt, negative_prompt)
+                # Served, but not by the configured APIs - counted as a fallback and not cached
+                stylized.info["stylization_fallback"] = True
+                return stylized, "local"
+            except Exception as e:
+                error = e
+        return self._fallback(face_image, error), None
+    
+    def _fallback(self, face_image, error=None):
+        """Basic enhancement when no provider is configured or every provider failed"""
+        if error is None:
             print("Warning: No stylization API/model available. Using basic enhancement.")
             print("To enable AI stylization, set NVIDIA_NIM_API_KEY environment variable.")
-            return self._basic_enhancement(face_image)
+        else:
+            print(f"Stylization failed on every provider ({error}). Using basic enhancement.")
+        return self._basic_enhancement(face_image)
     
     def _stylize_local(self, face_image, prompt, negative_prompt):
-        """Stylize using local SDXL pipeline (only if explicitly enabled)"""
+        """Stylize using the local diffusers pipeline (only if explicitly enabled)"""
+        self.load()
         if not DIFFUSERS_AVAILABLE or self.pipeline is None:
             raise ValueError("Local SDXL not available. Use API instead.")
         
         try:
-            # Ensure image is RGB and right size
-            if face_image.mode != "RGB":
-                face_image = face_image.convert("RGB")
-            
-            # Resize to 1024x1024 for SDXL (optimal size)
-            face_image = face_image.resize((1024, 1024), Image.LANCZOS)
-            
-            # Generate
-            result = self.pipeline(
-                prompt=prompt,
-                negative_prompt=negative_prompt,
-                image=face_image,
-                strength=STYLIZATION_STRENGTH,
-                num_inference_steps=NUM_INFERENCE_STEPS,
-                guidance_scale=GUIDANCE_SCALE,
-            )
-            
-            stylized = result.images[0]
-            return stylized
+            return self.pipeline(face_image, prompt, negative_prompt)
             
         except Exception as e:
             print(f"Error in local stylization: {e}")
             raise
     
+    async def stylize_face_async(self, face_image, prompt=None, negative_prompt=None):
+        """
+        Async variant of stylize_face for use from the FastAPI handlers
+        
+        NVIDIA NIM requests go through the shared async HTTP client; the other
+        providers run on the stylization executor. A request that runs past the
+        provider's p95 is hedged onto the next provider and the first result wins.
+        
+        Args:
+            face_image: PIL Image of face
+            prompt: Custom prompt (uses default if None)
+            negative_prompt: Custom negative prompt (uses default if None)
+            
+        Returns:
+            stylized_face: PIL Image
+        """
+        if prompt is None:
+            prompt = STYLIZATION_PROMPT
+        if negative_prompt is None:
+            negative_prompt = NEGATIVE_PROMPT
+        
+        # Hashing the crop and reading the disk tier are blocking - do them off the loop
+        cache_key, cached = await run_in_stage("stylization", self._cache_lookup, face_image, prompt, negative_prompt)
+        if cached is not None:
+            self._record_outcome("cache_hit")
+            return cached
+        
+        calls = self._provider_calls_async(face_image, prompt, negative_prompt)
+        provider = None
+        if not calls:
+            stylized = await run_in_stage("stylization", self._fallback, face_image)
+        else:
+            try:
+                stylized, provider = await self.router.call_async(calls)
+            except Exception as e:
+                stylized, provider = await run_in_stage(
+                    "stylization", self._last_resort, face_image, prompt, negative_prompt, e
+                )
+        self._record_outcome(stylized, provider)
+        await run_in_stage("stylization", self._cache_store, cache_key, stylized)
+        return stylized
+    
+    def _provider_identity(self):
+        """(provider, model) of the enabled backends - part of the cache key"""
+        names = self._provider_names()
+        if not names:
+            return None, None
+        if len(names) == 1:
+            return names[0], self._provider_model(names[0])
+        # Any routed provider may answer, so the key covers the whole set
+        return "router", ",".join(f"{name}={self._provider_model(name)}" for name in names)
+    
+    def _provider_model(self, name):
+        # The local pipeline's output also depends on its scheduler, steps and resolution
+        if name == "local" and self.local is not None:
+            return self.local.identity
+        return PROVIDER_MODELS[name]
+    
+    def _record_outcome(self, result, provider=None):
+        """Count a stylization as success, fallback (basic enhancement) or cache_hit"""
+        if provider is None and isinstance(result, str):
+            provider, _ = self._provider_identity()
+        if isinstance(result, str):
+            outcome = result
+        elif result.info.get("stylization_fallback"):
+            outcome = "fallback"
+        else:
+            outcome = "success"
+        STYLIZATION_OUTCOMES.inc(provider=provider or "none", outcome=outcome)
+    
+    def _cache_lookup(self, face_image, prompt, negative_prompt):
+        """Return (key, cached image or None); key is None when caching does not apply"""
+        provider, model = self._provider_identity()
+        if self.cache is None or provider is None:
+            return None, None
+        # Without a seed every provider samples anew each call - caching one sample
+        # would serve it as if it were the answer for this input
+        if not STYLIZATION_SEED:
+            return None, None
+        if self.use_local and self.local is not None and not self.local.deterministic:
+            return None, None
+        
+        key = StylizationCache.make_key(
+            face_image,
+            provider=provider,
+            model=model,
+            prompt=prompt,
+            negative_prompt=negative_prompt,
+            steps=NUM_INFERENCE_STEPS,
+            guidance=GUIDANCE_SCALE,
+            strength=STYLIZATION_STRENGTH,
+            seed=STYLIZATION_SEED
+        )
+        cached = self.cache.get(key)
+        if cached is not None:
+            print(f"Stylization cache hit ({key[:12]})")
+        return key, cached
+    
+    def _cache_store(self, key, stylized):
+        # Never cache the basic-enhancement fallback, so a failed API call is retried next time
+        if key is None or stylized.info.get("stylization_fallback"):
+            return
+        try:
+            self.cache.put(key, stylized)
+        except Exception as e:
+            print(f"Could not store stylization result in cache: {e}")
+    
+    async def aclose(self):
+        """Close the pooled HTTP clients"""
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+    
+    def _nim_invoke_url(self):
+        return f"{NVIDIA_NIM_BASE_URL}/{NVIDIA_NIM_MODEL}"
+    
+    def _nim_headers(self):
+        return {
+            "Authorization": f"Bearer {NVIDIA_NIM_API_KEY}",
+            "Accept": "application/json",
+        }
+    
+    def _nim_payload(self, prompt, negative_prompt):
+        # Prepare payload based on user's example
+        return {
+            "prompt": prompt,
+            "cfg_scale": int(GUIDANCE_SCALE),
+            "seed": STYLIZATION_SEED,
+            "steps": NUM_INFERENCE_STEPS,
+            "negative_prompt": negative_prompt if negative_prompt else ""
+        }
+    
+    def _get_session(self):
+        """Pooled keep-alive session for the synchronous NIM path"""
+        if self._session is None:
+            retry = _CappedRetry(
+                total=NVIDIA_NIM_MAX_RETRIES,
+                read=0,  # Never resend a generation that may already be running
+                other=0,
+                backoff_factor=NVIDIA_NIM_RETRY_BACKOFF,
+                status_forcelist=RETRY_STATUS_CODES,
+                allowed_methods=None,  # NIM generation is a POST
+                respect_retry_after_header=True,
+                raise_on_status=False
+            )
+            adapter = HTTPAdapter(
+                pool_connections=1,
+                pool_maxsize=NVIDIA_NIM_MAX_CONNECTIONS,
+                max_retries=retry
+            )
+            session = requests.Session()
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            session.headers.update(self._nim_headers())
+            self._session = session
+        return self._session
+    
+    def _get_async_client(self):
+        """Pooled keep-alive async client for the NIM path"""
+        if self._async_client is None:
+            limits = httpx.Limits(
+                max_connections=NVIDIA_NIM_MAX_CONNECTIONS,
+                max_keepalive_connections=NVIDIA_NIM_MAX_KEEPALIVE,
+                keepalive_expiry=NVIDIA_NIM_KEEPALIVE_EXPIRY
+            )
+            self._async_client = httpx.AsyncClient(
+                http2=NVIDIA_NIM_HTTP2 and H2_AVAILABLE,
+                limits=limits,
+                timeout=httpx.Timeout(NVIDIA_NIM_TIMEOUT, connect=10.0),
+                headers=self._nim_headers()
+            )
+        return self._async_client
+    
+    def _retry_delay(self, attempt, response=None):
+        """Exponential backoff with jitter, honoring Retry-After (up to NVIDIA_NIM_TIMEOUT) when present"""
+        if response is not None:
+            retry_after = response.headers.get("Retry-After")
+            if retry_after:
+                try:
+                    return min(max(0.0, float(retry_after)), NVIDIA_NIM_TIMEOUT)
+                except ValueError:
+                    pass
+        delay = NVIDIA_NIM_RETRY_BACKOFF * (2 ** attempt)
+        return delay + random.uniform(0, delay * 0.1)
+    
+    async def _post_nim_async(self, invoke_url, payload):
+        """POST to NIM with retries on 429/502/503/504 and connection errors; returns raw body bytes"""
+        client = self._get_async_client()
+        attempt = 0
+        while True:
+            try:
+                response = await client.post(invoke_url, json=payload)
+            except RETRY_TRANSPORT_ERRORS as e:
+                if attempt >= NVIDIA_NIM_MAX_RETRIES:
+                    raise
+                delay = self._retry_delay(attempt)
+                print(f"NVIDIA NIM request failed ({e}), retrying in {delay:.1f}s")
+            else:
+                if response.status_code not in RETRY_STATUS_CODES or attempt >= NVIDIA_NIM_MAX_RETRIES:
+                    response.raise_for_status()
+                    return response.content
+                delay = self._retry_delay(attempt, response)
+                print(f"NVIDIA NIM returned {response.status_code}, retrying in {delay:.1f}s")
+            attempt += 1
+            await asyncio.sleep(delay)
+    
+    def _decode_nim_response(self, response_body, face_image):
+        """Extract the generated image from a NIM response and resize it to the face size"""
+        if isinstance(response_body, (bytes, bytearray)):
+            response_body = json.loads(response_body)
+        
+        # Extract image from response
+        # NVIDIA NIM API typically returns base64 encoded image
+        if "image" in response_body:
+            image_b64 = response_body["image"]
+        elif "b64_json" in response_body:
+            image_b64 = response_body["b64_json"]
+        elif "data" in response_body and len(response_body["data"]) > 0:
+            # Some formats return array with image data
+            image_data = response_body["data"][0]
+            if "b64_json" in image_data:
+                image_b64 = image_data["b64_json"]
+            elif "image" in image_data:
+                image_b64 = image_data["image"]
+            else:
+                raise ValueError(f"Unexpected response format: {response_body.keys()}")
+        else:
+            # Try to find base64 string in response
+            raise ValueError(f"Could not find image in response. Response keys: {response_body.keys()}")
+        
+        # Decode base64 image
+        # Handle data URL format if present
+        if image_b64.startswith("data:image"):
+            image_b64 = image_b64.split(",")[1]
+        
+        image_bytes = base64.b64decode(image_b64)
+        stylized = Image.open(io.BytesIO(image_bytes))
+        
+        # Resize to match input face size for compositing
+        stylized = stylized.resize(face_image.size, Image.LANCZOS)
+        
+        return stylized
+    
     def _stylize_with_nvidia_nim(self, face_image, prompt, negative_prompt):
         """Stylize using NVIDIA NIM API"""
         try:
             if not NVIDIA_NIM_API_KEY:
                 raise ValueError("NVIDIA_NIM_API_KEY not set")
             
-            # Construct the API URL
-            invoke_url = f"{NVIDIA_NIM_BASE_URL}/{NVIDIA_NIM_MODEL}"
-            
-            headers = {
-                "Authorization": f"Bearer {NVIDIA_NIM_API_KEY}",
-                "Accept": "application/json",
-            }
-            
-            # Prepare payload based on user's example
-            payload = {
-                "prompt": prompt,
-                "cfg_scale": int(GUIDANCE_SCALE),
-                "seed": 0,  # Can be randomized for variety
-                "steps": NUM_INFERENCE_STEPS,
-                "negative_prompt": negative_prompt if negative_prompt else ""
-            }
+            invoke_url = self._nim_invoke_url()
+            payload = self._nim_payload(prompt, negative_prompt)
             
             # Make API request
             print(f"Calling NVIDIA NIM API: {invoke_url}")
             print(f"Prompt: {prompt[:80]}...")
             
-            response = requests.post(
+            response = self._get_session().post(
                 invoke_url,
-                headers=headers,
                 json=payload,
-                timeout=120
+                timeout=NVIDIA_NIM_TIMEOUT
             )
             
             response.raise_for_status()
-            response_body = response.json()
-            
-            # Extract image from response
-            # NVIDIA NIM API typically returns base64 encoded image
-            if "image" in response_body:
-                image_b64 = response_body["image"]
-            elif "b64_json" in response_body:
-                image_b64 = response_body["b64_json"]
-            elif "data" in response_body and len(response_body["data"]) > 0:
-                # Some formats return array with image data
-                image_data = response_body["data"][0]
-                if "b64_json" in image_data:
-                    image_b64 = image_data["b64_json"]
-                elif "image" in image_data:
-                    image_b64 = image_data["image"]
-                else:
-                    raise ValueError(f"Unexpected response format: {response_body.keys()}")
-            else:
-                # Try to find base64 string in response
-                raise ValueError(f"Could not find image in response. Response keys: {response_body.keys()}")
-            
-            # Decode base64 image
-            # Handle data URL format if present
-            if image_b64.startswith("data:image"):
-                image_b64 = image_b64.split(",")[1]
-            
-            image_bytes = base64.b64decode(image_b64)
-            stylized = Image.open(io.BytesIO(image_bytes))
-            
-            # Resize to match input face size for compositing
-            stylized = stylized.resize(face_image.size, Image.LANCZOS)
-            
-            return stylized
+            return self._decode_nim_response(response.json(), face_image)
             
         except requests.exceptions.RequestException as e:
             print(f"Error in NVIDIA NIM API request: {e}")
@@ -260,12 +589,41 @@ class FaceStylizer:
                     print(f"API response: {e.response.text}")
             import traceback
             traceback.print_exc()
-            return self._basic_enhancement(face_image)
+            raise
         except Exception as e:
             print(f"Error in NVIDIA NIM stylization: {e}")
             import traceback
             traceback.print_exc()
-            return self._basic_enhancement(face_image)
+            raise
+    
+    async def _stylize_with_nvidia_nim_async(self, face_image, prompt, negative_prompt):
+        """Stylize using NVIDIA NIM API over the shared async client"""
+        try:
+            if not NVIDIA_NIM_API_KEY:
+                raise ValueError("NVIDIA_NIM_API_KEY not set")
+            
+            invoke_url = self._nim_invoke_url()
+            payload = self._nim_payload(prompt, negative_prompt)
+            
+            print(f"Calling NVIDIA NIM API (async): {invoke_url}")
+            print(f"Prompt: {prompt[:80]}...")
+            
+            body = await self._post_nim_async(invoke_url, payload)
+            
+            # JSON parsing and base64/PNG decoding are CPU work - keep them off the event loop
+            return await run_in_stage("stylization", self._decode_nim_response, body, face_image)
+            
+        except httpx.HTTPStatusError as e:
+            print(f"Error in NVIDIA NIM API request: {e}")
+            print(f"API response: {e.response.text}")
+            import traceback
+            traceback.print_exc()
+            raise
+        except Exception as e:
+            print(f"Error in NVIDIA NIM stylization: {e}")
+            import traceback
+            traceback.print_exc()
+            raise
     
     def _stylize_with_huggingface(self, face_image, prompt, negative_prompt):
         """Stylize using HuggingFace InferenceClient"""
@@ -275,6 +633,7 @@ class FaceStylizer:
             
             if not HF_CLIENT_AVAILABLE:
                 raise ValueError("huggingface_hub not installed. Install with: pip install huggingface_hub")
+            from huggingface_hub import InferenceClient
             
             # Initialize InferenceClient
             # Using provider from config (default: fal-ai for better performance)
@@ -310,6 +669,7 @@ class FaceStylizer:
             stylized = client.text_to_image(
                 prompt=enhanced_prompt,
                 model=HUGGINGFACE_MODEL,
+                seed=STYLIZATION_SEED or None,
             )
             
             # Handle different return types
@@ -329,13 +689,14 @@ class FaceStylizer:
             print(f"Error in HuggingFace stylization: {e}")
             import traceback
             traceback.print_exc()
-            return self._basic_enhancement(face_image)
+            raise
     
     def _stylize_with_replicate(self, face_image, prompt, negative_prompt):
         """Stylize using Replicate API"""
         try:
             if not REPLICATE_API_TOKEN:
                 raise ValueError("REPLICATE_API_TOKEN not set")
+            import replicate
             
             # Set API token
             os.environ["REPLICATE_API_TOKEN"] = REPLICATE_API_TOKEN
@@ -358,6 +719,7 @@ class FaceStylizer:
                         "strength": STYLIZATION_STRENGTH,
                         "num_inference_steps": NUM_INFERENCE_STEPS,
                         "guidance_scale": GUIDANCE_SCALE,
+                        **({"seed": STYLIZATION_SEED} if STYLIZATION_SEED else {}),
                     }
                 )
                 
@@ -383,8 +745,11 @@ class FaceStylizer:
             print(f"Error in Replicate stylization: {e}")
             import traceback
             traceback.print_exc()
-            # Fallback to basic enhancement
-            return self._basic_enhancement(face_image)
+            raise
+    
+    def preview_face(self, face_image):
+        """Cheap local stand-in for the stylized face, shown while the real stylization runs"""
+        return self._basic_enhancement(face_image)
     
     def _basic_enhancement(self, face_image):
         """Basic image enhancement as fallback"""
@@ -397,5 +762,8 @@ class FaceStylizer:
         enhancer = ImageEnhance.Contrast(face_image)
         face_image = enhancer.enhance(1.1)
         
+        # Mark the result so callers (e.g. the cache) can tell it is not a real stylization
+        face_image.info["stylization_fallback"] = True
+        
         return face_image
 
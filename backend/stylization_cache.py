@@ -0,0 +1,183 @@
+"""Content-addressed cache for stylization results (memory LRU + on-disk tier)"""
+
+import os
+import io
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from PIL import Image
+
+
+class StylizationCache:
+    def __init__(self, max_memory_items=64, disk_dir=None, max_disk_bytes=512 * 1024 * 1024):
+        """
+        Initialize the cache
+
+        Args:
+            max_memory_items: Number of decoded results kept in the memory LRU
+            disk_dir: Directory for the on-disk tier (disabled if None)
+            max_disk_bytes: Size cap of the on-disk tier, oldest entries are evicted first
+        """
+        self.max_memory_items = max_memory_items
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = max_disk_bytes
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_bytes = 0
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            self._disk_bytes = sum(size for _, size, _ in self._disk_entries())
+
+    @staticmethod
+    def make_key(face_image, **params):
+        """
+        Build the cache key from the aligned face crop and the generation parameters
+
+        Args:
+            face_image: PIL Image of the aligned face crop
+            **params: prompt, negative prompt, model, steps, guidance, seed, ...
+
+        Returns:
+            Hex digest identifying the request
+        """
+        digest = hashlib.sha256()
+        digest.update(f"{face_image.mode}:{face_image.size[0]}x{face_image.size[1]}".encode("utf-8"))
+        digest.update(face_image.tobytes())
+        digest.update(json.dumps(params, sort_keys=True, default=str).encode("utf-8"))
+        return digest.hexdigest()
+
+    def get(self, key):
+        """Return a cached PIL Image for key, or None on a miss"""
+        with self._lock:
+            image = self._memory.get(key)
+            if image is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return image.copy()
+
+        image = self._read_disk(key)
+        with self._lock:
+            if image is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._remember(key, image)
+        return image.copy()
+
+    def put(self, key, image):
+        """Store a stylization result under key in both tiers"""
+        image = image.copy()
+        image.load()
+        with self._lock:
+            self._remember(key, image)
+        self._write_disk(key, image)
+
+    def stats(self):
+        """Hit/miss counters and tier sizes"""
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            lookups = hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_ratio": hits / lookups if lookups else 0.0,
+                "memory_items": len(self._memory),
+                "disk_bytes": self._disk_bytes,
+            }
+
+    def _remember(self, key, image):
+        # Caller holds self._lock
+        self._memory[key] = image
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, f"{key}.png")
+
+    def _disk_entries(self):
+        """(path, size, mtime) for every file in the disk tier"""
+        entries = []
+        for name in os.listdir(self.disk_dir):
+            if not name.endswith(".png"):
+                continue
+            path = os.path.join(self.disk_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((path, stat.st_size, stat.st_mtime))
+        return entries
+
+    def _read_disk(self, key):
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)  # Track recency for eviction
+        except OSError:
+            return None
+        try:
+            image = Image.open(io.BytesIO(data))
+            image.load()
+            return image
+        except Exception as e:
+            print(f"Discarding unreadable stylization cache entry {key}: {e}")
+            self._remove_disk(path)
+            return None
+
+    def _write_disk(self, key, image):
+        if not self.disk_dir:
+            return
+        buf = io.BytesIO()
+        image.save(buf, format="PNG", compress_level=1)
+        data = buf.getvalue()
+        if len(data) > self.max_disk_bytes:
+            return
+
+        path = self._disk_path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            previous = os.path.getsize(path) if os.path.exists(path) else 0
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Could not write stylization cache entry: {e}")
+            self._remove_disk(tmp_path)
+            return
+
+        with self._lock:
+            self._disk_bytes += len(data) - previous
+            over_budget = self._disk_bytes > self.max_disk_bytes
+        if over_budget:
+            self._evict_disk()
+
+    def _evict_disk(self):
+        """Remove least recently used files until the disk tier fits its budget"""
+        entries = sorted(self._disk_entries(), key=lambda entry: entry[2])
+        total = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if total <= self.max_disk_bytes:
+                break
+            if self._remove_disk(path):
+                total -= size
+        with self._lock:
+            self._disk_bytes = total
+
+    def _remove_disk(self, path):
+        try:
+            os.unlink(path)
+            return True
+        except OSError:
+            return False
@@ -0,0 +1,238 @@
+"""Registry of decoded (memory-mapped) templates and their face slots"""
+
+import os
+import json
+import time
+import threading
+import cv2
+import numpy as np
+from PIL import Image
+from config import TEMPLATE_DIR, BOOK_DIR, TEMPLATE_RECHECK_SECONDS, TEMPLATE_STORE_DIR
+from template_store import MappedTemplateStore
+
+TEMPLATE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp")
+
+
+def _is_safe_name(name):
+    """True for a plain file/directory name (no path separators or parent references)"""
+    return bool(name) and name not in (".", "..") and os.path.basename(name) == name and "\\" not in name
+
+
+def resolve_template(template_id, template_dir=TEMPLATE_DIR):
+    """
+    Map a client-supplied template id (file name in template_dir) to a path
+
+    Raises:
+        ValueError: If the id is not a plain file name of an existing template
+    """
+    if not _is_safe_name(template_id) or not template_id.lower().endswith(TEMPLATE_EXTENSIONS):
+        raise ValueError(f"Invalid template id: {template_id}")
+    path = os.path.join(template_dir, template_id)
+    if not os.path.isfile(path):
+        raise ValueError(f"Template not found: {template_id}")
+    return path
+
+
+def book_pages(book_name, book_dir=BOOK_DIR):
+    """
+    Return the page template paths of a named book, in page order
+
+    A book is a directory under book_dir whose templates are sorted by file
+    name (e.g. page01.png, page02.png, ...).
+
+    Raises:
+        ValueError: If the book does not exist or has no pages
+    """
+    if not _is_safe_name(book_name):
+        raise ValueError(f"Invalid book name: {book_name}")
+    path = os.path.join(book_dir, book_name)
+    if not os.path.isdir(path):
+        raise ValueError(f"Book not found: {book_name}")
+    pages = [
+        os.path.join(path, name) for name in sorted(os.listdir(path))
+        if name.lower().endswith(TEMPLATE_EXTENSIONS)
+    ]
+    if not pages:
+        raise ValueError(f"Book has no pages: {book_name}")
+    return pages
+
+
+class TemplateEntry:
+    """A decoded template with its face-slot coordinates"""
+
+    def __init__(self, path, pixels, face_region, mtime):
+        self.path = path
+        self.pixels = pixels  # Read-only (height, width, 3) uint8 array, memory-mapped when the store is on
+        self.face_region = face_region
+        self.mtime = mtime
+        self.checked_at = time.monotonic()
+        self._previews = {}  # max side -> (downscaled pixels, scale)
+        self._lock = threading.Lock()
+
+    @property
+    def size(self):
+        return self.pixels.shape[1], self.pixels.shape[0]
+
+    @property
+    def image(self):
+        """A new, private PIL copy of the template (safe to draw on)"""
+        return Image.frombuffer("RGB", self.size, self.pixels, "raw", "RGB", 0, 1)
+
+    def preview_pixels(self, max_side):
+        """
+        The template downscaled so its long side is at most max_side, computed once per size
+
+        Returns:
+            (read-only uint8 array, scale factor relative to the full template)
+        """
+        with self._lock:
+            preview = self._previews.get(max_side)
+        if preview is not None:
+            return preview
+
+        # Resized outside the lock; stage threads racing on the same size keep the first result
+        width, height = self.size
+        scale = min(1.0, max_side / max(width, height))
+        size = (max(1, int(round(width * scale))), max(1, int(round(height * scale))))
+        pixels = cv2.resize(np.asarray(self.pixels), size, interpolation=cv2.INTER_AREA) if scale < 1.0 else np.array(self.pixels)
+        pixels.flags.writeable = False
+        with self._lock:
+            return self._previews.setdefault(max_side, (pixels, scale))
+
+
+class TemplateRegistry:
+    def __init__(self, template_dir=TEMPLATE_DIR, region_detector=None,
+                 recheck_interval=TEMPLATE_RECHECK_SECONDS, store_dir=TEMPLATE_STORE_DIR):
+        """
+        Initialize the registry
+
+        Args:
+            template_dir: Directory scanned by scan()
+            region_detector: Callable((width, height)) -> (x1, y1, x2, y2) used when a
+                template has no sidecar manifest
+            recheck_interval: Seconds between mtime checks of a cached template
+            store_dir: Directory of memory-mapped raw templates (None/empty decodes in-process)
+        """
+        self.template_dir = template_dir
+        self.region_detector = region_detector
+        self.recheck_interval = recheck_interval
+        self.store = MappedTemplateStore(store_dir) if store_dir else None
+        self._entries = {}
+        self._missing = {}
+        self._lock = threading.Lock()
+
+    def scan(self):
+        """Load every template in template_dir up front (call at startup)"""
+        if not os.path.isdir(self.template_dir):
+            return 0
+        loaded = 0
+        for name in sorted(os.listdir(self.template_dir)):
+            if name.lower().endswith(TEMPLATE_EXTENSIONS):
+                if self.get(os.path.join(self.template_dir, name)) is not None:
+                    loaded += 1
+        print(f"Template registry: {loaded} template(s) loaded from {self.template_dir}")
+        return loaded
+
+    def get(self, template_path):
+        """
+        Return the TemplateEntry for a template path, or None if it does not exist
+
+        The file is only stat'ed again once recheck_interval has elapsed, and
+        re-decoded if its mtime changed.
+        """
+        key = os.path.abspath(template_path)
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry.checked_at < self.recheck_interval:
+                return entry
+            missing_since = self._missing.get(key)
+            if missing_since is not None and now - missing_since < self.recheck_interval:
+                return None
+
+        try:
+            mtime = self._source_mtime(key)
+        except OSError:
+            with self._lock:
+                self._entries.pop(key, None)
+                self._missing[key] = now
+            return None
+
+        if entry is not None and entry.mtime == mtime:
+            entry.checked_at = now
+            return entry
+
+        entry = self._load(key, mtime)
+        with self._lock:
+            self._entries[key] = entry
+            self._missing.pop(key, None)
+        return entry
+
+    def invalidate(self, template_path=None):
+        """Drop one cached template, or all of them"""
+        with self._lock:
+            if template_path is None:
+                self._entries.clear()
+                self._missing.clear()
+            else:
+                key = os.path.abspath(template_path)
+                self._entries.pop(key, None)
+                self._missing.pop(key, None)
+
+    def _source_mtime(self, path):
+        """Latest mtime of the template and its sidecar manifest"""
+        mtime = os.stat(path).st_mtime
+        try:
+            mtime = max(mtime, os.stat(self._manifest_path(path)).st_mtime)
+        except OSError:
+            pass
+        return mtime
+
+    def _manifest_path(self, path):
+        return os.path.splitext(path)[0] + ".json"
+
+    def _load(self, path, mtime):
+        pixels = self._read_pixels(path)
+        size = (pixels.shape[1], pixels.shape[0])
+        face_region = self._read_manifest(path, size)
+        if face_region is None and self.region_detector is not None:
+            face_region = self.region_detector(size)
+        print(f"Template loaded: {os.path.basename(path)} {size}, face region {face_region}")
+        return TemplateEntry(path, pixels, face_region, mtime)
+
+    def _read_pixels(self, path):
+        if self.store is not None:
+            try:
+                return self.store.open(path)
+            except (OSError, ValueError) as e:
+                # ValueError: the store file is still invalid after reconverting (e.g. replaced by a bad one meanwhile)
+                print(f"Template store unavailable ({e}), decoding {os.path.basename(path)} in-process")
+        pixels = np.asarray(Image.open(path).convert("RGB"))
+        pixels.flags.writeable = False
+        return pixels
+
+    def _read_manifest(self, path, size):
+        """
+        Read face-slot coordinates from a sidecar manifest next to the template
+
+        template1.png -> template1.json: {"face_region": [x1, y1, x2, y2]}
+        """
+        manifest_path = self._manifest_path(path)
+        if not os.path.exists(manifest_path):
+            return None
+        try:
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            x1, y1, x2, y2 = (int(v) for v in manifest["face_region"])
+        except Exception as e:
+            print(f"Ignoring invalid template manifest {manifest_path}: {e}")
+            return None
+
+        width, height = size
+        x1, y1 = max(0, x1), max(0, y1)
+        x2, y2 = min(width, x2), min(height, y2)
+        if x2 <= x1 or y2 <= y1:
+            print(f"Ignoring empty face region in {manifest_path}")
+            return None
+        return (x1, y1, x2, y2)
@@ -0,0 +1,102 @@
+"""Decoded templates as raw RGB files, memory-mapped read-only and shared between worker processes"""
+
+import os
+import struct
+import hashlib
+import tempfile
+import numpy as np
+from PIL import Image
+
+MAGIC = b"PBTPLRGB"
+VERSION = 1
+# magic, version, width, height, channels - padded to 32 bytes so pixel rows start aligned
+HEADER = struct.Struct("<8sIIII")
+HEADER_SIZE = 32
+CHANNELS = 3
+EXTENSION = ".rgb"
+
+
+class MappedTemplateStore:
+    def __init__(self, store_dir):
+        """
+        Initialize the store
+
+        Args:
+            store_dir: Directory holding the converted .rgb files (created on demand)
+        """
+        self.store_dir = store_dir
+
+    def open(self, template_path):
+        """
+        Return the template's pixels as a read-only (height, width, 3) uint8 memmap
+
+        The PNG/JPEG is decoded and converted once per file version; every later
+        call (in this or any other worker process) maps the converted file, so
+        the pixels live once in the page cache however many workers use them.
+        """
+        stat = os.stat(template_path)
+        path = self._store_path(template_path, stat)
+        try:
+            return self._map(path)
+        except (OSError, ValueError):
+            pass
+        self._convert(template_path, path)
+        return self._map(path)
+
+    def _prefix(self, template_path):
+        digest = hashlib.sha1(os.path.abspath(template_path).encode("utf-8")).hexdigest()[:16]
+        stem = os.path.splitext(os.path.basename(template_path))[0]
+        return f"{stem}-{digest}-"
+
+    def _store_path(self, template_path, stat):
+        # Size and mtime identify the source version; a changed file gets a new store file
+        version = f"{stat.st_size:x}-{stat.st_mtime_ns:x}"
+        return os.path.join(self.store_dir, self._prefix(template_path) + version + EXTENSION)
+
+    def _map(self, path):
+        with open(path, "rb") as f:
+            header = f.read(HEADER_SIZE)
+        if len(header) < HEADER_SIZE:
+            raise ValueError(f"Truncated template store file: {path}")
+        magic, version, width, height, channels = HEADER.unpack_from(header)
+        if magic != MAGIC or version != VERSION or channels != CHANNELS:
+            raise ValueError(f"Not a template store file: {path}")
+        if os.path.getsize(path) != HEADER_SIZE + width * height * channels:
+            raise ValueError(f"Template store file has the wrong size: {path}")
+        return np.memmap(path, dtype=np.uint8, mode="r", offset=HEADER_SIZE, shape=(height, width, channels))
+
+    def _convert(self, template_path, path):
+        """Decode the template and write header + raw pixels atomically"""
+        os.makedirs(self.store_dir, exist_ok=True)
+        pixels = np.asarray(Image.open(template_path).convert("RGB"))
+        height, width = pixels.shape[:2]
+
+        # Workers converting the same template concurrently each write their own
+        # temporary file; the rename makes whichever finishes last the visible one
+        fd, tmp_path = tempfile.mkstemp(dir=self.store_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(HEADER.pack(MAGIC, VERSION, width, height, CHANNELS).ljust(HEADER_SIZE, b"\0"))
+                f.write(np.ascontiguousarray(pixels).data)
+            os.chmod(tmp_path, 0o644)  # mkstemp creates 0600; workers may run as other users
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+        print(f"Template store: converted {os.path.basename(template_path)} ({width}x{height})")
+        self._remove_stale(template_path, path)
+
+    def _remove_stale(self, template_path, current):
+        """Delete store files of older versions of the same template"""
+        prefix = self._prefix(template_path)
+        for name in os.listdir(self.store_dir):
+            path = os.path.join(self.store_dir, name)
+            if name.startswith(prefix) and name.endswith(EXTENSION) and path != current:
+                try:
+                    # Processes that still map the old version keep their pages until they remap
+                    os.unlink(path)
+                except OSError:
+                    pass
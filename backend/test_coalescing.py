@@ -0,0 +1,145 @@
+"""Tests for single-flight coalescing and idempotency-key replay"""
+
+import time
+import asyncio
+import pytest
+from coalescing import SingleFlight, IdempotencyStore, SharedIdempotencyStore, StoredResponse
+
+
+def test_single_flight_coalesces_concurrent_callers():
+    flight = SingleFlight()
+    calls = []
+
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "result"
+
+    async def main():
+        results = await asyncio.gather(*(flight.run("key", work) for _ in range(5)))
+        return results, len(flight)
+
+    results, inflight = asyncio.run(main())
+    assert results == ["result"] * 5
+    assert len(calls) == 1
+    assert inflight == 0
+
+
+def test_single_flight_runs_different_keys_separately():
+    flight = SingleFlight()
+    calls = []
+
+    async def work(key):
+        calls.append(key)
+        await asyncio.sleep(0.01)
+        return key
+
+    async def main():
+        return await asyncio.gather(flight.run("a", lambda: work("a")), flight.run("b", lambda: work("b")))
+
+    assert asyncio.run(main()) == ["a", "b"]
+    assert sorted(calls) == ["a", "b"]
+
+
+def test_single_flight_propagates_errors_to_every_caller():
+    flight = SingleFlight()
+
+    async def work():
+        await asyncio.sleep(0.01)
+        raise ValueError("boom")
+
+    async def main():
+        return await asyncio.gather(*(flight.run("key", work) for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert all(isinstance(r, ValueError) for r in results)
+
+
+def test_single_flight_cancelled_caller_does_not_cancel_shared_work():
+    flight = SingleFlight()
+    release = None
+
+    async def work():
+        await release.wait()
+        return "done"
+
+    async def main():
+        nonlocal release
+        release = asyncio.Event()
+        first = asyncio.ensure_future(flight.run("key", work))
+        second = asyncio.ensure_future(flight.run("key", work))
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(main()) == "done"
+
+
+def test_single_flight_starts_again_after_completion():
+    flight = SingleFlight()
+    calls = []
+
+    async def work():
+        calls.append(1)
+        return len(calls)
+
+    async def main():
+        return await flight.run("key", work), await flight.run("key", work)
+
+    assert asyncio.run(main()) == (1, 2)
+
+
+def _response(body=b"body"):
+    return StoredResponse("fingerprint", body, "image/png", {"X-Session-Token": "abc"})
+
+
+def test_idempotency_store_replays_and_expires(monkeypatch):
+    store = IdempotencyStore(ttl=10)
+    store.put("key", _response())
+    assert store.get("key").body == b"body"
+
+    now = time.monotonic()
+    monkeypatch.setattr("coalescing.time.monotonic", lambda: now + 11)
+    assert store.get("key") is None
+
+
+def test_idempotency_store_evicts_least_recently_used():
+    store = IdempotencyStore(max_entries=2)
+    store.put("a", _response())
+    store.put("b", _response())
+    store.get("a")
+    store.put("c", _response())
+    assert store.get("a") is not None
+    assert store.get("b") is None
+    assert store.get("c") is not None
+
+
+def test_idempotency_store_respects_byte_limit():
+    store = IdempotencyStore(max_bytes=10)
+    store.put("large", _response(b"x" * 11))
+    assert store.get("large") is None
+    store.put("a", _response(b"x" * 6))
+    store.put("b", _response(b"x" * 6))
+    assert store.get("a") is None
+    assert store.get("b") is not None
+
+
+def test_shared_idempotency_store_round_trip(tmp_path):
+    store = SharedIdempotencyStore(str(tmp_path / "idempotency.sqlite3"), max_entries=2)
+    try:
+        store.put("a", _response(b"first"))
+        response = store.get("a")
+        assert response.body == b"first"
+        assert response.media_type == "image/png"
+        assert response.headers == {"X-Session-Token": "abc"}
+
+        store.put("b", _response())
+        store.put("c", _response())
+        assert store.get("a") is None
+        assert store.get("c") is not None
+    finally:
+        store.close()
@@ -0,0 +1,75 @@
+"""Tests for output encoding and Accept-header negotiation"""
+
+import io
+import pytest
+from PIL import Image
+from encoding import (
+    DEFAULT_FORMAT, OutputOptions, negotiate_format, parse_format, encode_image, encode_timed,
+    encode_thumbnail, iter_chunks
+)
+
+
+@pytest.mark.parametrize("accept", [None, "", "*/*", "application/json", "text/html"])
+def test_negotiate_keeps_json_without_an_explicit_image_type(accept):
+    assert negotiate_format(accept) is None
+
+
+@pytest.mark.parametrize("accept, expected", [
+    ("image/png", "PNG"),
+    ("image/jpeg", "JPEG"),
+    ("IMAGE/WEBP", "WEBP"),
+    ("image/*", DEFAULT_FORMAT),
+    ("image/webp;q=0.5, image/png;q=0.9", "PNG"),
+    ("image/webp, image/png", "WEBP"),  # Ties keep the first listed type
+    ("image/png;q=0, image/jpeg;q=0.1", "JPEG"),
+    ("image/png;q=bad, image/jpeg;q=0.1", "JPEG"),
+    ("application/json;q=0.5, image/png", "PNG"),
+])
+def test_negotiate_picks_the_preferred_image_type(accept, expected):
+    assert negotiate_format(accept) == expected
+
+
+@pytest.mark.parametrize("accept", ["application/json, image/png", "image/png;q=0.5, application/json;q=0.8"])
+def test_negotiate_prefers_json_when_ranked_at_least_as_high(accept):
+    assert negotiate_format(accept) is None
+
+
+def test_parse_format_aliases_and_errors():
+    assert parse_format(" jpg ") == "JPEG"
+    assert parse_format("webp") == "WEBP"
+    with pytest.raises(ValueError):
+        parse_format("gif")
+
+
+def test_output_options_validation():
+    options = OutputOptions.parse(fmt="jpg", quality=70, preset="FAST", thumbnail=256)
+    assert (options.format, options.quality, options.preset, options.thumbnail) == ("JPEG", 70, "fast", 256)
+    assert options.key() == "JPEG:70:fast:256"
+    for kwargs in ({"preset": "tiny"}, {"quality": 0}, {"quality": 101}, {"thumbnail": 8}):
+        with pytest.raises(ValueError):
+            OutputOptions.parse(**kwargs)
+
+
+@pytest.mark.parametrize("fmt", ["PNG", "JPEG", "WEBP"])
+def test_encode_image_round_trips(fmt):
+    image = Image.new("RGBA", (40, 30), (10, 20, 30, 255))
+    decoded = Image.open(io.BytesIO(encode_image(image, fmt, preset="fast")))
+    assert decoded.format == fmt
+    assert decoded.size == (40, 30)
+
+
+def test_encode_timed_and_thumbnail_metadata():
+    image = Image.new("RGB", (800, 400), (200, 100, 50))
+    options = OutputOptions.parse(fmt="png", preset="fast", thumbnail=100)
+    encoded = encode_timed(image, options)
+    assert encoded.media_type == "image/png"
+    assert encoded.metadata()["width"] == 800
+    thumb = encode_thumbnail(image, options)
+    assert thumb.size == (100, 50)
+
+
+def test_iter_chunks_covers_the_data():
+    data = bytes(range(256)) * 10
+    chunks = list(iter_chunks(data, chunk_size=1000))
+    assert [len(chunk) for chunk in chunks] == [1000, 1000, 560]
+    assert b"".join(chunks) == data
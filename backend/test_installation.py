@@ -68,7 +68,8 @@ def test_components():
     try:
         from face_detection import FaceDetector
         detector = FaceDetector()
-        print("✓ FaceDetector initialized")
+        detector.load()
+        print(f"✓ FaceDetector initialized (backend: {detector.backend.name})")
     except Exception as e:
         print(f"✗ FaceDetector failed: {e}")
         traceback.print_exc()
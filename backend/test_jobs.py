@@ -0,0 +1,190 @@
+"""Tests for the persistent job store, its leases and the job manager"""
+
+import time
+import asyncio
+import pytest
+from jobs import JobStore, JobManager, QueueFullError, QUEUED, RUNNING, COMPLETED, FAILED
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "jobs.sqlite3")
+
+
+@pytest.fixture
+def store(db_path):
+    store = JobStore(db_path)
+    yield store
+    store.close()
+
+
+def _age(store, job_id, seconds):
+    # Backdate a job's last update, as if its lease had not been renewed for `seconds`
+    with store._lock, store._conn:
+        store._conn.execute("UPDATE jobs SET updated_at = ? WHERE id = ?", (time.time() - seconds, job_id))
+
+
+def test_claim_gives_a_job_to_one_worker_only(store, db_path):
+    job_id = store.create(b"photo", "a.jpg")
+    other = JobStore(db_path)  # Another worker process sharing the database
+    try:
+        assert store.claim(job_id)
+        assert not other.claim(job_id)
+        assert not store.claim(job_id)
+    finally:
+        other.close()
+    assert store.get(job_id)["status"] == RUNNING
+
+
+def test_requeue_stale_only_resets_expired_leases(store):
+    stale = store.create(b"photo")
+    live = store.create(b"photo")
+    done = store.create(b"photo")
+    for job_id in (stale, live, done):
+        store.claim(job_id)
+    store.complete(done, b"result", "png")
+    _age(store, stale, 120)
+    _age(store, done, 120)
+
+    assert store.requeue_stale(60) == [stale]
+    assert store.get(stale)["status"] == QUEUED
+    assert store.get(live)["status"] == RUNNING
+    assert store.get(done)["status"] == COMPLETED
+    assert store.claim(stale)
+
+
+def test_touch_renews_the_lease(store):
+    job_id = store.create(b"photo")
+    store.claim(job_id)
+    _age(store, job_id, 120)
+    store.touch(job_id)
+    assert store.requeue_stale(60) == []
+
+
+def test_requeue_interrupted_resets_every_running_job(store):
+    first = store.create(b"photo")
+    second = store.create(b"photo")
+    store.claim(first)
+    store.set_stage(first, "detected")
+    assert store.requeue_interrupted() == [first, second]
+    job = store.get(first)
+    assert job["status"] == QUEUED
+    assert job["stage"] is None
+
+
+def test_result_and_purge(store):
+    job_id = store.create(b"photo")
+    store.claim(job_id)
+    store.complete(job_id, b"result", "webp")
+    assert store.get_result(job_id) == (b"result", "webp")
+    assert store.get_input(job_id) is None
+    assert store.purge(3600) == 0
+    _age(store, job_id, 7200)
+    assert store.purge(3600) == 1
+    assert store.get(job_id) is None
+
+
+async def _wait_for(manager, job_id, statuses, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = await manager.get(job_id)
+        if job["status"] in statuses:
+            return job
+        await asyncio.sleep(0.01)
+    raise AssertionError(f"Job {job_id} did not reach {statuses}")
+
+
+def test_manager_runs_jobs_and_streams_events(db_path):
+    async def runner(contents, on_stage):
+        await on_stage("detected")
+        return contents.upper(), "png"
+
+    async def main():
+        manager = JobManager(JobStore(db_path), runner, workers=1, poll_interval=0.05)
+        await manager.start()
+        try:
+            job_id = await manager.submit(b"photo", "a.jpg")
+            events = [event async for event in manager.events(job_id)]
+            result = await manager.get_result(job_id)
+            return events, result, manager._changed
+        finally:
+            await manager.stop()
+
+    events, result, changed = asyncio.run(main())
+    assert events[-1].startswith(f"event: {COMPLETED}")
+    assert result == (b"PHOTO", "png")
+    assert changed == {}
+
+
+def test_manager_records_failures(db_path):
+    async def runner(contents, on_stage):
+        raise ValueError("No face detected")
+
+    async def main():
+        manager = JobManager(JobStore(db_path), runner, workers=1)
+        await manager.start()
+        try:
+            job_id = await manager.submit(b"photo")
+            return await _wait_for(manager, job_id, (FAILED,))
+        finally:
+            await manager.stop()
+
+    assert asyncio.run(main())["error"] == "No face detected"
+
+
+def test_manager_rejects_submissions_over_capacity(db_path):
+    release = None
+
+    async def runner(contents, on_stage):
+        await release.wait()
+        return b"", "png"
+
+    async def main():
+        nonlocal release
+        release = asyncio.Event()
+        manager = JobManager(JobStore(db_path), runner, workers=1, max_queue=1)
+        await manager.start()
+        try:
+            first = await manager.submit(b"photo")
+            await _wait_for(manager, first, (RUNNING,))
+            await manager.submit(b"photo")
+            with pytest.raises(QueueFullError):
+                await manager.submit(b"photo")
+        finally:
+            release.set()
+            await manager.stop()
+
+    asyncio.run(main())
+
+
+def test_events_subscription_is_dropped_when_the_client_disconnects(db_path):
+    async def main():
+        manager = JobManager(JobStore(db_path), None, poll_interval=0.05)
+        job_id = await asyncio.to_thread(manager.store.create, b"photo")
+        stream = manager.events(job_id)
+        await stream.__anext__()
+        pending = asyncio.ensure_future(stream.__anext__())
+        await asyncio.sleep(0.01)
+        subscribed = len(manager._changed.get(job_id, ()))
+        pending.cancel()
+        await asyncio.gather(pending, return_exceptions=True)
+        await stream.aclose()
+        manager.store.close()
+        return subscribed, manager._changed
+
+    subscribed, changed = asyncio.run(main())
+    assert subscribed == 1
+    assert changed == {}
+
+
+def test_events_for_unknown_job(db_path):
+    async def main():
+        manager = JobManager(JobStore(db_path), None)
+        try:
+            return [event async for event in manager.events("missing")]
+        finally:
+            manager.store.close()
+
+    events = asyncio.run(main())
+    assert len(events) == 1
+    assert events[0].startswith("event: error")
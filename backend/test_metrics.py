@@ -0,0 +1,106 @@
+"""Tests for the in-process metrics and their Prometheus exposition"""
+
+import os
+import json
+from metrics import Registry, track_stage, start_trace, end_trace, STAGE_DURATION
+
+
+def test_counter_renders_labels_and_escapes_values():
+    registry = Registry()
+    requests = registry.counter("requests_total", "Requests", ("endpoint", "status"))
+    requests.inc(endpoint="/personalize", status=200)
+    requests.inc(2, endpoint="/personalize", status=200)
+    requests.inc(endpoint='/odd"path', status=500)
+
+    lines = registry.render().splitlines()
+    assert lines[:2] == ["# HELP requests_total Requests", "# TYPE requests_total counter"]
+    assert 'requests_total{endpoint="/personalize",status="200"} 3' in lines
+    assert 'requests_total{endpoint="/odd\\"path",status="500"} 1' in lines
+
+
+def test_gauge_inc_dec_and_set():
+    registry = Registry()
+    gauge = registry.gauge("in_flight", "In flight", ("stage",))
+    gauge.inc(stage="decode")
+    gauge.inc(stage="decode")
+    gauge.dec(stage="decode")
+    gauge.set(0.5, stage="encoding")
+    assert gauge.snapshot() == {("decode",): 1, ("encoding",): 0.5}
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = Registry()
+    histogram = registry.histogram("latency_seconds", "Latency", ("stage",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 2.0):
+        histogram.observe(value, stage="detection")
+
+    lines = histogram.render()
+    assert lines[1] == "# TYPE latency_seconds histogram"
+    assert lines[2:] == [
+        'latency_seconds_bucket{stage="detection",le="0.1"} 2',
+        'latency_seconds_bucket{stage="detection",le="1.0"} 3',
+        'latency_seconds_bucket{stage="detection",le="+Inf"} 4',
+        'latency_seconds_sum{stage="detection"} 2.65',
+        'latency_seconds_count{stage="detection"} 4',
+    ]
+
+
+def test_histogram_without_labels():
+    registry = Registry()
+    histogram = registry.histogram("size", "Size", (), buckets=(10,))
+    histogram.observe(5)
+    assert histogram.render()[2:] == ['size_bucket{le="10"} 1', 'size_bucket{le="+Inf"} 1', "size_sum 5.0", "size_count 1"]
+
+
+def test_collectors_run_before_render():
+    registry = Registry()
+    gauge = registry.gauge("cache", "Cache", ("stat",))
+    registry.add_collector(lambda: gauge.set(7, stat="hits"))
+    registry.add_collector(lambda: 1 / 0)  # A failing collector must not break the scrape
+    assert 'cache{stat="hits"} 7' in registry.render()
+
+
+def test_track_stage_records_histogram_and_trace():
+    trace, token = start_trace("/personalize")
+    try:
+        before = STAGE_DURATION.snapshot().get(("test_stage",), [[], 0.0, 0])[2]
+        with track_stage("test_stage"):
+            pass
+    finally:
+        end_trace(token)
+    assert STAGE_DURATION.snapshot()[("test_stage",)][2] == before + 1
+    assert "test_stage" in trace.stages
+
+
+def _registry():
+    registry = Registry()
+    counter = registry.counter("jobs_total", "Jobs", ("status",))
+    gauge = registry.gauge("queue_depth", "Queue depth")
+    histogram = registry.histogram("latency_seconds", "Latency", buckets=(1.0,))
+    return registry, counter, gauge, histogram
+
+
+def test_render_multiprocess_merges_worker_snapshots(tmp_path):
+    directory = str(tmp_path)
+    registry, counter, gauge, histogram = _registry()
+    counter.inc(2, status="done")
+    gauge.set(3)
+    histogram.observe(0.5)
+
+    # A worker that has exited: its counters still count, its gauges are dropped
+    dead_pid = 2 ** 22 + 1
+    with open(os.path.join(directory, f"{dead_pid}.json"), "w", encoding="utf-8") as f:
+        json.dump({
+            "jobs_total": [[["done"], 5]],
+            "queue_depth": [[[], 9]],
+            "latency_seconds": [[[], [[0, 1], 4.0, 1]]],
+        }, f)
+
+    lines = registry.render_multiprocess(directory).splitlines()
+    assert 'jobs_total{status="done"} 7' in lines
+    assert f'queue_depth{{worker="{os.getpid()}"}} 3' in lines
+    assert not any(f'worker="{dead_pid}"' in line for line in lines)
+    assert 'latency_seconds_bucket{le="1.0"} 1' in lines
+    assert 'latency_seconds_bucket{le="+Inf"} 2' in lines
+    assert "latency_seconds_count 2" in lines
+    assert os.path.exists(os.path.join(directory, f"{os.getpid()}.json"))
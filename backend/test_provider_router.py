@@ -0,0 +1,147 @@
+"""Tests for latency-aware provider routing and circuit breakers"""
+
+import asyncio
+import pytest
+import provider_router
+from provider_router import CircuitBreaker, ProviderRouter, NoProviderAvailable
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(provider_router.time, "monotonic", fake)
+    return fake
+
+
+def test_breaker_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker(failures=3, cooldown=30.0)
+    breaker.record(False)
+    breaker.record(False)
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.record(True)
+    breaker.record(False)
+    breaker.record(False)
+    assert breaker.state == CircuitBreaker.CLOSED  # The success reset the count
+    breaker.record(False)
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.available()
+    assert not breaker.acquire()
+
+
+def test_breaker_half_open_probe_closes_on_success(clock):
+    breaker = CircuitBreaker(failures=1, cooldown=30.0)
+    breaker.record(False)
+    clock.now += 30.0
+    assert breaker.available()
+    assert breaker.acquire()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    # Only one probe at a time
+    assert not breaker.available()
+    assert not breaker.acquire()
+    breaker.record(True)
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.acquire()
+
+
+def test_breaker_half_open_probe_reopens_on_failure(clock):
+    breaker = CircuitBreaker(failures=3, cooldown=30.0)
+    for _ in range(3):
+        breaker.record(False)
+    clock.now += 31.0
+    assert breaker.acquire()
+    breaker.record(False)
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.acquire()
+    clock.now += 31.0
+    assert breaker.acquire()
+
+
+def test_breaker_release_frees_the_probe(clock):
+    breaker = CircuitBreaker(failures=1, cooldown=10.0)
+    breaker.record(False)
+    clock.now += 10.0
+    assert breaker.acquire()
+    breaker.release()
+    assert breaker.acquire()
+
+
+def _prime(router, name, latency, ok=True, count=5):
+    stats, _ = router._state(name)
+    for _ in range(count):
+        stats.record(latency, ok)
+
+
+def test_rank_keeps_priority_order_without_history():
+    router = ProviderRouter(min_samples=5)
+    assert router.rank(["nim", "huggingface", "replicate"]) == ["nim", "huggingface", "replicate"]
+
+
+def test_rank_orders_measured_providers_by_latency_before_untried():
+    router = ProviderRouter(min_samples=5)
+    _prime(router, "nim", 2.0)
+    _prime(router, "replicate", 0.5)
+    assert router.rank(["nim", "huggingface", "replicate"]) == ["replicate", "nim", "huggingface"]
+
+
+def test_rank_penalizes_error_rate():
+    router = ProviderRouter(min_samples=5, window=20)
+    _prime(router, "nim", 1.0, count=5)
+    _prime(router, "nim", 1.0, ok=False, count=15)  # 75% errors: expected cost 4 s
+    _prime(router, "replicate", 2.0)
+    assert router.rank(["nim", "replicate"]) == ["replicate", "nim"]
+
+
+def test_rank_skips_open_circuits(clock):
+    router = ProviderRouter(breaker_failures=1, breaker_cooldown=30.0)
+    router._state("nim")[1].record(False)
+    assert router.rank(["nim", "replicate"]) == ["replicate"]
+    clock.now += 30.0
+    assert router.rank(["nim", "replicate"]) == ["nim", "replicate"]
+
+
+def test_hedge_after_uses_p95_once_known():
+    router = ProviderRouter(min_samples=5, hedge_delay=30.0, min_hedge_delay=2.0)
+    assert router.hedge_after("nim") == 30.0
+    _prime(router, "nim", 5.0)
+    assert router.hedge_after("nim") == 5.0
+    _prime(router, "fast", 0.1)
+    assert router.hedge_after("fast") == 2.0
+
+
+def test_call_fails_over_to_next_provider():
+    router = ProviderRouter()
+
+    def broken():
+        raise RuntimeError("down")
+
+    result, name = router.call({"nim": broken, "replicate": lambda: "image"})
+    assert (result, name) == ("image", "replicate")
+
+
+def test_call_raises_when_no_provider_is_available(clock):
+    router = ProviderRouter(breaker_failures=1)
+    router._state("nim")[1].record(False)
+    with pytest.raises(NoProviderAvailable):
+        router.call({"nim": lambda: "image"})
+
+
+def test_call_async_hedges_onto_a_faster_provider():
+    router = ProviderRouter(hedge_delay=0.05, min_hedge_delay=0.01)
+
+    async def slow():
+        await asyncio.sleep(1.0)
+        return "slow"
+
+    async def fast():
+        return "fast"
+
+    result, name = asyncio.run(router.call_async({"nim": slow, "replicate": fast}))
+    assert (result, name) == ("fast", "replicate")
@@ -0,0 +1,58 @@
+"""Tests for multi-worker serving helpers"""
+
+import multiprocessing
+import pytest
+import serving
+
+pytestmark = pytest.mark.skipif(serving.fcntl is None, reason="needs fcntl (POSIX)")
+
+
+def _join(lock_path, resets, results, hold):
+    # Runs in a separate process, like a server worker
+    first = serving.join_server(lock_path, reset=lambda: resets.put(1))
+    results.put(first)
+    hold.wait(10)
+
+
+def test_join_server_resets_once_for_concurrent_workers(tmp_path):
+    lock_path = str(tmp_path / "server.lock")
+    context = multiprocessing.get_context("fork")
+    resets, results, hold = context.Queue(), context.Queue(), context.Event()
+    workers = [context.Process(target=_join, args=(lock_path, resets, results, hold)) for _ in range(4)]
+    for worker in workers:
+        worker.start()
+    try:
+        firsts = sorted(results.get(timeout=10) for _ in workers)
+        assert firsts == [False, False, False, True]
+        assert resets.get(timeout=1) == 1
+        assert resets.empty()
+
+        # A worker replacing a recycled one while the others run does not reset
+        late = context.Process(target=_join, args=(lock_path, resets, results, hold))
+        late.start()
+        workers.append(late)
+        assert results.get(timeout=10) is False
+    finally:
+        hold.set()
+        for worker in workers:
+            worker.join(10)
+
+    # Once every worker has exited, the next start resets again
+    restart = context.Process(target=_join, args=(lock_path, resets, results, hold))
+    restart.start()
+    restart.join(10)
+    assert results.get(timeout=1) is True
+
+
+def test_limit_threads_records_the_worker_cap(monkeypatch):
+    monkeypatch.setattr(serving, "_thread_limit", 0)
+    assert serving.thread_limit() == 0
+    serving.limit_threads(2)
+    assert serving.thread_limit() == 2
+
+
+def test_threads_per_worker_splits_cores(monkeypatch):
+    monkeypatch.setattr(serving, "available_cores", lambda: 8)
+    assert serving.threads_per_worker(workers=4, threads=0) == 2
+    assert serving.threads_per_worker(workers=16, threads=0) == 1
+    assert serving.threads_per_worker(workers=4, threads=3) == 3
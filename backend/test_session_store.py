@@ -0,0 +1,116 @@
+"""Tests for the on-disk session artifact store"""
+
+import os
+import time
+import pytest
+from PIL import Image
+from session_store import SessionStore, SessionArtifacts, TMP_PREFIX, TMP_GRACE_SECONDS, FACE_FILE, META_FILE
+
+
+def _artifacts(size=64):
+    return SessionArtifacts(
+        Image.new("RGB", (size, size), (200, 120, 80)),
+        Image.new("RGB", (size, size), (90, 90, 90)),
+        (10, 20, 110, 140),
+        landmarks=[[30, 40], [70, 40], [50, 60], [35, 80], [65, 80]],
+        filename="photo.jpg"
+    )
+
+
+def _set_times(path, created, last_used):
+    os.utime(os.path.join(path, FACE_FILE), (created, created))
+    os.utime(os.path.join(path, META_FILE), (last_used, last_used))
+
+
+def test_save_and_get_round_trip(tmp_path):
+    store = SessionStore(str(tmp_path))
+    token = store.save(_artifacts())
+    artifacts = store.get(token)
+    assert artifacts.bbox == (10, 20, 110, 140)
+    assert artifacts.filename == "photo.jpg"
+    assert artifacts.face.size == (64, 64)
+    assert artifacts.face.getpixel((0, 0)) == (200, 120, 80)
+    assert artifacts.landmarks.shape == (5, 2)
+
+
+@pytest.mark.parametrize("token", ["", "../etc", "a/b", "x" * 65, "tok en", None])
+def test_invalid_tokens_never_name_a_path(tmp_path, token):
+    store = SessionStore(str(tmp_path))
+    assert store.get(token) is None
+    store.delete(token)  # Must not raise or touch anything outside the store
+    assert os.path.isdir(str(tmp_path))
+
+
+def test_unknown_and_deleted_tokens(tmp_path):
+    store = SessionStore(str(tmp_path))
+    assert store.get("unknown-token") is None
+    token = store.save(_artifacts())
+    store.delete(token)
+    assert store.get(token) is None
+
+
+def test_expired_session_is_dropped_on_read(tmp_path, monkeypatch):
+    store = SessionStore(str(tmp_path), ttl=60)
+    token = store.save(_artifacts())
+    now = time.time()
+    monkeypatch.setattr("session_store.time.time", lambda: now + 61)
+    assert store.get(token) is None
+    assert not os.path.exists(os.path.join(str(tmp_path), token))
+
+
+def test_sweep_removes_expired_sessions(tmp_path):
+    store = SessionStore(str(tmp_path), ttl=60)
+    old = store.save(_artifacts())
+    fresh = store.save(_artifacts())
+    now = time.time()
+    _set_times(os.path.join(str(tmp_path), old), now - 120, now - 120)
+    store.sweep()
+    assert not os.path.exists(os.path.join(str(tmp_path), old))
+    assert store.get(fresh) is not None
+
+
+def test_sweep_evicts_least_recently_used_over_size_cap(tmp_path):
+    store = SessionStore(str(tmp_path), sweep_interval=3600)
+    tokens = [store.save(_artifacts()) for _ in range(3)]
+    session_size = sum(entry.stat().st_size for entry in os.scandir(os.path.join(str(tmp_path), tokens[0])))
+
+    now = time.time()
+    # Created in order, but the first session was used most recently
+    for age, token in zip((10, 30, 20), tokens):
+        _set_times(os.path.join(str(tmp_path), token), now - 60, now - age)
+    store.max_bytes = session_size * 2
+    store.sweep()
+
+    remaining = set(os.listdir(str(tmp_path)))
+    assert tokens[1] not in remaining
+    assert {tokens[0], tokens[2]} <= remaining
+
+
+def test_save_sweeps_at_most_every_interval(tmp_path):
+    store = SessionStore(str(tmp_path), max_bytes=0, sweep_interval=3600)
+    first = store.save(_artifacts())  # Sweeps: first save since startup
+    assert not os.path.exists(os.path.join(str(tmp_path), first))
+    second = store.save(_artifacts())  # Within the interval - not swept
+    assert os.path.exists(os.path.join(str(tmp_path), second))
+
+
+def test_sweep_keeps_recent_temporary_directories(tmp_path):
+    store = SessionStore(str(tmp_path))
+    in_progress = tmp_path / f"{TMP_PREFIX}inprogress"
+    leftover = tmp_path / f"{TMP_PREFIX}leftover"
+    in_progress.mkdir()
+    leftover.mkdir()
+    old = time.time() - TMP_GRACE_SECONDS - 1
+    os.utime(str(leftover), (old, old))
+    store.sweep()
+    assert in_progress.exists()
+    assert not leftover.exists()
+
+
+def test_unreadable_session_is_discarded(tmp_path):
+    store = SessionStore(str(tmp_path))
+    token = store.save(_artifacts())
+    with open(os.path.join(str(tmp_path), token, META_FILE), "w", encoding="utf-8") as f:
+        f.write("{not json")
+    assert store.get(token) is None
+    assert not os.path.exists(os.path.join(str(tmp_path), token))
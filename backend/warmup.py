@@ -0,0 +1,161 @@
+"""Background model loading and warm-up, with per-phase timings for the readiness probe"""
+
+import time
+import threading
+import traceback
+
+PENDING = "pending"
+LOADING = "loading"
+WARMING = "warming"
+READY = "ready"
+DISABLED = "disabled"
+FAILED = "failed"
+
+
+class _Component:
+    def __init__(self, name, load, warmup=None, enabled=None, required=True):
+        self.name = name
+        self.load = load
+        self.warmup = warmup
+        self.enabled = enabled
+        self.required = required
+        self.status = PENDING
+        self.load_seconds = None
+        self.warmup_seconds = None
+        self.error = None
+
+    def is_ready(self):
+        if self.status in (READY, DISABLED):
+            return True
+        # Optional components never block readiness once they have given up
+        return self.status == FAILED and not self.required
+
+    def as_dict(self):
+        return {
+            "status": self.status,
+            "required": self.required,
+            "load_seconds": _round(self.load_seconds),
+            "warmup_seconds": _round(self.warmup_seconds),
+            "error": self.error,
+        }
+
+
+class ComponentWarmup:
+    def __init__(self):
+        self._components = []
+        self._lock = threading.Lock()
+        self.started_at = None
+        self.finished_at = None
+
+    def add(self, name, load, warmup=None, enabled=None, required=True):
+        """
+        Register a component
+
+        Args:
+            name: Name reported by the readiness probe
+            load: Callable that loads models / imports heavy dependencies
+            warmup: Optional callable running a dummy inference
+            enabled: Optional callable checked after load; False marks the component disabled
+            required: Whether a failure keeps the service from becoming ready
+        """
+        self._components.append(_Component(name, load, warmup, enabled, required))
+
+    def start(self):
+        """Load and warm up every component in background threads"""
+        self.started_at = time.perf_counter()
+        threads = [
+            threading.Thread(target=self._run, args=(component,), name=f"warmup-{component.name}", daemon=True)
+            for component in self._components
+        ]
+        for thread in threads:
+            thread.start()
+        threading.Thread(target=self._wait, args=(threads,), name="warmup", daemon=True).start()
+
+    def run(self):
+        """Load and warm up every component in the calling thread (e.g. before forking workers)"""
+        self.started_at = time.perf_counter()
+        for component in self._components:
+            self._run(component)
+        self._finish()
+
+    def preload(self):
+        """
+        Run every component's load (not its warm-up) in the calling thread
+
+        Used by the pre-fork server's master process: loaded weights are then
+        shared copy-on-write by the workers, which still run start() to warm
+        up - dummy inferences start thread pools that must not exist before fork().
+        Loads are idempotent, so the workers' own load calls return at once.
+        """
+        for component in self._components:
+            started = time.perf_counter()
+            try:
+                component.load()
+            except Exception as e:
+                # Left to the workers' start(), which retries and reports it on /ready
+                print(f"Preload: {component.name} failed: {e}")
+                continue
+            print(f"Preload: {component.name} loaded in {time.perf_counter() - started:.2f}s")
+
+    @property
+    def ready(self):
+        with self._lock:
+            return all(component.is_ready() for component in self._components)
+
+    def status(self):
+        with self._lock:
+            elapsed = None
+            if self.started_at is not None:
+                end = self.finished_at if self.finished_at is not None else time.perf_counter()
+                elapsed = end - self.started_at
+            return {
+                "ready": all(component.is_ready() for component in self._components),
+                "elapsed_seconds": _round(elapsed),
+                "components": {component.name: component.as_dict() for component in self._components},
+            }
+
+    def _run(self, component):
+        try:
+            self._set(component, status=LOADING)
+            started = time.perf_counter()
+            component.load()
+            self._set(component, load_seconds=time.perf_counter() - started)
+
+            if component.enabled is not None and not component.enabled():
+                self._set(component, status=DISABLED)
+                print(f"Warm-up: {component.name} disabled")
+                return
+
+            if component.warmup is not None:
+                self._set(component, status=WARMING)
+                started = time.perf_counter()
+                component.warmup()
+                self._set(component, warmup_seconds=time.perf_counter() - started)
+
+            self._set(component, status=READY)
+            print(f"Warm-up: {component.name} ready "
+                  f"(load {component.load_seconds:.2f}s, warm-up {component.warmup_seconds or 0:.2f}s)")
+        except Exception as e:
+            self._set(component, status=FAILED, error=str(e))
+            print(f"Warm-up: {component.name} failed: {e}")
+            print(traceback.format_exc())
+
+    def _wait(self, threads):
+        for thread in threads:
+            thread.join()
+        self._finish()
+
+    def _finish(self):
+        with self._lock:
+            self.finished_at = time.perf_counter()
+            elapsed = self.finished_at - self.started_at
+        print(f"Warm-up finished in {elapsed:.2f}s (ready: {self.ready})")
+
+    def _set(self, component, **fields):
+        with self._lock:
+            for key, value in fields.items():
+                setattr(component, key, value)
+
+
+def _round(value):
+    return round(value, 3) if value is not None else None